@@ -18,13 +18,14 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from rpython.rlib import debug, jit, objectmodel, rarithmetic, rweakref
+from rpython.rlib import debug, jit, listsort, objectmodel, rarithmetic, rthread, rweakref
+from rpython.rlib.rstring import StringBuilder
 from rpython.rtyper.lltypesystem import lltype, rffi
 
 NUM_BUILTINS = 41
 
 from Core import *
-import Bytecode, Target, VM
+import Bytecode, Config, Target, VM
 
 
 
@@ -141,6 +142,10 @@ class Con_Boxed_Object(Con_Object):
             self.instance_of = instance_of
         self.slots_map = _EMPTY_MAP
         self.slots = None
+        if Config.COUNTERS and vm.counters is not None:
+            vm.counters.count_alloc(self)
+        if vm.alloc_sites is not None:
+            vm.alloc_sites.record(vm, self)
 
 
     def has_slot(self, vm, n):
@@ -280,7 +285,7 @@ def _Con_Object_find_slot(vm):
     (self, sn_o),_ = vm.decode_args("OS")
     assert isinstance(sn_o, Con_String)
 
-    v = self.find_slot(vm, sn_o.v)
+    v = self.find_slot(vm, sn_o.as_str())
     if not v:
         v = vm.get_builtin(BUILTIN_FAIL_OBJ)
     return v
@@ -291,7 +296,7 @@ def _Con_Object_get_slot(vm):
     (self, sn_o),_ = vm.decode_args("OS")
     assert isinstance(sn_o, Con_String)
 
-    return self.get_slot(vm, sn_o.v)
+    return self.get_slot(vm, sn_o.as_str())
 
 
 @con_object_proc
@@ -450,7 +455,8 @@ class Con_Class(Con_Boxed_Object):
         # its subclasses need to be regenerated. To force this, every class a "version" which is
         # incremented whenever its fields are changed. As well as changing the class itself, all
         # subclasses must be changed too. We maintain a list of all subclasses (even indirect ones!)
-        # to do this.
+        # to do this. set_field never releases the GIL, so other threads can never see a class whose
+        # fields and version are out of step.
         
         self.version = Version()
         self.dependents = []
@@ -529,7 +535,7 @@ def _Con_Class_new(vm):
     _, v = vm.decode_args(vargs=True)
     c = type_check_class(vm, v[0])
     if c.new_func is None:
-        p = type_check_string(vm, vm.get_slot_apply(c, "path")).v
+        p = type_check_string(vm, vm.get_slot_apply(c, "path")).as_str()
         msg = "Instance of %s has no new_func." % p
         vm.raise_helper("VM_Exception", [Con_String(vm, msg)])
     return vm.apply(c.new_func, v)
@@ -541,7 +547,7 @@ def _Con_Class_get_field(vm):
     assert isinstance(self, Con_Class)
     assert isinstance(n, Con_String)
 
-    o = self.find_field(vm, n.v)
+    o = self.find_field(vm, n.as_str())
     if o is None:
         vm.raise_helper("Field_Exception", [n, self])
 
@@ -553,7 +559,7 @@ def _Con_Class_set_field(vm):
     (self, n, o),_ = vm.decode_args("CSO")
     assert isinstance(self, Con_Class)
     assert isinstance(n, Con_String)
-    self.set_field(vm, n.v, o)
+    self.set_field(vm, n.as_str(), o)
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -564,7 +570,7 @@ def _Con_Class_path(vm):
     assert isinstance(self, Con_Class)
     
     name = type_check_string(vm, self.get_slot(vm, "name"))
-    if name.v == "":
+    if name.as_str() == "":
         name = Con_String(vm, "<anon>")
 
     container = self.get_slot(vm, "container")
@@ -578,7 +584,7 @@ def _Con_Class_path(vm):
             sep = "::"
         else:
             sep = "."
-        return Con_String(vm, "%s%s%s" % (rtn.v, sep, name.v))
+        return Con_String(vm, "%s%s%s" % (rtn.as_str(), sep, name.as_str()))
 
 
 @con_object_proc
@@ -587,7 +593,7 @@ def _Con_Class_to_str(vm):
     assert isinstance(self, Con_Class)
 
     nm = type_check_string(vm, self.get_slot(vm, "name"))
-    return Con_String(vm, "<Class %s>" % nm.v)
+    return Con_String(vm, "<Class %s>" % nm.as_str())
 
 
 @con_object_proc
@@ -660,7 +666,7 @@ def bootstrap_con_class(vm):
 
 class Con_Module(Con_Boxed_Object):
     __slots__ = ("is_bc", "bc", "id_", "src_path", "imps", "tlvars_map", "consts",
-      "init_func", "values", "closure", "initialized")
+      "init_func", "values", "closure", "initialized", "importer", "import_lock")
     _immutable_fields_ = ("is_bc", "bc", "name", "id_", "src_path", "imps", "tlvars_map",
       "init_func", "consts")
 
@@ -693,12 +699,52 @@ class Con_Module(Con_Boxed_Object):
         self.set_slot(vm, "container", vm.get_builtin(BUILTIN_NULL_OBJ))
 
         self.initialized = False
+        self.importer = -1 # The ident of the thread running this module's init function, or -1.
+        self.import_lock = None # Held by the importer thread; allocated on first import.
 
 
     def import_(self, vm):
         if self.initialized:
             return
-        
+
+        me = rthread.get_or_make_ident()
+        if self.importer == me:
+            # A recursive import of a module whose init function this thread is already running
+            # gets the partially initialised module.
+            return
+
+        while self.importer != -1:
+            # Another thread is part way through initialising this module. If that thread is
+            # (perhaps indirectly) waiting for a module this thread is initialising, waiting for it
+            # would deadlock, so this thread gets the partially initialised module, just as a
+            # recursive import does. Otherwise this thread blocks (releasing the GIL) until the
+            # other thread has finished. If that fails, this thread then tries to initialise the
+            # module itself.
+            if _import_would_deadlock(self, me):
+                return
+            lock = self.import_lock
+            assert lock is not None
+            _import_waits[me] = self
+            try:
+                lock.acquire(True)
+            finally:
+                del _import_waits[me]
+            lock.release()
+            if self.initialized:
+                return
+
+        if self.import_lock is None:
+            self.import_lock = rthread.allocate_lock()
+        self.importer = me
+        self.import_lock.acquire(True)
+        try:
+            self._import(vm)
+        finally:
+            self.importer = -1
+            self.import_lock.release()
+
+
+    def _import(self, vm):
         if self.is_bc:
             # Bytecode modules use the old "push a Con_Int onto the stack to signify how many
             # parameters are being passed" hack. To add insult injury, they simply pop this object
@@ -721,12 +767,18 @@ class Con_Module(Con_Boxed_Object):
     def get_defn(self, vm, n):
         i = self.get_closure_i(vm, n)
         if i == -1:
-            name = type_check_string(vm, self.get_slot(vm, "name")).v
+            name = type_check_string(vm, self.get_slot(vm, "name")).as_str()
             vm.raise_helper("Mod_Defn_Exception", \
               [Builtins.Con_String(vm, "No such definition '%s' in '%s'." % (n, name))])
-        o = self.closure.vars[i]
+        closure = self.closure
+        if closure is None:
+            # A bytecode module only has a closure once its init function has finished, so a
+            # partially initialised module (see import_) has no definitions assigned yet.
+            o = None
+        else:
+            o = closure.vars[i]
         if o is None:
-            name = type_check_string(vm, self.get_slot(vm, "name")).v
+            name = type_check_string(vm, self.get_slot(vm, "name")).as_str()
             vm.raise_helper("Mod_Defn_Exception", \
               [Builtins.Con_String(vm, "Definition '%s' unassigned in '%s'." % (n, name))])
 
@@ -743,10 +795,15 @@ class Con_Module(Con_Boxed_Object):
     def set_defn(self, vm, n, o):
         i = self.get_closure_i(vm, n)
         if i == -1:
-            name = type_check_string(vm, self.get_slot(vm, "name")).v
+            name = type_check_string(vm, self.get_slot(vm, "name")).as_str()
             vm.raise_helper("Mod_Defn_Exception", \
               [Builtins.Con_String(vm, "No such definition '%s' in '%s'." % (n, name))])
-        self.closure.vars[i] = o
+        closure = self.closure
+        if closure is None:
+            name = type_check_string(vm, self.get_slot(vm, "name")).as_str()
+            vm.raise_helper("Mod_Defn_Exception", \
+              [Builtins.Con_String(vm, "Module '%s' is not yet initialised." % name)])
+        closure.vars[i] = o
 
 
     @jit.elidable_promote("0")
@@ -800,6 +857,8 @@ class Con_Module(Con_Boxed_Object):
                 cur_bc_off += Target.align(start + size)
             elif it == Target.CON_INSTR_VAR_LOOKUP \
               or it == Target.CON_INSTR_VAR_ASSIGN \
+              or it == Target.CON_INSTR_VAR_LOOKUP_LOCAL \
+              or it == Target.CON_INSTR_VAR_ASSIGN_LOCAL \
               or it == Target.CON_INSTR_ADD_FAILURE_FRAME \
               or it == Target.CON_INSTR_ADD_FAIL_UP_FRAME \
               or it == Target.CON_INSTR_REMOVE_FAILURE_FRAME \
@@ -879,12 +938,41 @@ class Con_Module(Con_Boxed_Object):
         return Con_List(vm, src_infos)
 
 
+    def src_offset_to_line_column(self, off):
+        # Returns a tuple (line, column) for the source offset 'off', or (-1, -1) if 'off' is
+        # beyond the end of the module's source.
+        bc = self.bc
+        newlines_off = Target.read_word(bc, Target.BC_MOD_NEWLINES)
+        for i in range(Target.read_word(bc, Target.BC_MOD_NUM_NEWLINES)):
+            if off < Target.read_word(bc, newlines_off + i * Target.INTSIZE):
+                return i, off - Target.read_word(bc, newlines_off + (i - 1) * Target.INTSIZE)
+
+        return -1, -1
+
+
+# Maps the ident of each thread blocked in Con_Module.import_ to the module it is waiting for.
+_import_waits = {}
+
+def _import_would_deadlock(mod, me):
+    # Would thread 'me' waiting for 'mod' create a cycle of threads each waiting for another's
+    # import? The chain of waits can't be longer than the number of waiting threads.
+    t = mod.importer
+    for _ in range(len(_import_waits) + 1):
+        if t == me:
+            return True
+        waiting_for = _import_waits.get(t, None)
+        if waiting_for is None:
+            return False
+        t = waiting_for.importer
+    return False
+
+
 @con_object_proc
 def _new_func_Con_Module(vm):
     (class_, bc_o), vargs = vm.decode_args("CS", vargs=True)
     assert isinstance(bc_o, Con_String)
     
-    bc = rffi.str2charp(bc_o.v)
+    bc = rffi.str2charp(bc_o.as_str())
     mod = Bytecode.mk_mod(vm, bc, 0)
     return mod
 
@@ -895,7 +983,7 @@ def _Con_Module_get_defn(vm):
     assert isinstance(self, Con_Module)
     assert isinstance(n, Con_String)
 
-    return self.get_defn(vm, n.v)
+    return self.get_defn(vm, n.as_str())
 
 
 @con_object_proc
@@ -904,7 +992,7 @@ def _Con_Module_has_defn(vm):
     assert isinstance(self, Con_Module)
     assert isinstance(n, Con_String)
 
-    if self.has_defn(vm, n.v):
+    if self.has_defn(vm, n.as_str()):
         r_o = vm.get_builtin(BUILTIN_NULL_OBJ)
     else:
         r_o = vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -918,7 +1006,7 @@ def _Con_Module_set_defn(vm):
     assert isinstance(self, Con_Module)
     assert isinstance(n, Con_String)
 
-    self.set_defn(vm, n.v, o)
+    self.set_defn(vm, n.as_str(), o)
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
@@ -962,7 +1050,7 @@ def _Con_Module_path(vm):
             sep = "::"
         else:
             sep = "."
-        return Con_String(vm, "%s%s%s" % (rtn.v, sep, name.v))
+        return Con_String(vm, "%s%s%s" % (rtn.as_str(), sep, name.as_str()))
 
 
 @con_object_proc
@@ -975,14 +1063,11 @@ def _Con_Module_src_offset_to_line_column(vm):
     if off < 0:
         raise Exception("XXX")
 
-    bc = self.bc
-    newlines_off = Target.read_word(bc, Target.BC_MOD_NEWLINES)
-    for i in range(Target.read_word(bc, Target.BC_MOD_NUM_NEWLINES)):
-        if off < Target.read_word(bc, newlines_off + i * Target.INTSIZE):
-            return Con_List(vm, [Con_Int(vm, i), Con_Int(vm, off - \
-              Target.read_word(bc, newlines_off + (i - 1) * Target.INTSIZE))])
-    
-    raise Exception("XXX")
+    line, col = self.src_offset_to_line_column(off)
+    if line == -1:
+        raise Exception("XXX")
+
+    return Con_List(vm, [Con_Int(vm, line), Con_Int(vm, col)])
     
 
 
@@ -1029,13 +1114,13 @@ def new_bc_con_module(vm, bc, name, id_, src_path, imps, tlvars_map, num_consts)
 
 class Con_Func(Con_Boxed_Object):
     __slots__ = ("name", "is_bound", "pc", "max_stack_size", "num_vars", 
-                 "container_closure", "stack_count", "has_loop")
+                 "container_closure", "stack_count", "has_loop", "frame_vars")
     _immutable_fields_ = ("name", "is_bound", "pc", "max_stack_size",
-                 "num_vars", "container_closure", "has_loop")
+                 "num_vars", "container_closure", "has_loop", "frame_vars")
 
 
     def __init__(self, vm, name, is_bound, pc, max_stack_size, num_params, num_vars, container, \
-      container_closure, instance_of=None, has_loop=0):
+      container_closure, instance_of=None, has_loop=0, frame_vars=0):
         if instance_of is None:
             instance_of = vm.get_builtin(BUILTIN_FUNC_CLASS)
         Con_Boxed_Object.__init__(self, vm, instance_of)
@@ -1048,6 +1133,9 @@ class Con_Func(Con_Boxed_Object):
         self.container_closure = container_closure
         self.stack_count = 0
         self.has_loop = has_loop
+        # If frame_vars is set, the function's variables live in its continuation frame rather than
+        # in a closure of their own (see Stack_Continuation_Frame.localsp).
+        self.frame_vars = frame_vars
         
         self.set_slot(vm, "container", container)
         self.set_slot(vm, "name", name)
@@ -1055,7 +1143,7 @@ class Con_Func(Con_Boxed_Object):
 
 
     def __repr__(self):
-        return "<Func %s>" % self.name.v
+        return "<Func %s>" % self.name.as_str()
 
 
 @con_object_proc
@@ -1077,7 +1165,7 @@ def _Con_Func_path(vm):
             sep = "."
         name = self.name
         assert isinstance(name, Con_String)
-        return Con_String(vm, "%s%s%s" % (rtn.v, sep, name.v))
+        return Con_String(vm, "%s%s%s" % (rtn.as_str(), sep, name.as_str()))
 
 
 def bootstrap_con_func(vm):
@@ -1126,7 +1214,7 @@ class Con_Partial_Application(Con_Boxed_Object):
 
 
     def __repr__(self):
-        return "<Partial_Application %s>" % self.f.name.v
+        return "<Partial_Application %s>" % self.f.name.as_str()
 
 
 
@@ -1331,11 +1419,12 @@ def _new_func_Con_Int(vm):
         return o_o
     elif isinstance(o_o, Con_String):
         v = None
+        s = o_o.as_str()
         try:
-            if o_o.v.startswith("0x") or o_o.v.startswith("0X"):
-                v = int(o_o.v[2:], 16)
+            if s.startswith("0x") or s.startswith("0X"):
+                v = int(s[2:], 16)
             else:
-                v = int(o_o.v)
+                v = int(s)
         except ValueError:
             vm.raise_helper("Number_Exception", [o_o])
         return Con_Int(vm, v)
@@ -1543,7 +1632,7 @@ def _Con_Int_str_val(vm):
     if v < 0 or v > 255:
         vm.raise_helper("Number_Exception", [Con_String(vm, "'%d' out of ASCII range." % v)])
 
-    return Con_String(vm, chr(v))
+    return new_con_string_char(vm, chr(v))
 
 
 @con_object_proc
@@ -1728,7 +1817,7 @@ def _new_func_Con_Float(vm):
     elif isinstance(o_o, Con_String):
         v = None
         try:
-            v = float(o_o.v)
+            v = float(o_o.as_str())
         except ValueError:
             vm.raise_helper("Number_Exception", [o_o])
         return Con_Float(vm, v)
@@ -1778,57 +1867,170 @@ def bootstrap_con_float(vm):
 # Con_String
 #
 
+# Strings can share the buffer of the string they were sliced from (with _off and _len saying which
+# part of _s is this string's), which makes slicing O(1). Slices no longer than SLICE_COPY_MAX are
+# always copied, since sharing buys nothing. A slice of a string longer than SLICE_SHARE_MIN is also
+# copied if it is less than 1/SLICE_SHARE_FRAC of its parent, so that small slices don't keep huge
+# parents alive.
+
+SLICE_COPY_MAX = 32
+SLICE_SHARE_MIN = 65536
+SLICE_SHARE_FRAC = 8
+
+
 class Con_String(Con_Boxed_Object):
-    __slots__ = ("v",)
-    _immutable_fields_ = ("v",)
+    __slots__ = ("_s", "_off", "_len")
+    _immutable_fields_ = ("_s", "_off", "_len")
 
 
-    def __init__(self, vm, v):
+    def __init__(self, vm, s, off=0, len_=-1):
         Con_Boxed_Object.__init__(self, vm, vm.get_builtin(BUILTIN_STRING_CLASS))
-        assert v is not None
-        self.v = v
+        assert s is not None
+        self._s = s
+        self._off = off
+        if len_ == -1:
+            len_ = len(s)
+        self._len = len_
+
+
+    def as_str(self):
+        s = self._s
+        if self._off == 0 and self._len == len(s):
+            return s
+        # Materialise the slice. The copy isn't cached: doing so would keep both it and the parent
+        # alive. Comparisons and concatenation work on the shared buffer instead, so that most
+        # slices never need to be materialised.
+        off = self._off
+        end = off + self._len
+        assert off >= 0 and end >= 0
+        return s[off : end]
+
+
+    def cmp(self, o):
+        # Returns -1, 0 or 1 as this string is less than, equal to, or greater than the Con_String o,
+        # without materialising either.
+        s = self._s
+        os = o._s
+        if self._off == 0 and self._len == len(s) and o._off == 0 and o._len == len(os):
+            if s == os:
+                return 0
+            elif s < os:
+                return -1
+            return 1
+        i = self._off
+        j = o._off
+        n = min(self._len, o._len)
+        for k in range(n):
+            c = s[i + k]
+            oc = os[j + k]
+            if c != oc:
+                if c < oc:
+                    return -1
+                return 1
+        if self._len < o._len:
+            return -1
+        elif self._len > o._len:
+            return 1
+        return 0
+
+
+    def get_char(self, i):
+        return self._s[self._off + i]
+
+
+    def find_off(self, o, i, j):
+        # Returns the offset (relative to this string) of the first occurrence of the string o in
+        # [i, j) or -1.
+        off = self._off
+        start = off + i
+        end = off + j
+        assert start >= 0 and end >= 0
+        r = self._s.find(o, start, end)
+        if r == -1:
+            return -1
+        return r - off
+
+
+    def rfind_off(self, o, i, j):
+        off = self._off
+        start = off + i
+        end = off + j
+        assert start >= 0 and end >= 0
+        r = self._s.rfind(o, start, end)
+        if r == -1:
+            return -1
+        return r - off
 
 
     def add(self, vm, o):
         o = type_check_string(vm, o)
-        return Con_String(vm, self.v + o.v)
+        return concat_con_strings(vm, self, o)
 
 
     def eq(self, vm, o):
         if isinstance(o, Con_String):
-            return self.v == o.v
+            return self._len == o._len and self.cmp(o) == 0
         return False
 
 
     def neq(self, vm, o):
         if isinstance(o, Con_String):
-            return self.v != o.v
+            return self._len != o._len or self.cmp(o) != 0
         return True
 
 
     def le(self, vm, o):
         o = type_check_string(vm, o)
-        return self.v < o.v
+        return self.cmp(o) < 0
 
 
     def le_eq(self, vm, o):
         o = type_check_string(vm, o)
-        return self.v <= o.v
+        return self.cmp(o) <= 0
 
 
     def gr_eq(self, vm, o):
         o = type_check_string(vm, o)
-        return self.v >= o.v
+        return self.cmp(o) >= 0
 
 
     def gt(self, vm, o):
         o = type_check_string(vm, o)
-        return self.v > o.v
+        return self.cmp(o) > 0
 
 
     def get_slice(self, vm, i, j):
-        i, j = translate_slice_idxs(vm, i, j, len(self.v))
-        return Con_String(vm, self.v[i:j])
+        i, j = translate_slice_idxs(vm, i, j, self._len)
+        return new_con_string_slice(vm, self, i, j)
+
+
+def new_con_string_slice(vm, s_o, i, j):
+    # Returns the slice [i, j) of the Con_String s_o. i and j must already have been translated.
+    assert 0 <= i <= j <= s_o._len
+    len_ = j - i
+    assert len_ >= 0
+    if len_ == s_o._len:
+        return s_o
+    elif len_ == 1:
+        return new_con_string_char(vm, s_o.get_char(i))
+
+    s = s_o._s
+    off = s_o._off + i
+    if len_ <= SLICE_COPY_MAX or (len(s) > SLICE_SHARE_MIN and len_ * SLICE_SHARE_FRAC < len(s)):
+        return Con_String(vm, s[off : off + len_])
+    return Con_String(vm, s, off, len_)
+
+
+def concat_con_strings(vm, s_o, o_o):
+    # Returns the concatenation of the Con_Strings s_o and o_o, copying straight from their buffers.
+    b = StringBuilder(s_o._len + o_o._len)
+    b.append_slice(s_o._s, s_o._off, s_o._off + s_o._len)
+    b.append_slice(o_o._s, o_o._off, o_o._off + o_o._len)
+    return Con_String(vm, b.build())
+
+
+def new_con_string_char(vm, c):
+    return vm.char_strs[ord(c)]
 
 
 @con_object_proc
@@ -1837,7 +2039,7 @@ def _Con_String_add(vm):
     assert isinstance(self, Con_String)
     assert isinstance(o_o, Con_String)
     
-    return Con_String(vm, self.v + o_o.v)
+    return concat_con_strings(vm, self, o_o)
 
 
 @con_object_proc
@@ -1846,7 +2048,7 @@ def _Con_String_eq(vm):
     assert isinstance(self, Con_String)
     
     if isinstance(o_o, Con_String):
-        if self.v == o_o.v:
+        if self.eq(vm, o_o):
             return vm.get_builtin(BUILTIN_NULL_OBJ)
     return vm.get_builtin(BUILTIN_FAIL_OBJ)
 
@@ -1857,12 +2059,11 @@ def _Con_String_find(vm):
     assert isinstance(self, Con_String)
     assert isinstance(o_o, Con_String)
 
-    v = self.v
-    o = o_o.v
-    o_len = len(o)
-    for i in range(0, len(v) - o_len + 1):
-        if v[i:i+o_len] == o:
-            yield o_o
+    o = o_o.as_str()
+    i = self.find_off(o, 0, self._len)
+    while i != -1:
+        yield o_o
+        i = self.find_off(o, i + 1, self._len)
 
 
 @con_object_gen
@@ -1871,12 +2072,11 @@ def _Con_String_find_index(vm):
     assert isinstance(self, Con_String)
     assert isinstance(o_o, Con_String)
 
-    v = self.v
-    o = o_o.v
-    o_len = len(o)
-    for i in range(0, len(v) - o_len + 1):
-        if v[i:i+o_len] == o:
-            yield Con_Int(vm, i)
+    o = o_o.as_str()
+    i = self.find_off(o, 0, self._len)
+    while i != -1:
+        yield Con_Int(vm, i)
+        i = self.find_off(o, i + 1, self._len)
 
 
 @con_object_proc
@@ -1885,7 +2085,9 @@ def _Con_String_get(vm):
     assert isinstance(self, Con_String)
     assert isinstance(i_o, Con_Int)
 
-    return Con_String(vm, self.v[i_o.v])
+    i = translate_idx(vm, i_o.v, self._len)
+
+    return new_con_string_char(vm, self.get_char(i))
 
 
 @con_object_proc
@@ -1893,9 +2095,9 @@ def _Con_String_get_slice(vm):
     (self, i_o, j_o),_ = vm.decode_args("S", opt="ii")
     assert isinstance(self, Con_String)
 
-    i, j = translate_slice_idx_objs(vm, i_o, j_o, len(self.v))
+    i, j = translate_slice_idx_objs(vm, i_o, j_o, self._len)
 
-    return Con_String(vm, self.v[i:j])
+    return new_con_string_slice(vm, self, i, j)
 
 
 @con_object_proc
@@ -1903,7 +2105,7 @@ def _Con_String_hash(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
 
-    return Con_Int(vm, objectmodel.compute_hash(self.v))
+    return Con_Int(vm, objectmodel.compute_hash(self.as_str()))
 
 
 @con_object_proc
@@ -1913,11 +2115,11 @@ def _Con_String_int_val(vm):
 
     if i_o is not None:
         assert isinstance(i_o, Con_Int)
-        i = translate_idx(vm, i_o.v, len(self.v))
+        i = translate_idx(vm, i_o.v, self._len)
     else:
-        i = translate_idx(vm, 0, len(self.v))
+        i = translate_idx(vm, 0, self._len)
 
-    return Con_Int(vm, ord(self.v[i]))
+    return Con_Int(vm, ord(self.get_char(i)))
 
 
 @con_object_gen
@@ -1925,9 +2127,9 @@ def _Con_String_iter(vm):
     (self, i_o, j_o),_ = vm.decode_args("S", opt="ii")
     assert isinstance(self, Con_String)
     
-    i, j = translate_slice_idx_objs(vm, i_o, j_o, len(self.v))
+    i, j = translate_slice_idx_objs(vm, i_o, j_o, self._len)
     while i < j:
-        yield Con_String(vm, self.v[i])
+        yield new_con_string_char(vm, self.get_char(i))
         i += 1
 
 
@@ -1936,7 +2138,7 @@ def _Con_String_len(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
 
-    return Con_Int(vm, len(self.v))
+    return Con_Int(vm, self._len)
 
 
 @con_object_proc
@@ -1944,7 +2146,7 @@ def _Con_String_lower_cased(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
     
-    return Con_String(vm, self.v.lower())
+    return Con_String(vm, self.as_str().lower())
 
 
 @con_object_proc
@@ -1952,15 +2154,14 @@ def _Con_String_lstripped(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
     
-    v = self.v
-    v_len = len(v)
+    v_len = self._len
     i = 0
     while i < v_len:
-        if v[i] not in " \t\n\r":
+        if self.get_char(i) not in " \t\n\r":
             break
         i += 1
 
-    return Con_String(vm, self.v[i:])
+    return new_con_string_slice(vm, self, i, v_len)
 
 
 @con_object_proc
@@ -1969,7 +2170,7 @@ def _Con_String_mul(vm):
     assert isinstance(self, Con_String)
     assert isinstance(i_o, Con_Int)
     
-    return Con_String(vm, self.v * i_o.v)
+    return Con_String(vm, self.as_str() * i_o.v)
 
 
 @con_object_proc
@@ -1978,7 +2179,7 @@ def _Con_String_neq(vm):
     assert isinstance(self, Con_String)
 
     if isinstance(o_o, Con_String):
-        if self.v != o_o.v:
+        if self.neq(vm, o_o):
             return vm.get_builtin(BUILTIN_NULL_OBJ)
         else:
             return vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -1991,9 +2192,10 @@ def _Con_String_prefixed_by(vm):
     assert isinstance(self, Con_String)
     assert isinstance(o_o, Con_String)
 
-    i = translate_slice_idx_obj(vm, i_o, len(self.v))
+    i = translate_slice_idx_obj(vm, i_o, self._len)
 
-    if self.v[i:].startswith(o_o.v):
+    o_len = o_o._len
+    if i + o_len <= self._len and self.find_off(o_o.as_str(), i, i + o_len) == i:
         return vm.get_builtin(BUILTIN_NULL_OBJ)
     else:
         return vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -2005,12 +2207,15 @@ def _Con_String_rfind_index(vm):
     assert isinstance(self, Con_String)
     assert isinstance(o_o, Con_String)
 
-    v = self.v
-    o = o_o.v
-    o_len = len(o)
-    for i in range(len(v) - o_len, -1, -1):
-        if v[i:i+o_len] == o:
-            yield Con_Int(vm, i)
+    o = o_o.as_str()
+    o_len = o_o._len
+    j = self._len
+    while j >= o_len:
+        i = self.rfind_off(o, 0, j)
+        if i == -1:
+            break
+        yield Con_Int(vm, i)
+        j = i + o_len - 1
 
 
 @con_object_proc
@@ -2020,25 +2225,27 @@ def _Con_String_replaced(vm):
     assert isinstance(old_o, Con_String)
     assert isinstance(new_o, Con_String)
 
-    v = self.v
+    v = self.as_str()
     v_len = len(v)
-    old = old_o.v
+    old = old_o.as_str()
     old_len = len(old)
-    new = new_o.v
-    out = []
-    i = 0
-    while i < v_len:
-        j = v.find(old, i)
-        if j == -1:
-            break
-        assert j >= i
-        out.append(v[i:j])
-        out.append(new)
-        i = j + old_len
-    if i < v_len:
-        out.append(v[i:])
-
-    return Con_String(vm, "".join(out))
+    if old_len == 0:
+        vm.raise_helper("Parameters_Exception", [Con_String(vm, "Empty old string.")])
+    new = new_o.as_str()
+    i = v.find(old, 0, v_len)
+    if i == -1:
+        return self
+    b = StringBuilder(v_len)
+    j = 0
+    while i != -1:
+        b.append_slice(v, j, i)
+        b.append(new)
+        j = i + old_len
+        assert j >= 0
+        i = v.find(old, j, v_len)
+    b.append_slice(v, j, v_len)
+
+    return Con_String(vm, b.build())
 
 
 @con_object_proc
@@ -2047,7 +2254,21 @@ def _Con_String_split(vm):
     assert isinstance(self, Con_String)
     assert isinstance(o_o, Con_String)
 
-    return Con_List(vm, [Con_String(vm, x) for x in self.v.split(o_o.v)])
+    o = o_o.as_str()
+    o_len = o_o._len
+    if o_len == 0:
+        vm.raise_helper("Parameters_Exception", [Con_String(vm, "Empty separator.")])
+    out = []
+    i = 0
+    while True:
+        j = self.find_off(o, i, self._len)
+        if j == -1:
+            break
+        out.append(new_con_string_slice(vm, self, i, j))
+        i = j + o_len
+    out.append(new_con_string_slice(vm, self, i, self._len))
+
+    return Con_List(vm, out)
 
 
 @con_object_proc
@@ -2055,22 +2276,21 @@ def _Con_String_stripped(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
 
-    v = self.v
-    v_len = len(v)
+    v_len = self._len
     i = 0
     while i < v_len:
-        if v[i] not in " \t\n\r":
+        if self.get_char(i) not in " \t\n\r":
             break
         i += 1
     j = v_len - 1
     while j >= i:
-        if v[j] not in " \t\n\r":
+        if self.get_char(j) not in " \t\n\r":
             break
         j -= 1
     j += 1
 
     assert j >= i
-    return Con_String(vm, self.v[i:j])
+    return new_con_string_slice(vm, self, i, j)
 
 
 @con_object_proc
@@ -2080,11 +2300,12 @@ def _Con_String_suffixed_by(vm):
     assert isinstance(o_o, Con_String)
 
     if i_o is None:
-        i = len(self.v)
+        i = self._len
     else:
-        i = translate_slice_idx_obj(vm, i_o, len(self.v))
+        i = translate_slice_idx_obj(vm, i_o, self._len)
 
-    if self.v[:i].endswith(o_o.v):
+    o_len = o_o._len
+    if o_len <= i and self.find_off(o_o.as_str(), i - o_len, i) == i - o_len:
         return vm.get_builtin(BUILTIN_NULL_OBJ)
     else:
         return vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -2095,7 +2316,7 @@ def _Con_String_to_str(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
 
-    return Con_String(vm, '"%s"' % self.v)
+    return Con_String(vm, '"%s"' % self.as_str())
 
 
 @con_object_proc
@@ -2103,13 +2324,15 @@ def _Con_String_upper_cased(vm):
     (self,),_ = vm.decode_args("S")
     assert isinstance(self, Con_String)
     
-    return Con_String(vm, self.v.upper())
+    return Con_String(vm, self.as_str().upper())
 
 
 def bootstrap_con_string(vm):
     string_class = vm.get_builtin(BUILTIN_STRING_CLASS)
     assert isinstance(string_class, Con_Class)
 
+    vm.char_strs = [Con_String(vm, chr(i)) for i in range(256)]
+
     new_c_con_func_for_class(vm, "+", _Con_String_add, string_class)
     new_c_con_func_for_class(vm, "==", _Con_String_eq, string_class)
     new_c_con_func_for_class(vm, "find", _Con_String_find, string_class)
@@ -2447,6 +2670,22 @@ def _Con_List_set_slice(vm):
     return vm.get_builtin(Builtins.BUILTIN_NULL_OBJ)
 
 
+@con_object_proc
+def _Con_List_sort(vm):
+    (self, key_o, cmp_o, reverse_o),_ = vm.decode_args("L", opt="ooi")
+    assert isinstance(self, Con_List)
+
+    # Key and comparison functions can mutate the list, so a copy is sorted and then copied back.
+    l = self.l[:]
+    sort_objs(vm, l, key_o, cmp_o, reverse_o is not None and type_check_int(vm, reverse_o).v != 0)
+    if len(l) != len(self.l):
+        vm.raise_helper("VM_Exception", [Con_String(vm, "List modified during sort.")])
+    for i in range(len(l)):
+        self.l[i] = l[i]
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
 @con_object_proc
 def _Con_List_to_str(vm):
     (self,),_ = vm.decode_args("L")
@@ -2455,7 +2694,7 @@ def _Con_List_to_str(vm):
     es = []
     for e in self.l:
         s = type_check_string(vm, vm.get_slot_apply(e, "to_str"))
-        es.append(s.v)
+        es.append(s.as_str())
 
     return Con_String(vm, "[%s]" % ", ".join(es))
 
@@ -2489,10 +2728,130 @@ def bootstrap_con_list(vm):
     new_c_con_func_for_class(vm, "riter", _Con_List_riter, list_class)
     new_c_con_func_for_class(vm, "set", _Con_List_set, list_class)
     new_c_con_func_for_class(vm, "set_slice", _Con_List_set_slice, list_class)
+    new_c_con_func_for_class(vm, "sort", _Con_List_sort, list_class)
     new_c_con_func_for_class(vm, "to_str", _Con_List_to_str, list_class)
 
 
 
+################################################################################
+# Sorting
+#
+
+# These are used by List.sort and Array.sort. All are stable timsorts; the default ordering is
+# that of "<", with fast paths for lists containing only Ints, only Floats, or only Strings.
+
+def _lt_int(a, b):
+    assert isinstance(a, Con_Int) and isinstance(b, Con_Int)
+    return a.v < b.v
+
+def _lt_float(a, b):
+    assert isinstance(a, Con_Float) and isinstance(b, Con_Float)
+    return a.v < b.v
+
+def _lt_string(a, b):
+    assert isinstance(a, Con_String) and isinstance(b, Con_String)
+    return a.cmp(b) < 0
+
+_Int_Sort = listsort.make_timsort_class(lt=_lt_int)
+_Float_Sort = listsort.make_timsort_class(lt=_lt_float)
+_String_Sort = listsort.make_timsort_class(lt=_lt_string)
+
+_Object_Sort_Base = listsort.make_timsort_class()
+
+class _Object_Sort(_Object_Sort_Base):
+    def __init__(self, vm, l):
+        _Object_Sort_Base.__init__(self, l)
+        self.vm = vm
+
+    def lt(self, a, b):
+        return a.le(self.vm, b)
+
+
+_Cmp_Sort_Base = listsort.make_timsort_class()
+
+class _Cmp_Sort(_Cmp_Sort_Base):
+    def __init__(self, vm, l, cmp_o):
+        _Cmp_Sort_Base.__init__(self, l)
+        self.vm = vm
+        self.cmp_o = cmp_o
+
+    def lt(self, a, b):
+        if self.vm.apply(self.cmp_o, [a, b], allow_fail=True):
+            return True
+        else:
+            return False
+
+
+class _Keyed(object):
+    __slots__ = ("k", "o")
+
+    def __init__(self, k, o):
+        self.k = k
+        self.o = o
+
+_Keyed_Sort_Base = listsort.make_timsort_class()
+
+class _Keyed_Sort(_Keyed_Sort_Base):
+    def __init__(self, vm, l, cmp_o):
+        _Keyed_Sort_Base.__init__(self, l)
+        self.vm = vm
+        self.cmp_o = cmp_o
+
+    def lt(self, a, b):
+        if self.cmp_o is None:
+            return a.k.le(self.vm, b.k)
+        elif self.vm.apply(self.cmp_o, [a.k, b.k], allow_fail=True):
+            return True
+        else:
+            return False
+
+
+def sort_objs(vm, l, key_o, cmp_o, reverse):
+    # Sort the RPython list of objects l in place. If key_o is not None, it is a function which is
+    # called once per element to produce the value that is compared. If cmp_o is not None, it is a
+    # function which succeeds if its first argument is to be sorted before its second.
+
+    if reverse:
+        # Reversing before and after the sort keeps equal elements in their original order.
+        l.reverse()
+
+    if key_o is not None:
+        kl = [_Keyed(vm.apply(key_o, [o]), o) for o in l]
+        _Keyed_Sort(vm, kl, cmp_o).sort()
+        for i in range(len(kl)):
+            l[i] = kl[i].o
+    elif cmp_o is not None:
+        _Cmp_Sort(vm, l, cmp_o).sort()
+    elif len(l) > 0:
+        if isinstance(l[0], Con_Int):
+            for o in l:
+                if not isinstance(o, Con_Int):
+                    _Object_Sort(vm, l).sort()
+                    break
+            else:
+                _Int_Sort(l).sort()
+        elif isinstance(l[0], Con_Float):
+            for o in l:
+                if not isinstance(o, Con_Float):
+                    _Object_Sort(vm, l).sort()
+                    break
+            else:
+                _Float_Sort(l).sort()
+        elif isinstance(l[0], Con_String):
+            for o in l:
+                if not isinstance(o, Con_String):
+                    _Object_Sort(vm, l).sort()
+                    break
+            else:
+                _String_Sort(l).sort()
+        else:
+            _Object_Sort(vm, l).sort()
+
+    if reverse:
+        l.reverse()
+
+
+
 ################################################################################
 # Con_Set
 #
@@ -2623,7 +2982,7 @@ def _Con_Set_to_str(vm):
     es = []
     for e in self.s.keys():
         s = type_check_string(vm, vm.get_slot_apply(e, "to_str"))
-        es.append(s.v)
+        es.append(s.as_str())
 
     return Con_String(vm, "Set{%s}" % ", ".join(es))
 
@@ -2793,7 +3152,7 @@ def _Con_Dict_to_str(vm):
     for k, v in self.d.items():
         ks = type_check_string(vm, vm.get_slot_apply(k, "to_str"))
         vs = type_check_string(vm, vm.get_slot_apply(v, "to_str"))
-        es.append("%s : %s" % (ks.v, vs.v))
+        es.append("%s : %s" % (ks.as_str(), vs.as_str()))
 
     return Con_String(vm, "Dict{%s}" % ", ".join(es))
 
@@ -2869,7 +3228,7 @@ def _Con_Exception_to_str(vm):
     (self,),_ = vm.decode_args("E")
     ex_name = type_check_string(vm, self.get_slot(vm, "instance_of").get_slot(vm, "name"))
     msg = type_check_string(vm, self.get_slot(vm, "msg"))
-    return Con_String(vm, "%s: %s" % (ex_name.v, msg.v))
+    return Con_String(vm, "%s: %s" % (ex_name.as_str(), msg.as_str()))
 
 
 def bootstrap_con_exception(vm):
@@ -28,6 +28,10 @@ import Builtins
 
 
 
+# Modules from before version 1 of the module format don't record the maximum stack size of their
+# init function, so they get one which is hopefully large enough.
+DEFAULT_INIT_MAX_STACK_SIZE = 512
+
 
 @jit.elidable_promote()
 def _extract_sstr(bc, soff, ssize):
@@ -107,7 +111,10 @@ def mk_mod(vm, bc, mod_off):
     mod = Builtins.new_bc_con_module(vm, mod_bc, name, id_, src_path, imps, tlvars_map, num_consts)
     init_func_off = read_word(mod_bc, BC_MOD_INSTRUCTIONS)
     pc = BC_PC(mod, init_func_off)
-    max_stack_size = 512 # XXX!
+    if read_word(mod_bc, BC_MOD_VERSION) >= 1:
+        max_stack_size = read_word(mod_bc, BC_MOD_INIT_MAX_STACK_SIZE)
+    else:
+        max_stack_size = DEFAULT_INIT_MAX_STACK_SIZE
     mod.init_func = Builtins.Con_Func(vm, Builtins.Con_String(vm, "$$init$$"), False, pc, \
       max_stack_size, 0, num_vars, mod, None)
     
@@ -0,0 +1,200 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+from rpython.rlib import jit, listsort
+
+import Builtins, Target
+
+
+
+
+################################################################################################
+# Interpreter counters
+#
+# When counting is enabled (converge --stats), the VM records the instructions it executes and
+# the frames, exceptions and objects it creates. Counting is only compiled into VMs configured
+# with --enable-counters: every counting site is guarded by the translation-time constant
+# Config.COUNTERS, so in other VMs RPython removes them entirely. Even when compiled in, the VM
+# only has a Counters object when --stats is given; VM.counters is quasi-immutable, so when it is
+# None the JIT removes the checks for it from traces.
+#
+
+# The classes whose allocations are counted. Instances of any other Con_Boxed_Object subclass
+# are counted as "Object".
+ALLOC_NAMES = ["Class", "Dict", "Exception", "Float", "Func", "Int", "List", "Module", "Object",
+  "Partial_Application", "Set", "String"]
+ALLOC_CLASS = 0
+ALLOC_DICT = 1
+ALLOC_EXCEPTION = 2
+ALLOC_FLOAT = 3
+ALLOC_FUNC = 4
+ALLOC_INT = 5
+ALLOC_LIST = 6
+ALLOC_MODULE = 7
+ALLOC_OBJECT = 8
+ALLOC_PARTIAL_APPLICATION = 9
+ALLOC_SET = 10
+ALLOC_STRING = 11
+
+
+class Counters(object):
+    __slots__ = ("instrs", "mod_instrs", "cont_frames", "fail_frames", "gen_frames",
+      "exceptions", "allocs")
+
+    def __init__(self):
+        self.instrs = [0] * len(Target.INSTR_NAMES) # Indexed by instruction type
+        self.mod_instrs = {} # Module ID -> number of instructions executed
+        self.cont_frames = 0
+        self.fail_frames = 0
+        self.gen_frames = 0
+        self.exceptions = 0
+        self.allocs = [0] * len(ALLOC_NAMES) # Indexed by ALLOC_*
+
+
+    @jit.dont_look_inside
+    def count_instr(self, mod, it):
+        self.instrs[it] += 1
+        self.mod_instrs[mod.id_] = self.mod_instrs.get(mod.id_, 0) + 1
+
+
+    @jit.dont_look_inside
+    def count_alloc(self, o):
+        if isinstance(o, Builtins.Con_Int):
+            i = ALLOC_INT
+        elif isinstance(o, Builtins.Con_String):
+            i = ALLOC_STRING
+        elif isinstance(o, Builtins.Con_List):
+            i = ALLOC_LIST
+        elif isinstance(o, Builtins.Con_Float):
+            i = ALLOC_FLOAT
+        elif isinstance(o, Builtins.Con_Dict):
+            i = ALLOC_DICT
+        elif isinstance(o, Builtins.Con_Set):
+            i = ALLOC_SET
+        elif isinstance(o, Builtins.Con_Func):
+            i = ALLOC_FUNC
+        elif isinstance(o, Builtins.Con_Partial_Application):
+            i = ALLOC_PARTIAL_APPLICATION
+        elif isinstance(o, Builtins.Con_Exception):
+            i = ALLOC_EXCEPTION
+        elif isinstance(o, Builtins.Con_Class):
+            i = ALLOC_CLASS
+        elif isinstance(o, Builtins.Con_Module):
+            i = ALLOC_MODULE
+        else:
+            i = ALLOC_OBJECT
+        self.allocs[i] += 1
+
+
+    def to_dict(self, vm):
+        instrs = []
+        for i in range(len(Target.INSTR_NAMES)):
+            if self.instrs[i] > 0:
+                instrs.append(Builtins.Con_String(vm, Target.INSTR_NAMES[i]))
+                instrs.append(Builtins.Con_Int(vm, self.instrs[i]))
+
+        mod_instrs = []
+        for mod_id, n in self.mod_instrs.items():
+            mod_instrs.append(Builtins.Con_String(vm, mod_id))
+            mod_instrs.append(Builtins.Con_Int(vm, n))
+
+        allocs = []
+        for i in range(len(ALLOC_NAMES)):
+            allocs.append(Builtins.Con_String(vm, ALLOC_NAMES[i]))
+            allocs.append(Builtins.Con_Int(vm, self.allocs[i]))
+
+        return Builtins.Con_Dict(vm, [
+          Builtins.Con_String(vm, "instructions"), Builtins.Con_Dict(vm, instrs),
+          Builtins.Con_String(vm, "module_instructions"), Builtins.Con_Dict(vm, mod_instrs),
+          Builtins.Con_String(vm, "continuation_frames"), Builtins.Con_Int(vm, self.cont_frames),
+          Builtins.Con_String(vm, "failure_frames"), Builtins.Con_Int(vm, self.fail_frames),
+          Builtins.Con_String(vm, "generator_frames"), Builtins.Con_Int(vm, self.gen_frames),
+          Builtins.Con_String(vm, "exceptions"), Builtins.Con_Int(vm, self.exceptions),
+          Builtins.Con_String(vm, "allocations"), Builtins.Con_Dict(vm, allocs)])
+
+
+    def summary(self):
+        # Returns a human readable summary of the counters.
+        buf = ["VM statistics:\n"]
+        buf.append("  Continuation frames: %d\n" % self.cont_frames)
+        buf.append("  Failure frames: %d\n" % self.fail_frames)
+        buf.append("  Generator frames: %d\n" % self.gen_frames)
+        buf.append("  Exceptions raised: %d\n" % self.exceptions)
+
+        total = 0
+        instrs = []
+        for i in range(len(Target.INSTR_NAMES)):
+            if self.instrs[i] > 0:
+                total += self.instrs[i]
+                instrs.append((self.instrs[i], Target.INSTR_NAMES[i]))
+        buf.append("Instructions executed: %d\n" % total)
+        _Count_Sort(instrs).sort()
+        for n, name in instrs:
+            buf.append("  %s %s %s\n" % (_ljust(name, 24), _rjust(str(n), 12), _percent(n, total)))
+
+        buf.append("Instructions executed per module:\n")
+        mod_instrs = []
+        for mod_id, n in self.mod_instrs.items():
+            mod_instrs.append((n, mod_id))
+        _Count_Sort(mod_instrs).sort()
+        for n, mod_id in mod_instrs:
+            buf.append("  %s %s %s\n" % (_ljust(mod_id, 48), _rjust(str(n), 12), \
+              _percent(n, total)))
+
+        buf.append("Allocations:\n")
+        allocs = []
+        for i in range(len(ALLOC_NAMES)):
+            allocs.append((self.allocs[i], ALLOC_NAMES[i]))
+        _Count_Sort(allocs).sort()
+        for n, name in allocs:
+            buf.append("  %s %s\n" % (_ljust(name, 24), _rjust(str(n), 12)))
+
+        return "".join(buf)
+
+
+
+# RPython's string formatting doesn't support field widths, hence the following.
+
+def _percent(n, total):
+    # Returns n as a percentage of total, to one decimal place, right justified.
+    if total == 0:
+        t = 0
+    else:
+        t = n * 1000 // total
+    return _rjust("%d.%d%%" % (t // 10, t % 10), 6)
+
+
+def _ljust(s, w):
+    if len(s) >= w:
+        return s
+    return s + " " * (w - len(s))
+
+
+def _rjust(s, w):
+    if len(s) >= w:
+        return s
+    return " " * (w - len(s)) + s
+
+
+def _gt_count(a, b):
+    return a[0] > b[0]
+
+_Count_Sort = listsort.make_timsort_class(lt=_gt_count)
@@ -0,0 +1,316 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+
+import time
+from rpython.rlib import jit, listsort, rgc
+
+from Core import *
+import Builtins, Profiler
+
+
+
+
+################################################################################################
+# Raw memory
+#
+# Objects which own raw (i.e. non-GC) memory, such as an Array's buffer, subclass Raw_Memory so
+# that heap censuses and VM::gc_stats can report that memory, which the GC itself knows nothing
+# about. Subclasses call own when they acquire memory and disown when they free it, and override
+# RAW_KIND with a short description of what the memory is.
+#
+
+class Raw_Memory(object):
+    __slots__ = ("size",)
+    RAW_KIND = "Raw memory"
+
+    def own(self, size, pressure):
+        # Record that this object owns size bytes of raw memory. If pressure is True, the memory is
+        # also reported to the GC, so that it collects (and thus frees the memory) sooner.
+        self.size = size
+        gc_stats.raw_bytes += size
+        if pressure:
+            rgc.add_memory_pressure(size)
+
+
+    def disown(self):
+        gc_stats.raw_bytes -= self.size
+        self.size = 0
+
+
+
+################################################################################################
+# Heap census
+#
+# A census walks every object reachable from the GC's roots and counts, for each Converge class,
+# the number of instances on the heap and the number of bytes they occupy. Only an object's own
+# memory is counted against its class: the RPython lists, strings and so on that an object refers
+# to (e.g. a List's elements) are counted separately as "RPython objects". Raw memory owned by
+# Raw_Memory objects is counted separately too, by kind. Censuses are only possible with GCs
+# which can enumerate the heap (i.e. not Boehm).
+#
+
+class Census_Stats(object):
+    __slots__ = ("objs", "bytes")
+
+    def __init__(self):
+        self.objs = 0
+        self.bytes = 0
+
+
+class Census(object):
+    __slots__ = ("classes", "raw", "rpython")
+
+    def __init__(self):
+        self.classes = {} # Con_Class -> Census_Stats
+        self.raw = {} # Raw_Memory.RAW_KIND -> Census_Stats
+        self.rpython = Census_Stats()
+
+
+    @jit.dont_look_inside
+    def take(self):
+        # Walk the heap, returning False if the GC can't enumerate it. This uses the same
+        # approach as rgc.do_get_objects, but doesn't build a list of every object on the heap.
+        roots = rgc.get_rpy_roots()
+        if roots is None or not rgc.has_gcflag_extra():
+            return False
+        roots = [gcref for gcref in roots if gcref]
+        pending = roots[:]
+        while len(pending) > 0:
+            gcref = pending.pop()
+            if rgc.get_gcflag_extra(gcref):
+                continue
+            rgc.toggle_gcflag_extra(gcref)
+            self._count(gcref)
+            pending.extend(rgc.get_rpy_referents(gcref))
+        rgc.clear_gcflag_extra(roots)
+        rgc.assert_no_more_gcflags()
+        return True
+
+
+    def _count(self, gcref):
+        size = rgc.get_rpy_memory_usage(gcref)
+        o = rgc.try_cast_gcref_to_instance(Builtins.Con_Boxed_Object, gcref)
+        if o is not None:
+            cls = o.instance_of
+            cs = self.classes.get(cls, None)
+            if cs is None:
+                cs = self.classes[cls] = Census_Stats()
+        else:
+            cs = self.rpython
+            r = rgc.try_cast_gcref_to_instance(Raw_Memory, gcref)
+            if r is not None:
+                rs = self.raw.get(r.RAW_KIND, None)
+                if rs is None:
+                    rs = self.raw[r.RAW_KIND] = Census_Stats()
+                rs.objs += 1
+                rs.bytes += r.size
+        cs.objs += 1
+        cs.bytes += size
+
+
+    def write(self, vm, path):
+        # Write out the census to path. Raises OSError on failure.
+        buf = ["# Converge heap census. Columns are: bytes, objects, name.\n", "[classes]\n"]
+        entries = []
+        for cls, cs in self.classes.items():
+            entries.append((cs.bytes, cs.objs, _class_name(vm, cls)))
+        _write_entries(buf, entries)
+
+        buf.append("[rpython]\n")
+        _write_entries(buf, [(self.rpython.bytes, self.rpython.objs, "RPython objects")])
+
+        buf.append("[raw]\n")
+        entries = []
+        for kind, rs in self.raw.items():
+            entries.append((rs.bytes, rs.objs, kind))
+        _write_entries(buf, entries)
+
+        alloc_sites = vm.alloc_sites
+        if alloc_sites is not None:
+            buf.append("[allocation sites]\n")
+            entries = []
+            for cls, sites in alloc_sites.resolve(vm).items():
+                name = _class_name(vm, cls)
+                for loc, n in sites.items():
+                    entries.append((0, n, "%s %s" % (name, loc)))
+            _Census_Sort(entries).sort()
+            for _, n, name in entries:
+                buf.append("%d %s\n" % (n, name))
+
+        Profiler.write_file(path, "".join(buf))
+
+
+def _class_name(vm, cls):
+    return Builtins.type_check_string(vm, cls.get_slot(vm, "name")).as_str()
+
+
+def _write_entries(buf, entries):
+    _Census_Sort(entries).sort()
+    for b, n, name in entries:
+        buf.append("%d %d %s\n" % (b, n, name))
+
+
+def _census_lt(a, b):
+    # Sort by bytes, then number of objects, largest first.
+    return a[0] > b[0] or (a[0] == b[0] and a[1] > b[1])
+
+_Census_Sort = listsort.make_timsort_class(lt=_census_lt)
+
+
+
+################################################################################################
+# Allocation sites
+#
+# When allocation site tracking is enabled (see VM::start_alloc_sites), the VM records, for each
+# instance of a tracked class that it creates, the module and bytecode offset of the innermost
+# bytecode function then executing. Offsets are only converted to source locations when results
+# are requested. When tracking is not enabled, VM.alloc_sites is None; since that field is
+# quasi-immutable, the JIT removes the check entirely from traces.
+#
+# The VM tells Alloc_Sites its position before executing each instruction, and whenever a frame
+# returns. Allocations can't simply walk the stack to find their position, because objects are
+# allocated by elidable functions (e.g. Con_Module.get_const), which must not read frames.
+#
+
+class Alloc_Sites(object):
+    __slots__ = ("sites", "mod_id", "bc_off")
+
+    def __init__(self, classes):
+        # Con_Class -> {(module ID, bytecode offset) -> number of allocations}
+        self.sites = {}
+        for cls in classes:
+            self.sites[cls] = {}
+        self.mod_id = ""
+        self.bc_off = -1
+
+
+    def at(self, mod, bc_off):
+        # Called by the VM before it executes the instruction at bc_off in mod.
+        self.mod_id = mod.id_
+        self.bc_off = bc_off
+
+
+    @jit.dont_look_inside
+    def resume(self, cf):
+        # Called by the VM when it returns to cf.
+        while cf is not None:
+            pc = cf.pc
+            if isinstance(pc, BC_PC):
+                self.mod_id = pc.mod.id_
+                self.bc_off = cf.bc_off
+                return
+            cf = cf.parent
+        self.mod_id = ""
+        self.bc_off = -1
+
+
+    @jit.dont_look_inside
+    def record(self, vm, o):
+        sites = self.sites.get(o.instance_of, None)
+        if sites is None:
+            return
+        key = (self.mod_id, self.bc_off)
+        sites[key] = sites.get(key, 0) + 1
+
+
+    def resolve(self, vm):
+        # Returns a dictionary Con_Class -> {"path:line" -> number of allocations}.
+        rsites = {}
+        for cls, sites in self.sites.items():
+            locs = {}
+            for key, n in sites.items():
+                mod_id, bc_off = key
+                mod = vm.find_mod(mod_id)
+                if mod is None or not mod.is_bc:
+                    loc = "<unknown>"
+                else:
+                    loc = Profiler.src_location(vm, mod, bc_off)
+                locs[loc] = locs.get(loc, 0) + n
+            rsites[cls] = locs
+        return rsites
+
+
+    def to_dict(self, vm):
+        entries = []
+        for cls, locs in self.resolve(vm).items():
+            locs_entries = []
+            for loc, n in locs.items():
+                locs_entries.append(Builtins.Con_String(vm, loc))
+                locs_entries.append(Builtins.Con_Int(vm, n))
+            entries.append(cls.get_slot(vm, "name"))
+            entries.append(Builtins.Con_Dict(vm, locs_entries))
+        return Builtins.Con_Dict(vm, entries)
+
+
+
+################################################################################################
+# GC statistics
+#
+# Newer versions of RPython can report the GC's own statistics via rgc.get_stats; with older
+# versions, VM::gc_stats can only report the figures the VM itself records.
+#
+
+HAVE_GET_STATS = hasattr(rgc, "get_stats")
+HAVE_GC_TIME = hasattr(rgc, "TOTAL_GC_TIME")
+
+
+class GC_Stats(object):
+    __slots__ = ("collections", "collect_time", "raw_bytes")
+
+    def __init__(self):
+        self.collections = 0 # Collections forced by VM::collect
+        self.collect_time = 0.0 # Seconds spent in collections forced by VM::collect
+        self.raw_bytes = 0 # Raw memory currently owned by Raw_Memory objects
+
+
+    @jit.dont_look_inside
+    def collect(self):
+        start = time.time()
+        rgc.collect()
+        self.collect_time += time.time() - start
+        self.collections += 1
+
+
+    def to_dict(self, vm):
+        entries = [
+          Builtins.Con_String(vm, "forced_collections"), Builtins.Con_Int(vm, self.collections),
+          Builtins.Con_String(vm, "forced_collection_time"), \
+            Builtins.Con_Float(vm, self.collect_time),
+          Builtins.Con_String(vm, "raw_memory"), Builtins.Con_Int(vm, self.raw_bytes)]
+        if HAVE_GET_STATS:
+            entries.extend([
+              Builtins.Con_String(vm, "heap_size"), _stat(vm, rgc.TOTAL_MEMORY),
+              Builtins.Con_String(vm, "peak_heap_size"), _stat(vm, rgc.PEAK_MEMORY),
+              Builtins.Con_String(vm, "nursery_size"), _stat(vm, rgc.NURSERY_SIZE),
+              Builtins.Con_String(vm, "memory_pressure"), _stat(vm, rgc.TOTAL_MEMORY_PRESSURE)])
+            if HAVE_GC_TIME:
+                # TOTAL_GC_TIME is in milliseconds.
+                entries.append(Builtins.Con_String(vm, "gc_time"))
+                entries.append(Builtins.Con_Float(vm, rgc.get_stats(rgc.TOTAL_GC_TIME) / 1000.0))
+        return Builtins.Con_Dict(vm, entries)
+
+gc_stats = GC_Stats()
+
+
+@jit.dont_look_inside
+def _stat(vm, stat):
+    return Builtins.Con_Int(vm, rgc.get_stats(stat))
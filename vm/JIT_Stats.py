@@ -0,0 +1,175 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+from rpython.rlib import jit, jit_hooks
+from rpython.rlib.jit import Counters
+from rpython.rlib.objectmodel import specialize
+from rpython.rlib.rstring import assert_str0
+from rpython.rtyper.annlowlevel import cast_base_ptr_to_instance
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rtyper.rclass import OBJECTPTR
+
+import Builtins, VM
+
+
+
+
+################################################################################################
+# JIT statistics
+#
+# The JIT calls JIT_Hooks (via main.jitpolicy) whenever it compiles a loop or bridge, or aborts
+# a trace; these are recorded in jit_stats per location, where a location is the text
+# VM.get_printable_location returns for a loop's green key. Bridges are attributed to the
+# location of the loop they are attached to, so a location which accumulates many bridges is one
+# whose guards keep failing. Global counts and timings come from the JIT's own profiler.
+#
+# The hooks are annotated after the rest of the VM has been rtyped, so they cannot change the
+# types the annotator has already inferred for jit_stats. jit_stats is therefore prebuilt with
+# two dummy locations whose keys and counts differ, so that none of them are seen as constants.
+# The dummy locations are never reported.
+#
+
+# Set by main.target to whether the VM is being translated with the JIT. The jit_hooks stats
+# functions are only meaningful if it is.
+HAVE_JIT = False
+
+# Abort reasons, as reported in VM::jit_stats.
+ABORTS = [("too_long", Counters.ABORT_TOO_LONG), ("bridge", Counters.ABORT_BRIDGE),
+  ("bad_loop", Counters.ABORT_BAD_LOOP), ("escape", Counters.ABORT_ESCAPE),
+  ("force_quasiimmut", Counters.ABORT_FORCE_QUASIIMMUT)]
+
+
+DUMMY_LOCS = ["<dummy 0>", "<dummy 1>"]
+
+
+class Location_Stats(object):
+    __slots__ = ("loops", "bridges", "aborts")
+
+    def __init__(self, n):
+        self.loops = n
+        self.bridges = n
+        self.aborts = n
+
+
+class JIT_Stats(object):
+    __slots__ = ("locs", "loop_locs")
+
+    def __init__(self):
+        self.locs = {} # Location -> Location_Stats
+        self.loop_locs = {} # Loop token number -> Location_Stats
+        for i in range(len(DUMMY_LOCS)):
+            ls = Location_Stats(i)
+            self.locs[DUMMY_LOCS[i]] = ls
+            self.loop_locs[-1 - i] = ls
+
+
+    def to_dict(self, vm):
+        # Returns a Con_Dict of the JIT's statistics, or fails if the VM doesn't have a JIT.
+        if not HAVE_JIT:
+            return None
+
+        aborts = []
+        for name, counter in ABORTS:
+            aborts.append(Builtins.Con_String(vm, name))
+            aborts.append(Builtins.Con_Int(vm, jit_hooks.stats_get_counter_value(None, counter)))
+
+        locs = []
+        for loc, ls in self.locs.items():
+            if loc in DUMMY_LOCS:
+                continue
+            locs.append(Builtins.Con_String(vm, loc))
+            locs.append(Builtins.Con_Dict(vm, [
+              Builtins.Con_String(vm, "loops"), Builtins.Con_Int(vm, ls.loops),
+              Builtins.Con_String(vm, "bridges"), Builtins.Con_Int(vm, ls.bridges),
+              Builtins.Con_String(vm, "aborts"), Builtins.Con_Int(vm, ls.aborts)]))
+
+        return Builtins.Con_Dict(vm, [
+          Builtins.Con_String(vm, "loops"), _counter(vm, Counters.TOTAL_COMPILED_LOOPS),
+          Builtins.Con_String(vm, "bridges"), _counter(vm, Counters.TOTAL_COMPILED_BRIDGES),
+          Builtins.Con_String(vm, "freed_loops"), _counter(vm, Counters.TOTAL_FREED_LOOPS),
+          Builtins.Con_String(vm, "freed_bridges"), _counter(vm, Counters.TOTAL_FREED_BRIDGES),
+          Builtins.Con_String(vm, "traces"), _counter(vm, Counters.TRACING),
+          Builtins.Con_String(vm, "tracing_time"), _time(vm, Counters.TRACING),
+          Builtins.Con_String(vm, "backend_time"), _time(vm, Counters.BACKEND),
+          Builtins.Con_String(vm, "aborts"), Builtins.Con_Dict(vm, aborts),
+          Builtins.Con_String(vm, "locations"), Builtins.Con_Dict(vm, locs)])
+
+jit_stats = JIT_Stats()
+
+
+def _counter(vm, counter):
+    return Builtins.Con_Int(vm, jit_hooks.stats_get_counter_value(None, counter))
+
+
+def _time(vm, counter):
+    return Builtins.Con_Float(vm, jit_hooks.stats_get_times_value(None, counter))
+
+
+
+class JIT_Hooks(jit.JitHookInterface):
+    # Note that the single instance of this class must not be referenced from normal VM code;
+    # state is kept in jit_stats instead.
+
+    def on_abort(self, reason, jitdriver, greenkey, greenkey_repr, logops, operations):
+        _get_loc(_loc(greenkey)).aborts += 1
+
+
+    def after_compile(self, debug_info):
+        ls = _get_loc(_loc(debug_info.greenkey))
+        ls.loops += 1
+        jit_stats.loop_locs[debug_info.looptoken.number] = ls
+
+
+    def after_compile_bridge(self, debug_info):
+        n = debug_info.looptoken.number
+        if n in jit_stats.loop_locs:
+            jit_stats.loop_locs[n].bridges += 1
+
+jit_hooks_iface = JIT_Hooks()
+
+
+# Each hook is annotated separately, so the helpers they share must not be shared graphs. Nor can
+# they be methods of JIT_Stats, which has been rtyped by the time the hooks are annotated.
+
+@specialize.call_location()
+def _get_loc(loc):
+    # Note that jit_stats.locs.get(loc, None) would make the dictionary's values nullable.
+    if loc in jit_stats.locs:
+        return jit_stats.locs[loc]
+    ls = Location_Stats(0)
+    jit_stats.locs[loc] = ls
+    return ls
+
+
+@specialize.call_location()
+def _loc(greenkey):
+    # Returns the location of greenkey. The greenkey_repr the JIT passes to hooks is only the
+    # location if debug prints are enabled (e.g. via PYPYLOG), so the location is recreated here.
+    if greenkey is None:
+        return "<unknown>"
+    bc_off = greenkey[0].getint()
+    mod_bc = rffi.cast(rffi.CCHARP, greenkey[1].getint()) # Raw pointers are integer greens
+    pc = cast_base_ptr_to_instance(VM.BC_PC, \
+      lltype.cast_opaque_ptr(OBJECTPTR, greenkey[2].getref_base()))
+    vm = cast_base_ptr_to_instance(VM.VM, \
+      lltype.cast_opaque_ptr(OBJECTPTR, greenkey[3].getref_base()))
+    assert pc is not None and vm is not None
+    return assert_str0(VM.get_printable_location(bc_off, mod_bc, pc, vm))
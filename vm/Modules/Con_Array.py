@@ -19,29 +19,56 @@
 # IN THE SOFTWARE.
 
 
-import sys
+import math, os, sys
+from rpython.rlib import listsort, rgc, rposix
+from rpython.rlib.rarithmetic import intmask, r_ulonglong
+from rpython.rlib.rfloat import INFINITY
+from rpython.rlib.rstruct import ieee
+from rpython.rlib.rstring import StringBuilder
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rtyper.tool import rffi_platform as platform
 from rpython.translator.tool.cbuild import ExternalCompilationInfo
 from Builtins import *
 from Core import *
+import Heap
 
 
 
 DEFAULT_ENTRIES_ALLOC = 256
 
 
-eci         = ExternalCompilationInfo(includes=["string.h"])
+eci         = ExternalCompilationInfo(includes=["string.h", "sys/types.h", "sys/mman.h"])
 memmove     = rffi.llexternal("memmove", [rffi.CCHARP, rffi.CCHARP, rffi.SIZE_T], rffi.CCHARP, compilation_info=eci)
+mmap        = rffi.llexternal("mmap", [rffi.CCHARP, rffi.SIZE_T, rffi.INT, rffi.INT, rffi.INT, \
+                rffi.LONG], rffi.CCHARP, compilation_info=eci, save_err=rffi.RFFI_SAVE_ERRNO)
+msync       = rffi.llexternal("msync", [rffi.CCHARP, rffi.SIZE_T, rffi.INT], rffi.INT, \
+                compilation_info=eci, releasegil=False, save_err=rffi.RFFI_SAVE_ERRNO)
+# _Mmap_Buffer's light finalizer can't save errno (which uses thread-local storage), and ignores
+# msync's result anyway.
+msync_del   = rffi.llexternal("msync", [rffi.CCHARP, rffi.SIZE_T, rffi.INT], rffi.INT, \
+                compilation_info=eci, releasegil=False)
+munmap      = rffi.llexternal("munmap", [rffi.CCHARP, rffi.SIZE_T], rffi.INT, compilation_info=eci, \
+                releasegil=False)
 class CConfig:
     _compilation_info_ = eci
+    MAP_ANON           = platform.DefinedConstantInteger("MAP_ANON")
+    MAP_SHARED         = platform.DefinedConstantInteger("MAP_SHARED")
+    MS_SYNC            = platform.DefinedConstantInteger("MS_SYNC")
+    PROT_READ          = platform.DefinedConstantInteger("PROT_READ")
+    PROT_WRITE         = platform.DefinedConstantInteger("PROT_WRITE")
 cconfig = platform.configure(CConfig)
 
+MAP_ANON   = cconfig["MAP_ANON"]
+MAP_SHARED = cconfig["MAP_SHARED"]
+MS_SYNC    = cconfig["MS_SYNC"]
+PROT_READ  = cconfig["PROT_READ"]
+PROT_WRITE = cconfig["PROT_WRITE"]
+
 
 
 def init(vm):
     return new_c_con_module(vm, "Array", "Array", __file__, import_, \
-      ["Array_Exception", "Array"])
+      ["Array_Exception", "Array", "arange", "map_file", "shared"])
 
 
 @con_object_proc
@@ -56,6 +83,9 @@ def import_(vm):
     mod.set_defn(vm, "Array_Exception", array_exception)
 
     bootstrap_array_class(vm, mod)
+    new_c_con_func_for_mod(vm, "arange", arange, mod)
+    new_c_con_func_for_mod(vm, "map_file", map_file, mod)
+    new_c_con_func_for_mod(vm, "shared", shared, mod)
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -68,66 +98,142 @@ def import_(vm):
 TYPE_I32 = 0
 TYPE_I64 = 1
 TYPE_F   = 2
+TYPE_U8  = 3
+TYPE_I8  = 4
+TYPE_U16 = 5
+TYPE_I16 = 6
+TYPE_U32 = 7
+TYPE_F32 = 8
+
+_ENDIAN_NATIVE = 0
+_ENDIAN_BIG    = 1
+_ENDIAN_LITTLE = 2
+
+# Maps each type name to (type, size in bytes, endianness). Every type larger than a byte also has
+# explicitly big and little endian variants (e.g. "u16be" and "u16le").
+
+_TYPES = {}
+for _name, _type, _size in [("u8", TYPE_U8, 1), ("i8", TYPE_I8, 1), ("u16", TYPE_U16, 2),
+  ("i16", TYPE_I16, 2), ("u32", TYPE_U32, 4), ("i32", TYPE_I32, 4), ("i64", TYPE_I64, 8),
+  ("f32", TYPE_F32, 4), ("f64", TYPE_F, 8)]:
+    _TYPES[_name] = (_type, _size, _ENDIAN_NATIVE)
+    if _size > 1:
+        _TYPES[_name + "be"] = (_type, _size, _ENDIAN_BIG)
+        _TYPES[_name + "le"] = (_type, _size, _ENDIAN_LITTLE)
+_TYPES["bytes"] = _TYPES["u8"]
+_TYPES["f"] = _TYPES["f64"]
+if Target.INTSIZE == 4:
+    _TYPES["i"] = _TYPES["i32"]
+else:
+    assert Target.INTSIZE == 8
+    _TYPES["i"] = _TYPES["i64"]
+
+# An array's elements live in a _Buffer, which frees its raw memory when it is garbage collected.
+# Views (e.g. from get_slice) share their parent's _Buffer, so the memory stays alive for as long as
+# either does; for that reason arrays have no explicit way of freeing their memory. _Buffers have
+# light finalizers, so the GC frees them as soon as they die, rather than queueing them to be
+# finalized later.
+
+class _Buffer(Heap.Raw_Memory):
+    __slots__ = ("data",)
+    RAW_KIND = "Array buffers"
+
+    def __init__(self, size):
+        self.data = lltype.malloc(rffi.CCHARP.TO, size, flavor="raw")
+        self.own(size, True)
+
+
+    def sync(self):
+        return 0
+
+
+    @rgc.must_be_light_finalizer
+    def __del__(self):
+        self.disown()
+        lltype.free(self.data, flavor="raw")
+
+
+class _Mmap_Buffer(_Buffer):
+    # Memory from mmap, either of a file or anonymous shared memory. Writable file mappings are
+    # msync'd before being unmapped.
+    __slots__ = ("writable_file",)
+    RAW_KIND = "Array memory maps"
+
+    def __init__(self, data, size, writable_file):
+        self.data = data
+        self.own(size, False)
+        self.writable_file = writable_file
+
+
+    def sync(self):
+        if self.writable_file:
+            return int(msync(self.data, self.size, MS_SYNC))
+        return 0
+
+
+    @rgc.must_be_light_finalizer
+    def __del__(self):
+        if self.writable_file:
+            msync_del(self.data, self.size, MS_SYNC)
+        munmap(self.data, self.size)
+        self.disown()
+
 
 class Array(Con_Boxed_Object):
-    __slots__ = ("type_name", "type", "type_size", "big_endian", "data", "num_entries",
-      "entries_alloc")
-    _immutable_fields_ = ("type_name", "type", "big_endian")
+    __slots__ = ("type_name", "type", "type_size", "big_endian", "is_float", "swap", "buf", "data",
+      "stride", "fixed_size", "read_only", "num_entries", "entries_alloc")
+    _immutable_fields_ = ("type_name", "type", "big_endian", "is_float", "swap", "stride",
+      "fixed_size", "read_only")
 
 
-    def __init__(self, vm, instance_of, type_name, data_o):
+    def __init__(self, vm, instance_of, type_name, data_o, view_of=None, off=0, n=0, stride=1,
+      buf=None, read_only=False):
+        # If view_of is not None, this array is a view of n elements of view_of, starting at
+        # element off, and taking every stride'th element. If buf is not None, this array is
+        # the n elements at the start of buf. In both cases, the array can not grow.
         Con_Boxed_Object.__init__(self, vm, instance_of)
         self.type_name = type_name
-        if type_name == "i":
-            if Target.INTSIZE == 4:
-                self.type = TYPE_I32
-                self.type_size = 4
-            else:
-                assert Target.INTSIZE == 8
-                self.type = TYPE_I64
-                self.type_size = 8
-            self._auto_endian()
-        elif type_name == "i32":
-            self.type = TYPE_I32
-            self.type_size = 4
-            self._auto_endian()
-        elif type_name == "i32be":
-            self.type = TYPE_I32
-            self.type_size = 4
-            self.big_endian = True
-        elif type_name == "i32le":
-            self.type = TYPE_I32
-            self.type_size = 4
-            self.big_endian = False
-        elif type_name == "i64":
-            self.type = TYPE_I64
-            self.type_size = 8
-            self._auto_endian()
-        elif type_name == "i64be":
-            self.type = TYPE_I64
-            self.type_size = 8
+        if type_name not in _TYPES:
+            _raise_array_exception(vm, "Unknown array type '%s'." % type_name)
+        self.type, self.type_size, endian = _TYPES[type_name]
+        self.is_float = self.type == TYPE_F or self.type == TYPE_F32
+        if endian == _ENDIAN_BIG:
             self.big_endian = True
-        elif type_name == "i64le":
-            self.type = TYPE_I64
-            self.type_size = 8
+        elif endian == _ENDIAN_LITTLE:
             self.big_endian = False
-        elif type_name == "f":
-            self.type = TYPE_F
-            self.type_size = 8
-            self.big_endian = False # irrelevant for floats
         else:
-            mod = vm.get_funcs_mod()
-            aex_class = mod.get_defn(vm, "Array_Exception")
-            vm.raise_(vm.get_slot_apply(aex_class, "new", \
-              [Con_String(vm, "Unknown array type '%s'." % type)]))
+            self._auto_endian()
+        # Elements whose byte order differs from the machine's are accessed a byte at a time.
+        self.swap = self.type_size > 1 and self.big_endian != (ENDIANNESS == "BIG_ENDIAN")
+
+        if view_of is not None:
+            assert view_of.type == self.type
+            self.buf = view_of.buf
+            self.data = rffi.ptradd(view_of.data, off * view_of.stride * self.type_size)
+            self.stride = stride * view_of.stride
+            self.fixed_size = True
+            self.read_only = view_of.read_only
+            self.num_entries = self.entries_alloc = n
+            return
+        elif buf is not None:
+            self.buf = buf
+            self.data = buf.data
+            self.stride = 1
+            self.fixed_size = True
+            self.read_only = read_only
+            self.num_entries = self.entries_alloc = n
+            return
 
+        self.stride = 1
+        self.fixed_size = False
+        self.read_only = False
         if data_o is not None:
             if isinstance(data_o, Con_String):
-                data = data_o.v
+                data = data_o.as_str()
                 i = len(data)
                 self._alignment_check(vm, i)
                 self.num_entries = self.entries_alloc = i // self.type_size
-                self.data = lltype.malloc(rffi.CCHARP.TO, i, flavor="raw")
+                self._alloc(i)
                 i -= 1
                 while i >= 0:
                     self.data[i] = data[i]
@@ -135,16 +241,32 @@ class Array(Con_Boxed_Object):
             else:
                 self.num_entries = 0
                 self.entries_alloc = type_check_int(vm, vm.get_slot_apply(data_o, "len")).v
-                self.data = lltype.malloc(rffi.CCHARP.TO, self.entries_alloc * self.type_size, flavor="raw")
+                self._alloc(self.entries_alloc * self.type_size)
                 vm.get_slot_apply(self, "extend", [data_o])
         else:
             self.num_entries = 0
             self.entries_alloc = DEFAULT_ENTRIES_ALLOC
-            self.data = lltype.malloc(rffi.CCHARP.TO, self.entries_alloc * self.type_size, flavor="raw")
+            self._alloc(self.entries_alloc * self.type_size)
 
 
-    def __del__(self):
-        lltype.free(self.data, flavor="raw")
+    def reserve(self, vm, n):
+        # Makes room for n more elements at the end of this array, returning a pointer to the first
+        # of them. The caller is responsible for increasing num_entries by the number of elements it
+        # writes.
+        _check_room(vm, self, n)
+        return rffi.ptradd(self.data, self.num_entries * self.type_size)
+
+
+    def serialized(self):
+        # Returns this array's elements as a string of raw bytes.
+        data = _to_str(self)
+        objectmodel.keepalive_until_here(self) # XXX I don't really understand why this is needed
+        return data
+
+
+    def _alloc(self, size):
+        self.buf = _Buffer(size)
+        self.data = self.buf.data
 
 
     def _auto_endian(self):
@@ -170,7 +292,7 @@ def _new_func_Array(vm):
     (class_, type_o, data_o),_ = vm.decode_args("CS", opt="O")
     assert isinstance(type_o, Con_String)
 
-    a_o = Array(vm, class_, type_o.v, data_o)
+    a_o = Array(vm, class_, type_o.as_str(), data_o)
     if data_o is None:
         data_o = vm.get_builtin(BUILTIN_NULL_OBJ)
     vm.get_slot_apply(a_o, "init", [type_o, data_o])
@@ -188,12 +310,79 @@ def Array_append(vm):
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+@con_object_proc
+def Array_converted(vm):
+    (self, type_o),_ = vm.decode_args("!S", self_of=Array)
+    assert isinstance(self, Array)
+    assert isinstance(type_o, Con_String)
+
+    n = self.num_entries
+    r = _new_array(vm, type_o.as_str(), n)
+    if r.type == self.type and r.big_endian == self.big_endian and self.stride == 1:
+        memmove(r.data, self.data, n * self.type_size)
+    elif r.is_float:
+        for i in range(n):
+            _set_float(r, i, _get_float(self, i))
+    elif self.is_float:
+        for i in range(n):
+            _set_int(r, i, int(_get_float(self, i)))
+    else:
+        # Integers which don't fit in r's type are truncated, as in C.
+        for i in range(n):
+            _set_int(r, i, _get_int(self, i))
+    objectmodel.keepalive_until_here(self)
+
+    return r
+
+
+@con_object_proc
+def Array_copy(vm):
+    mod = vm.get_funcs_mod()
+    (self,),_ = vm.decode_args("!", self_of=Array)
+    assert isinstance(self, Array)
+
+    a = Array(vm, mod.get_defn(vm, "Array"), self.type_name, None)
+    _check_room(vm, a, self.num_entries)
+    if self.stride == 1:
+        memmove(a.data, self.data, self.num_entries * self.type_size)
+    elif self.is_float:
+        for i in range(self.num_entries):
+            _set_float(a, i, _get_float(self, i))
+    else:
+        for i in range(self.num_entries):
+            _set_int(a, i, _get_int(self, i))
+    a.num_entries = self.num_entries
+    objectmodel.keepalive_until_here(self)
+
+    return a
+
+
+@con_object_proc
+def Array_decode_to_string(vm):
+    (self, i_o, j_o),_ = vm.decode_args("!", opt="ii", self_of=Array)
+    assert isinstance(self, Array)
+    _check_bytes(vm, self)
+
+    i, j = translate_slice_idx_objs(vm, i_o, j_o, self.num_entries)
+    if self.stride == 1:
+        s = rffi.charpsize2str(rffi.ptradd(self.data, i), j - i)
+    else:
+        b = StringBuilder(j - i)
+        for k in range(i, j):
+            b.append(self.data[k * self.stride])
+        s = b.build()
+    objectmodel.keepalive_until_here(self)
+
+    return Con_String(vm, s)
+
+
 @con_object_proc
 def Array_extend(vm):
     (self, o_o),_ = vm.decode_args("!O", self_of=Array)
     assert isinstance(self, Array)
 
-    if isinstance(o_o, Array) and self.type_size == o_o.type_size:
+    if isinstance(o_o, Array) and self.type == o_o.type \
+      and self.big_endian == o_o.big_endian and o_o.stride == 1:
         _check_room(vm, self, o_o.num_entries)
         memmove(rffi.ptradd(self.data, self.num_entries * self.type_size), \
           o_o.data, o_o.num_entries * o_o.type_size)
@@ -216,7 +405,7 @@ def Array_extend_from_string(vm):
     assert isinstance(self, Array)
     assert isinstance(s_o, Con_String)
 
-    s = s_o.v
+    s = s_o.as_str()
     i = len(s)
     self._alignment_check(vm, i)
     _check_room(vm, self, i // self.type_size)
@@ -231,6 +420,34 @@ def Array_extend_from_string(vm):
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+@con_object_gen
+def Array_find(vm):
+    (self, o_o),_ = vm.decode_args("!O", self_of=Array)
+    assert isinstance(self, Array)
+    _check_bytes(vm, self)
+
+    o = _bytes_operand(vm, o_o)
+    i = _find_off(self, o, 0)
+    while i != -1:
+        yield o_o
+        i = _find_off(self, o, i + 1)
+    objectmodel.keepalive_until_here(self)
+
+
+@con_object_gen
+def Array_find_index(vm):
+    (self, o_o),_ = vm.decode_args("!O", self_of=Array)
+    assert isinstance(self, Array)
+    _check_bytes(vm, self)
+
+    o = _bytes_operand(vm, o_o)
+    i = _find_off(self, o, 0)
+    while i != -1:
+        yield Con_Int(vm, i)
+        i = _find_off(self, o, i + 1)
+    objectmodel.keepalive_until_here(self)
+
+
 @con_object_proc
 def Array_get(vm):
     (self, i_o),_ = vm.decode_args("!I", self_of=Array)
@@ -246,14 +463,19 @@ def Array_get(vm):
 @con_object_proc
 def Array_get_slice(vm):
     mod = vm.get_funcs_mod()
-    (self, i_o, j_o),_ = vm.decode_args("!", opt="ii", self_of=Array)
+    (self, i_o, j_o, step_o),_ = vm.decode_args("!", opt="iii", self_of=Array)
     assert isinstance(self, Array)
 
     i, j = translate_slice_idx_objs(vm, i_o, j_o, self.num_entries)
-    # This does a double allocation, so isn't very efficient. It is pleasingly simple though.
-    data = rffi.charpsize2str(rffi.ptradd(self.data, i * self.type_size), int((j - i) * self.type_size))
-    objectmodel.keepalive_until_here(self)
-    return Array(vm, mod.get_defn(vm, "Array"), self.type_name, Con_String(vm, data))
+    if step_o is None:
+        step = 1
+    else:
+        step = type_check_int(vm, step_o).v
+        if step <= 0:
+            _raise_array_exception(vm, "Step must be greater than zero.")
+    # The slice is a view which shares this array's buffer.
+    return Array(vm, mod.get_defn(vm, "Array"), self.type_name, None, self, i, \
+      (j - i + step - 1) // step, step)
 
 
 @con_object_gen
@@ -288,9 +510,7 @@ def Array_serialize(vm):
     (self,),_ = vm.decode_args("!", self_of=Array)
     assert isinstance(self, Array)
 
-    data = rffi.charpsize2str(self.data, self.num_entries * self.type_size)
-    objectmodel.keepalive_until_here(self) # XXX I don't really understand why this is needed
-    return Con_String(vm, data)
+    return Con_String(vm, self.serialized())
 
 
 @con_object_proc
@@ -298,6 +518,7 @@ def Array_set(vm):
     (self, i_o, o_o),_ = vm.decode_args("!IO", self_of=Array)
     assert isinstance(self, Array)
     assert isinstance(i_o, Con_Int)
+    _check_writable(vm, self)
 
     i = translate_idx(vm, i_o.v, self.num_entries)
     _set_obj(vm, self, i, o_o)
@@ -305,16 +526,660 @@ def Array_set(vm):
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+_Int_Sort = listsort.make_timsort_class()
+_Float_Sort = listsort.make_timsort_class()
+
+@con_object_proc
+def Array_sort(vm):
+    (self, key_o, cmp_o, reverse_o),_ = vm.decode_args("!", opt="ooi", self_of=Array)
+    assert isinstance(self, Array)
+    _check_writable(vm, self)
+
+    reverse = reverse_o is not None and type_check_int(vm, reverse_o).v != 0
+    n = self.num_entries
+    if key_o is not None or cmp_o is not None:
+        l = [_get_obj(vm, self, i) for i in range(n)]
+        sort_objs(vm, l, key_o, cmp_o, reverse)
+        if n != self.num_entries:
+            vm.raise_helper("VM_Exception", [Con_String(vm, "Array modified during sort.")])
+        for i in range(n):
+            _set_obj(vm, self, i, l[i])
+    elif self.is_float:
+        fl = [_get_float(self, i) for i in range(n)]
+        if reverse:
+            fl.reverse()
+        _Float_Sort(fl).sort()
+        if reverse:
+            fl.reverse()
+        for i in range(n):
+            _set_float(self, i, fl[i])
+    else:
+        il = [_get_int(self, i) for i in range(n)]
+        if reverse:
+            il.reverse()
+        _Int_Sort(il).sort()
+        if reverse:
+            il.reverse()
+        for i in range(n):
+            _set_int(self, i, il[i])
+    objectmodel.keepalive_until_here(self)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Array_sync(vm):
+    (self,),_ = vm.decode_args("!", self_of=Array)
+    assert isinstance(self, Array)
+
+    if self.buf.sync() != 0:
+        _raise_array_exception(vm, os.strerror(rposix.get_saved_errno()))
+    objectmodel.keepalive_until_here(self)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
 @con_object_proc
 def Array_to_str(vm):
     (self,),_ = vm.decode_args("!", self_of=Array)
     assert isinstance(self, Array)
 
-    data = rffi.charpsize2str(self.data, self.num_entries * self.type_size)
+    data = _to_str(self)
     objectmodel.keepalive_until_here(self)
     return Con_String(vm, data)
 
 
+################################################################################
+# Vectorised operations
+#
+
+# Operations on whole arrays run as native loops over the raw buffer, without boxing each element.
+# Binary operations take either an array of the same length or a scalar Int or Float. Results are
+# float arrays if either operand is float, and otherwise have the type of the left-hand array.
+
+_OP_ADD = 0
+_OP_SUB = 1
+_OP_MUL = 2
+_OP_DIV = 3
+
+_CMP_LT = 0
+_CMP_LE = 1
+_CMP_EQ = 2
+_CMP_NEQ = 3
+_CMP_GT = 4
+_CMP_GE = 5
+
+
+def _raise_array_exception(vm, msg):
+    mod = vm.get_funcs_mod()
+    aex_class = mod.get_defn(vm, "Array_Exception")
+    vm.raise_(vm.get_slot_apply(aex_class, "new", [Con_String(vm, msg)]))
+
+
+def _new_array(vm, type_name, n):
+    mod = vm.get_funcs_mod()
+    a = Array(vm, mod.get_defn(vm, "Array"), type_name, None)
+    _check_room(vm, a, n)
+    a.num_entries = n
+    return a
+
+
+def _get_float(self, i):
+    if not self.is_float:
+        return float(_get_int(self, i))
+    if self.swap:
+        return ieee.float_unpack(_get_swapped(self, i), self.type_size)
+    if self.type == TYPE_F32:
+        return rffi.cast(lltype.Float, rffi.cast(rffi.FLOATP, self.data)[i * self.stride])
+    else:
+        assert self.type == TYPE_F
+        return float(rffi.cast(rffi.DOUBLEP, self.data)[i * self.stride])
+
+
+def _set_float(self, i, v):
+    if self.swap:
+        try:
+            bits = ieee.float_pack(v, self.type_size)
+        except OverflowError:
+            # Only possible for f32: store infinity, as a native f32 would.
+            bits = ieee.float_pack(math.copysign(INFINITY, v), self.type_size)
+        _set_swapped(self, i, bits)
+    elif self.type == TYPE_F32:
+        rffi.cast(rffi.FLOATP, self.data)[i * self.stride] = rffi.cast(rffi.FLOAT, v)
+    else:
+        assert self.type == TYPE_F
+        rffi.cast(rffi.DOUBLEP, self.data)[i * self.stride] = rffi.cast(rffi.DOUBLE, v)
+
+
+def _check_operand(vm, self, o_o):
+    # Checks that o_o is a valid operand for a binary operation on self, returning True if the
+    # operation has to be performed on floats.
+    if isinstance(o_o, Array):
+        if o_o.num_entries != self.num_entries:
+            _raise_array_exception(vm, "Arrays of different lengths (%d and %d)." \
+              % (self.num_entries, o_o.num_entries))
+        return self.is_float or o_o.is_float
+    o_o = type_check_number(vm, o_o)
+    return self.is_float or isinstance(o_o, Con_Float)
+
+
+def _float_operand(o_o, i):
+    if isinstance(o_o, Array):
+        return _get_float(o_o, i)
+    assert isinstance(o_o, Con_Number)
+    return o_o.as_float()
+
+
+def _int_operand(o_o, i):
+    if isinstance(o_o, Array):
+        return _get_int(o_o, i)
+    assert isinstance(o_o, Con_Number)
+    return o_o.as_int()
+
+
+def _binop(vm, op):
+    (self, o_o),_ = vm.decode_args("!O", self_of=Array)
+    assert isinstance(self, Array)
+
+    n = self.num_entries
+    if _check_operand(vm, self, o_o) or op == _OP_DIV:
+        r = _new_array(vm, "f", n)
+        for i in range(n):
+            x = _get_float(self, i)
+            y = _float_operand(o_o, i)
+            if op == _OP_ADD:
+                x += y
+            elif op == _OP_SUB:
+                x -= y
+            elif op == _OP_MUL:
+                x *= y
+            else:
+                x /= y
+            _set_float(r, i, x)
+    else:
+        r = _new_array(vm, self.type_name, n)
+        for i in range(n):
+            x = _get_int(self, i)
+            y = _int_operand(o_o, i)
+            if op == _OP_ADD:
+                x += y
+            elif op == _OP_SUB:
+                x -= y
+            else:
+                assert op == _OP_MUL
+                x *= y
+            _set_int(r, i, x)
+    objectmodel.keepalive_until_here(self)
+    objectmodel.keepalive_until_here(o_o)
+
+    return r
+
+
+@con_object_proc
+def Array_add(vm):
+    return _binop(vm, _OP_ADD)
+
+
+@con_object_proc
+def Array_sub(vm):
+    return _binop(vm, _OP_SUB)
+
+
+@con_object_proc
+def Array_mul(vm):
+    return _binop(vm, _OP_MUL)
+
+
+@con_object_proc
+def Array_div(vm):
+    return _binop(vm, _OP_DIV)
+
+
+def _cmp_mask(vm, cmp):
+    (self, o_o),_ = vm.decode_args("!O", self_of=Array)
+    assert isinstance(self, Array)
+
+    n = self.num_entries
+    r = _new_array(vm, "i", n)
+    if _check_operand(vm, self, o_o):
+        for i in range(n):
+            x = _get_float(self, i)
+            y = _float_operand(o_o, i)
+            if cmp == _CMP_LT:
+                b = x < y
+            elif cmp == _CMP_LE:
+                b = x <= y
+            elif cmp == _CMP_EQ:
+                b = x == y
+            elif cmp == _CMP_NEQ:
+                b = x != y
+            elif cmp == _CMP_GT:
+                b = x > y
+            else:
+                b = x >= y
+            _set_int(r, i, int(b))
+    else:
+        for i in range(n):
+            x = _get_int(self, i)
+            y = _int_operand(o_o, i)
+            if cmp == _CMP_LT:
+                b = x < y
+            elif cmp == _CMP_LE:
+                b = x <= y
+            elif cmp == _CMP_EQ:
+                b = x == y
+            elif cmp == _CMP_NEQ:
+                b = x != y
+            elif cmp == _CMP_GT:
+                b = x > y
+            else:
+                b = x >= y
+            _set_int(r, i, int(b))
+    objectmodel.keepalive_until_here(self)
+    objectmodel.keepalive_until_here(o_o)
+
+    return r
+
+
+@con_object_proc
+def Array_mask_lt(vm):
+    return _cmp_mask(vm, _CMP_LT)
+
+
+@con_object_proc
+def Array_mask_le(vm):
+    return _cmp_mask(vm, _CMP_LE)
+
+
+@con_object_proc
+def Array_mask_eq(vm):
+    return _cmp_mask(vm, _CMP_EQ)
+
+
+@con_object_proc
+def Array_mask_neq(vm):
+    return _cmp_mask(vm, _CMP_NEQ)
+
+
+@con_object_proc
+def Array_mask_gt(vm):
+    return _cmp_mask(vm, _CMP_GT)
+
+
+@con_object_proc
+def Array_mask_ge(vm):
+    return _cmp_mask(vm, _CMP_GE)
+
+
+@con_object_proc
+def Array_cumsum(vm):
+    (self,),_ = vm.decode_args("!", self_of=Array)
+    assert isinstance(self, Array)
+
+    n = self.num_entries
+    r = _new_array(vm, self.type_name, n)
+    if self.is_float:
+        f = 0.0
+        for i in range(n):
+            f += _get_float(self, i)
+            _set_float(r, i, f)
+    else:
+        t = 0
+        for i in range(n):
+            t += _get_int(self, i)
+            _set_int(r, i, t)
+    objectmodel.keepalive_until_here(self)
+
+    return r
+
+
+@con_object_proc
+def Array_dot(vm):
+    (self, o_o),_ = vm.decode_args("!O", self_of=Array)
+    assert isinstance(self, Array)
+
+    if not isinstance(o_o, Array):
+        vm.raise_helper("Type_Exception", [Con_String(vm, "Array"), o_o])
+    assert isinstance(o_o, Array)
+    n = self.num_entries
+    if _check_operand(vm, self, o_o):
+        f = 0.0
+        for i in range(n):
+            f += _get_float(self, i) * _get_float(o_o, i)
+        r = Con_Float(vm, f)
+    else:
+        t = 0
+        for i in range(n):
+            t += _get_int(self, i) * _get_int(o_o, i)
+        r = Con_Int(vm, t)
+    objectmodel.keepalive_until_here(self)
+    objectmodel.keepalive_until_here(o_o)
+
+    return r
+
+
+@con_object_proc
+def Array_fill(vm):
+    (self, o_o),_ = vm.decode_args("!N", self_of=Array)
+    assert isinstance(self, Array)
+    assert isinstance(o_o, Con_Number)
+    _check_writable(vm, self)
+
+    n = self.num_entries
+    if self.is_float:
+        f = o_o.as_float()
+        for i in range(n):
+            _set_float(self, i, f)
+    else:
+        t = o_o.as_int()
+        for i in range(n):
+            _set_int(self, i, t)
+    objectmodel.keepalive_until_here(self)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def _min_max(vm, want_max):
+    (self,),_ = vm.decode_args("!", self_of=Array)
+    assert isinstance(self, Array)
+
+    n = self.num_entries
+    if n == 0:
+        _raise_array_exception(vm, "Empty array.")
+    if self.is_float:
+        f = _get_float(self, 0)
+        for i in range(1, n):
+            x = _get_float(self, i)
+            if (want_max and x > f) or (not want_max and x < f):
+                f = x
+        r = Con_Float(vm, f)
+    else:
+        t = _get_int(self, 0)
+        for i in range(1, n):
+            x = _get_int(self, i)
+            if (want_max and x > t) or (not want_max and x < t):
+                t = x
+        r = Con_Int(vm, t)
+    objectmodel.keepalive_until_here(self)
+
+    return r
+
+
+@con_object_proc
+def Array_max(vm):
+    return _min_max(vm, True)
+
+
+@con_object_proc
+def Array_min(vm):
+    return _min_max(vm, False)
+
+
+@con_object_proc
+def Array_sum(vm):
+    (self,),_ = vm.decode_args("!", self_of=Array)
+    assert isinstance(self, Array)
+
+    n = self.num_entries
+    if self.is_float:
+        f = 0.0
+        for i in range(n):
+            f += _get_float(self, i)
+        r = Con_Float(vm, f)
+    else:
+        t = 0
+        for i in range(n):
+            t += _get_int(self, i)
+        r = Con_Int(vm, t)
+    objectmodel.keepalive_until_here(self)
+
+    return r
+
+
+@con_object_proc
+def Array_take(vm):
+    (self, idxs_o),_ = vm.decode_args("!O", self_of=Array)
+    assert isinstance(self, Array)
+
+    if isinstance(idxs_o, Array):
+        if idxs_o.is_float:
+            _raise_array_exception(vm, "Indices must be integers.")
+        idxs = [_get_int(idxs_o, i) for i in range(idxs_o.num_entries)]
+        objectmodel.keepalive_until_here(idxs_o)
+    else:
+        idxs = []
+        vm.pre_get_slot_apply_pump(idxs_o, "iter")
+        while 1:
+            e_o = vm.apply_pump()
+            if not e_o:
+                break
+            idxs.append(type_check_int(vm, e_o).v)
+
+    n = len(idxs)
+    r = _new_array(vm, self.type_name, n)
+    for i in range(n):
+        j = translate_idx(vm, idxs[i], self.num_entries)
+        if self.is_float:
+            _set_float(r, i, _get_float(self, j))
+        else:
+            _set_int(r, i, _get_int(self, j))
+    objectmodel.keepalive_until_here(self)
+
+    return r
+
+
+@con_object_proc
+def Array_where(vm):
+    (self, x_o, y_o),_ = vm.decode_args("!", opt="OO", self_of=Array)
+    assert isinstance(self, Array)
+
+    n = self.num_entries
+    if x_o is None:
+        # Return the indices of non-zero elements.
+        idxs = []
+        for i in range(n):
+            if _get_float(self, i) != 0.0:
+                idxs.append(i)
+        r = _new_array(vm, "i", len(idxs))
+        for i in range(len(idxs)):
+            _set_int(r, i, idxs[i])
+        objectmodel.keepalive_until_here(self)
+        return r
+
+    if y_o is None:
+        vm.raise_helper("Parameters_Exception", [Con_String(vm, "Too few parameters.")])
+    is_float = _check_operand(vm, self, x_o)
+    is_float = _check_operand(vm, self, y_o) or is_float
+    if is_float:
+        r = _new_array(vm, "f", n)
+    elif isinstance(x_o, Array):
+        r = _new_array(vm, x_o.type_name, n)
+    elif isinstance(y_o, Array):
+        r = _new_array(vm, y_o.type_name, n)
+    else:
+        r = _new_array(vm, "i", n)
+    for i in range(n):
+        if _get_float(self, i) != 0.0:
+            o_o = x_o
+        else:
+            o_o = y_o
+        if is_float:
+            _set_float(r, i, _float_operand(o_o, i))
+        else:
+            _set_int(r, i, _int_operand(o_o, i))
+    objectmodel.keepalive_until_here(self)
+    objectmodel.keepalive_until_here(x_o)
+    objectmodel.keepalive_until_here(y_o)
+
+    return r
+
+
+@con_object_proc
+def arange(vm):
+    (type_o, start_o, stop_o, step_o),_ = vm.decode_args("SNN", opt="N")
+    assert isinstance(type_o, Con_String)
+    assert isinstance(start_o, Con_Number)
+    assert isinstance(stop_o, Con_Number)
+
+    mod = vm.get_funcs_mod()
+    r = Array(vm, mod.get_defn(vm, "Array"), type_o.as_str(), None)
+    if r.is_float:
+        start = start_o.as_float()
+        stop = stop_o.as_float()
+        if step_o is None:
+            step = 1.0
+        else:
+            step = type_check_number(vm, step_o).as_float()
+        if step == 0.0:
+            _raise_array_exception(vm, "Step must not be zero.")
+        n = int(math.ceil((stop - start) / step))
+        if n < 0:
+            n = 0
+        _check_room(vm, r, n)
+        r.num_entries = n
+        for i in range(n):
+            _set_float(r, i, start + i * step)
+    else:
+        start = start_o.as_int()
+        stop = stop_o.as_int()
+        if step_o is None:
+            step = 1
+        else:
+            step = type_check_number(vm, step_o).as_int()
+        if step == 0:
+            _raise_array_exception(vm, "Step must not be zero.")
+        if step > 0:
+            n = (stop - start + step - 1) // step
+        else:
+            n = (start - stop - step - 1) // -step
+        if n < 0:
+            n = 0
+        _check_room(vm, r, n)
+        r.num_entries = n
+        for i in range(n):
+            _set_int(r, i, start + i * step)
+    objectmodel.keepalive_until_here(r)
+
+    return r
+
+
+@con_object_proc
+def map_file(vm):
+    mod = vm.get_funcs_mod()
+    (path_o, type_o, mode_o),_ = vm.decode_args("SS", opt="s")
+    assert isinstance(path_o, Con_String)
+    assert isinstance(type_o, Con_String)
+
+    if mode_o is None:
+        mode = "r"
+    else:
+        mode = type_check_string(vm, mode_o).as_str()
+    read_only = True
+    flags = os.O_RDONLY
+    prot = PROT_READ
+    if mode == "rw":
+        read_only = False
+        flags = os.O_RDWR
+        prot = PROT_READ | PROT_WRITE
+    elif mode != "r":
+        _raise_array_exception(vm, "Unknown mode '%s'." % mode)
+
+    path = path_o.as_str()
+    fd = -1
+    try:
+        fd = os.open(path, flags, 0)
+    except OSError, e:
+        vm.raise_helper("File_Exception", \
+          [Con_String(vm, "File '%s': %s." % (path, os.strerror(e.errno)))])
+    try:
+        a = Array(vm, mod.get_defn(vm, "Array"), type_o.as_str(), None, buf=_Buffer(0), \
+          read_only=read_only)
+        size = os.fstat(fd).st_size
+        a._alignment_check(vm, size)
+        # mmap can't map 0 bytes, so an empty file leaves the array with its empty buffer.
+        if size > 0:
+            data = mmap(lltype.nullptr(rffi.CCHARP.TO), size, prot, MAP_SHARED, fd, 0)
+            if rffi.cast(lltype.Signed, data) == -1:
+                vm.raise_helper("File_Exception", [Con_String(vm, \
+                  "File '%s': %s." % (path, os.strerror(rposix.get_saved_errno())))])
+            a.buf = _Mmap_Buffer(data, size, not read_only)
+            a.data = data
+            a.num_entries = a.entries_alloc = size // a.type_size
+    finally:
+        # The mapping remains valid after the file is closed.
+        os.close(fd)
+
+    return a
+
+
+@con_object_proc
+def shared(vm):
+    mod = vm.get_funcs_mod()
+    (type_o, n_o),_ = vm.decode_args("SI")
+    assert isinstance(type_o, Con_String)
+    assert isinstance(n_o, Con_Int)
+
+    n = n_o.v
+    if n < 0:
+        _raise_array_exception(vm, "Negative size %d." % n)
+    a = Array(vm, mod.get_defn(vm, "Array"), type_o.as_str(), None, buf=_Buffer(0))
+    size = n * a.type_size
+    if size > 0:
+        data = mmap(lltype.nullptr(rffi.CCHARP.TO), size, PROT_READ | PROT_WRITE, \
+          MAP_SHARED | MAP_ANON, -1, 0)
+        if rffi.cast(lltype.Signed, data) == -1:
+            _raise_array_exception(vm, os.strerror(rposix.get_saved_errno()))
+        a.buf = _Mmap_Buffer(data, size, False)
+        a.data = data
+        a.num_entries = a.entries_alloc = n
+
+    return a
+
+
+################################################################################
+# Helpers
+#
+
+def _check_writable(vm, self):
+    if self.read_only:
+        _raise_array_exception(vm, "Array is read-only.")
+
+
+def _check_bytes(vm, self):
+    if self.type_size != 1:
+        _raise_array_exception(vm, "Array of type '%s' is not a byte array." % self.type_name)
+
+
+def _bytes_operand(vm, o_o):
+    # Returns the bytes of o_o, which must be a String or a byte array.
+    if isinstance(o_o, Array):
+        _check_bytes(vm, o_o)
+        s = _to_str(o_o)
+        objectmodel.keepalive_until_here(o_o)
+        return s
+    return type_check_string(vm, o_o).as_str()
+
+
+def _find_off(self, s, i):
+    # Returns the first position at or after i where the byte array self contains s, or -1.
+    n = len(s)
+    last = self.num_entries - n
+    if n == 0:
+        if i <= last:
+            return i
+        return -1
+    c = s[0]
+    while i <= last:
+        if self.data[i * self.stride] == c:
+            k = 1
+            while k < n and self.data[(i + k) * self.stride] == s[k]:
+                k += 1
+            if k == n:
+                return i
+        i += 1
+    return -1
+
+
 def _append(vm, self, o):
     _check_room(vm, self, 1)
     _set_obj(vm, self, self.num_entries, o)
@@ -322,36 +1187,124 @@ def _append(vm, self, o):
 
 
 def _check_room(vm, self, i):
-    if self.num_entries + i < self.entries_alloc:
+    if self.num_entries + i <= self.entries_alloc:
         return
+    if self.fixed_size:
+        _raise_array_exception(vm, "Array can not grow.")
     o_data = self.data
     self.entries_alloc = int((self.entries_alloc + i + 1) * 1.25)
     assert self.entries_alloc > self.num_entries + i
-    self.data = lltype.malloc(rffi.CCHARP.TO, self.entries_alloc * self.type_size, flavor="raw")
+    # The old buffer is not freed here: it is freed when it is garbage collected, which is only
+    # once no views of it remain.
+    self._alloc(self.entries_alloc * self.type_size)
     memmove(self.data, o_data, self.num_entries * self.type_size)
-    lltype.free(o_data, flavor="raw")
 
 
 def _get_obj(vm, self, i):
+    if self.is_float:
+        return Con_Float(vm, _get_float(self, i))
+    else:
+        return Con_Int(vm, _get_int(self, i))
+
+
+def _get_int(self, i):
+    if self.swap:
+        return _get_swapped_int(self, i)
+    j = i * self.stride
     if self.type == TYPE_I64:
-        return Con_Int(vm, rffi.cast(rffi.LONGP, self.data)[i])
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.LONGP, self.data)[j])
     elif self.type == TYPE_I32:
-        return Con_Int(vm, rffi.cast(rffi.LONG, rffi.cast(rffi.INTP, self.data)[i]))
-    elif self.type == TYPE_F:
-        return Con_Float(vm, rffi.cast(rffi.DOUBLE, rffi.cast(rffi.DOUBLEP, self.data)[i]))
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.INTP, self.data)[j])
+    elif self.type == TYPE_U32:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.UINTP, self.data)[j])
+    elif self.type == TYPE_I16:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.SHORTP, self.data)[j])
+    elif self.type == TYPE_U16:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.USHORTP, self.data)[j])
+    elif self.type == TYPE_I8:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.SIGNEDCHARP, self.data)[j])
     else:
-        raise Exception("XXX")
+        assert self.type == TYPE_U8
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.UCHARP, self.data)[j])
 
 
-def _set_obj(vm, self, i, o):
+def _get_swapped_int(self, i):
+    v = _get_swapped(self, i)
+    if self.type == TYPE_I64:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.LONGLONG, v))
+    elif self.type == TYPE_I32:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.INT, v))
+    elif self.type == TYPE_U32:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.UINT, v))
+    elif self.type == TYPE_I16:
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.SHORT, v))
+    else:
+        assert self.type == TYPE_U16
+        return rffi.cast(lltype.Signed, rffi.cast(rffi.USHORT, v))
+
+
+def _set_int(self, i, v):
+    if self.swap:
+        _set_swapped(self, i, r_ulonglong(v))
+        return
+    j = i * self.stride
     if self.type == TYPE_I64:
-        rffi.cast(rffi.LONGP, self.data)[i] = rffi.cast(rffi.LONG, type_check_number(vm, o).as_int())
+        rffi.cast(rffi.LONGP, self.data)[j] = rffi.cast(rffi.LONG, v)
     elif self.type == TYPE_I32:
-        rffi.cast(rffi.INTP, self.data)[i] = rffi.cast(rffi.INT, type_check_number(vm, o).as_int())
-    elif self.type == TYPE_F:
-        rffi.cast(rffi.DOUBLEP, self.data)[i] = rffi.cast(rffi.DOUBLE, type_check_number(vm, o).as_float())
+        rffi.cast(rffi.INTP, self.data)[j] = rffi.cast(rffi.INT, v)
+    elif self.type == TYPE_U32:
+        rffi.cast(rffi.UINTP, self.data)[j] = rffi.cast(rffi.UINT, v)
+    elif self.type == TYPE_I16:
+        rffi.cast(rffi.SHORTP, self.data)[j] = rffi.cast(rffi.SHORT, v)
+    elif self.type == TYPE_U16:
+        rffi.cast(rffi.USHORTP, self.data)[j] = rffi.cast(rffi.USHORT, v)
+    elif self.type == TYPE_I8:
+        rffi.cast(rffi.SIGNEDCHARP, self.data)[j] = rffi.cast(rffi.SIGNEDCHAR, v)
     else:
-        raise Exception("XXX")
+        assert self.type == TYPE_U8
+        rffi.cast(rffi.UCHARP, self.data)[j] = rffi.cast(rffi.UCHAR, v)
+
+
+def _get_swapped(self, i):
+    # Returns the raw bits of element i of an array whose byte order differs from the machine's.
+    p = rffi.ptradd(self.data, i * self.stride * self.type_size)
+    size = self.type_size
+    v = r_ulonglong(0)
+    for k in range(size):
+        if self.big_endian:
+            c = p[k]
+        else:
+            c = p[size - 1 - k]
+        v = (v << 8) | r_ulonglong(ord(c))
+    return v
+
+
+def _set_swapped(self, i, v):
+    p = rffi.ptradd(self.data, i * self.stride * self.type_size)
+    size = self.type_size
+    for k in range(size):
+        c = chr(intmask(v & r_ulonglong(0xFF)))
+        if self.big_endian:
+            p[size - 1 - k] = c
+        else:
+            p[k] = c
+        v = v >> 8
+
+
+def _set_obj(vm, self, i, o):
+    if self.is_float:
+        _set_float(self, i, type_check_number(vm, o).as_float())
+    else:
+        _set_int(self, i, type_check_number(vm, o).as_int())
+
+
+def _to_str(self):
+    if self.stride == 1:
+        return rffi.charpsize2str(self.data, self.num_entries * self.type_size)
+    b = StringBuilder(self.num_entries * self.type_size)
+    for i in range(self.num_entries):
+        b.append_charpsize(rffi.ptradd(self.data, i * self.stride * self.type_size), self.type_size)
+    return b.build()
 
 
 def bootstrap_array_class(vm, mod):
@@ -359,14 +1312,39 @@ def bootstrap_array_class(vm, mod):
     mod.set_defn(vm, "Array", array_class)
     array_class.new_func = new_c_con_func(vm, Con_String(vm, "new_Array"), False, _new_func_Array, mod)
 
+    new_c_con_func_for_class(vm, "+", Array_add, array_class)
+    new_c_con_func_for_class(vm, "-", Array_sub, array_class)
+    new_c_con_func_for_class(vm, "*", Array_mul, array_class)
+    new_c_con_func_for_class(vm, "/", Array_div, array_class)
     new_c_con_func_for_class(vm, "append", Array_append, array_class)
+    new_c_con_func_for_class(vm, "converted", Array_converted, array_class)
+    new_c_con_func_for_class(vm, "copy", Array_copy, array_class)
+    new_c_con_func_for_class(vm, "cumsum", Array_cumsum, array_class)
+    new_c_con_func_for_class(vm, "decode_to_string", Array_decode_to_string, array_class)
+    new_c_con_func_for_class(vm, "dot", Array_dot, array_class)
     new_c_con_func_for_class(vm, "extend", Array_extend, array_class)
     new_c_con_func_for_class(vm, "extend_from_string", Array_extend_from_string, array_class)
+    new_c_con_func_for_class(vm, "fill", Array_fill, array_class)
+    new_c_con_func_for_class(vm, "find", Array_find, array_class)
+    new_c_con_func_for_class(vm, "find_index", Array_find_index, array_class)
     new_c_con_func_for_class(vm, "get", Array_get, array_class)
     new_c_con_func_for_class(vm, "get_slice", Array_get_slice, array_class)
     new_c_con_func_for_class(vm, "iter", Array_iter, array_class)
     new_c_con_func_for_class(vm, "len", Array_len, array_class)
     new_c_con_func_for_class(vm, "len_bytes", Array_len_bytes, array_class)
+    new_c_con_func_for_class(vm, "mask_eq", Array_mask_eq, array_class)
+    new_c_con_func_for_class(vm, "mask_ge", Array_mask_ge, array_class)
+    new_c_con_func_for_class(vm, "mask_gt", Array_mask_gt, array_class)
+    new_c_con_func_for_class(vm, "mask_le", Array_mask_le, array_class)
+    new_c_con_func_for_class(vm, "mask_lt", Array_mask_lt, array_class)
+    new_c_con_func_for_class(vm, "mask_neq", Array_mask_neq, array_class)
+    new_c_con_func_for_class(vm, "max", Array_max, array_class)
+    new_c_con_func_for_class(vm, "min", Array_min, array_class)
     new_c_con_func_for_class(vm, "serialize", Array_serialize, array_class)
     new_c_con_func_for_class(vm, "set", Array_set, array_class)
-    new_c_con_func_for_class(vm, "to_str", Array_to_str, array_class)
\ No newline at end of file
+    new_c_con_func_for_class(vm, "sort", Array_sort, array_class)
+    new_c_con_func_for_class(vm, "sum", Array_sum, array_class)
+    new_c_con_func_for_class(vm, "sync", Array_sync, array_class)
+    new_c_con_func_for_class(vm, "take", Array_take, array_class)
+    new_c_con_func_for_class(vm, "to_str", Array_to_str, array_class)
+    new_c_con_func_for_class(vm, "where", Array_where, array_class)
\ No newline at end of file
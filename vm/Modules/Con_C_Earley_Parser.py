@@ -199,7 +199,7 @@ def Parser_parse(vm):
         rn_os.append(e_o)
 
     grm = []
-    grm_s = grm_o.v
+    grm_s = grm_o.as_str()
     if len(grm_s) % Target.INTSIZE != 0:
         raise Exception("XXX")
     for i in range(0, len(grm_s), Target.INTSIZE):
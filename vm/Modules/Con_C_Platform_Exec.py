@@ -19,7 +19,7 @@
 # IN THE SOFTWARE.
 
 
-import os
+import errno, os
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rtyper.tool import rffi_platform as platform
 from rpython.rlib import rarithmetic, rposix
@@ -28,27 +28,57 @@ from Builtins import *
 
 
 
-eci    = ExternalCompilationInfo(includes=["stdlib.h"])
+eci    = ExternalCompilationInfo(includes=["fcntl.h", "spawn.h", "stdlib.h", "sys/wait.h", "unistd.h"])
 
 system = rffi.llexternal("system", [rffi.CCHARP], rffi.INT, compilation_info=eci)
 
 class CConfig:
     _compilation_info_ = eci
+    FD_CLOEXEC         = platform.DefinedConstantInteger("FD_CLOEXEC")
+    F_SETFD            = platform.DefinedConstantInteger("F_SETFD")
+    WNOHANG            = platform.DefinedConstantInteger("WNOHANG")
+    posix_spawn_file_actions_t = platform.Struct("posix_spawn_file_actions_t", [])
 
 cconfig = platform.configure(CConfig)
 
+FD_CLOEXEC    = cconfig["FD_CLOEXEC"]
+F_SETFD       = cconfig["F_SETFD"]
+WNOHANG       = cconfig["WNOHANG"]
+FILE_ACTIONSP = lltype.Ptr(cconfig["posix_spawn_file_actions_t"])
+
+fcntl         = rffi.llexternal("fcntl", [rffi.INT, rffi.INT, rffi.INT], rffi.INT, \
+                  compilation_info=eci)
+posix_spawnp  = rffi.llexternal("posix_spawnp", [rffi.CArrayPtr(rffi.PID_T), rffi.CCHARP, \
+                  FILE_ACTIONSP, rffi.VOIDP, rffi.CCHARPP, rffi.CCHARPP], rffi.INT, \
+                  compilation_info=eci)
+file_actions_init = rffi.llexternal("posix_spawn_file_actions_init", [FILE_ACTIONSP], rffi.INT, \
+                  compilation_info=eci)
+file_actions_destroy = rffi.llexternal("posix_spawn_file_actions_destroy", [FILE_ACTIONSP], \
+                  rffi.INT, compilation_info=eci)
+file_actions_adddup2 = rffi.llexternal("posix_spawn_file_actions_adddup2", [FILE_ACTIONSP, \
+                  rffi.INT, rffi.INT], rffi.INT, compilation_info=eci)
+if platform.has("posix_spawn_file_actions_addchdir_np", "#include <spawn.h>"):
+    HAS_ADDCHDIR = True
+    file_actions_addchdir = rffi.llexternal("posix_spawn_file_actions_addchdir_np", \
+                  [FILE_ACTIONSP, rffi.CCHARP], rffi.INT, compilation_info=eci)
+else:
+    HAS_ADDCHDIR = False
+
 
 
 def init(vm):
     return new_c_con_module(vm, "C_Platform_Exec", "C_Platform_Exec", __file__, import_, \
-      ["sh_cmd"])
+      ["Pool", "Process", "sh_cmd", "spawn"])
 
 
 @con_object_proc
 def import_(vm):
     (mod,),_ = vm.decode_args("O")
     
+    bootstrap_pool_class(vm, mod)
+    bootstrap_process_class(vm, mod)
     new_c_con_func_for_mod(vm, "sh_cmd", sh_cmd, mod)
+    new_c_con_func_for_mod(vm, "spawn", spawn, mod)
     
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -58,8 +88,310 @@ def sh_cmd(vm):
     (cmd_o,),_ = vm.decode_args("S")
     assert isinstance(cmd_o, Con_String)
 
-    r = system(cmd_o.v)
+    r = system(cmd_o.as_str())
     if r == -1:
         vm.raise_helper("Exception", [Con_String(vm, os.strerror(rposix.get_saved_errno()))])
 
     return Con_Int(vm, os.WEXITSTATUS(r))
+
+
+@con_object_proc
+def spawn(vm):
+    mod = vm.get_funcs_mod()
+    (argv_o, env_o, cwd_o, capture_o),_ = vm.decode_args("O", opt="ooi")
+
+    capture = capture_o is None or type_check_int(vm, capture_o).v != 0
+    p = _spawn(vm, _strs(vm, argv_o), env_o, cwd_o, capture)
+    return Process(vm, mod.get_defn(vm, "Process"), p)
+
+
+
+################################################################################
+# class Process
+#
+
+# Exit statuses of processes reaped by Pool.map which were not its own: {pid: status}.
+_reaped = {}
+
+
+class _Spawned(object):
+    __slots__ = ("pid", "stdin", "stdout", "stderr")
+
+    def __init__(self, pid, stdin, stdout, stderr):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class Process(Con_Boxed_Object):
+    __slots__ = ("pid", "exit_code", "exited")
+    _immutable_fields_ = ("pid",)
+
+
+    def __init__(self, vm, instance_of, p):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.pid = p.pid
+        self.exit_code = 0
+        self.exited = False
+        
+        self.set_slot(vm, "pid", Con_Int(vm, p.pid))
+        self.set_slot(vm, "stdin", _fd_to_file(vm, p.stdin, "w"))
+        self.set_slot(vm, "stdout", _fd_to_file(vm, p.stdout, "r"))
+        self.set_slot(vm, "stderr", _fd_to_file(vm, p.stderr, "r"))
+
+
+    def waitpid(self, vm, options):
+        # Returns True if the process has exited (setting exit_code), or False if options includes
+        # WNOHANG and it is still running.
+        if self.exited:
+            return True
+        pid = 0
+        status = 0
+        try:
+            pid, status = os.waitpid(self.pid, options)
+        except OSError, e:
+            if e.errno != errno.ECHILD or self.pid not in _reaped:
+                vm.raise_helper("Exception", [Con_String(vm, os.strerror(e.errno))])
+            # A Pool has already reaped this process.
+            pid = self.pid
+            status = _reaped[self.pid]
+            del _reaped[self.pid]
+        if pid == 0:
+            return False
+        self.exit_code = _exit_code(status)
+        self.exited = True
+        return True
+
+
+@con_object_proc
+def Process_poll(vm):
+    (self,),_ = vm.decode_args("!", self_of=Process)
+    assert isinstance(self, Process)
+
+    if not self.waitpid(vm, WNOHANG):
+        return vm.get_builtin(BUILTIN_FAIL_OBJ)
+    return Con_Int(vm, self.exit_code)
+
+
+@con_object_proc
+def Process_wait(vm):
+    (self,),_ = vm.decode_args("!", self_of=Process)
+    assert isinstance(self, Process)
+
+    self.waitpid(vm, 0)
+    return Con_Int(vm, self.exit_code)
+
+
+def bootstrap_process_class(vm, mod):
+    process_class = Con_Class(vm, Con_String(vm, "Process"), \
+      [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
+    mod.set_defn(vm, "Process", process_class)
+
+    new_c_con_func_for_class(vm, "poll", Process_poll, process_class)
+    new_c_con_func_for_class(vm, "wait", Process_wait, process_class)
+
+
+
+################################################################################
+# class Pool
+#
+
+class Pool(Con_Boxed_Object):
+    __slots__ = ("n",)
+    _immutable_fields_ = ("n",)
+
+
+    def __init__(self, vm, instance_of, n):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.n = n
+
+
+@con_object_proc
+def _new_func_Pool(vm):
+    (class_, n_o),_ = vm.decode_args("CI")
+    assert isinstance(n_o, Con_Int)
+
+    if n_o.v < 1:
+        vm.raise_helper("Parameters_Exception", \
+          [Con_String(vm, "Pool size must be at least 1.")])
+    p_o = Pool(vm, class_, n_o.v)
+    vm.get_slot_apply(p_o, "init", [n_o])
+
+    return p_o
+
+
+@con_object_proc
+def Pool_map(vm):
+    (self, argvs_o),_ = vm.decode_args("!O", self_of=Pool)
+    assert isinstance(self, Pool)
+
+    argvs = []
+    vm.pre_get_slot_apply_pump(argvs_o, "iter")
+    while 1:
+        argv_o = vm.apply_pump()
+        if not argv_o:
+            break
+        argvs.append(_strs(vm, argv_o))
+
+    # At most n children run at once. Whenever one exits, the next command is started. The pool
+    # blocks until any child exits: if that child is not one of the pool's (e.g. it was started by
+    # another thread), its status is put in _reaped for its Process to pick up.
+    codes = [0] * len(argvs)
+    running = {}
+    i = 0
+    try:
+        while i < len(argvs) or len(running) > 0:
+            while i < len(argvs) and len(running) < self.n:
+                p = _spawn(vm, argvs[i], None, None, False)
+                running[p.pid] = i
+                i += 1
+            pid = 0
+            status = 0
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                vm.raise_helper("Exception", [Con_String(vm, os.strerror(e.errno))])
+            if pid in running:
+                codes[running[pid]] = _exit_code(status)
+                del running[pid]
+            else:
+                _reaped[pid] = status
+    finally:
+        # If a child could not be started, or waiting failed, the children still running are
+        # reaped so that they do not become zombies.
+        for pid in running.keys():
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+    return Con_List(vm, [Con_Int(vm, c) for c in codes])
+
+
+def bootstrap_pool_class(vm, mod):
+    pool_class = Con_Class(vm, Con_String(vm, "Pool"), [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
+    mod.set_defn(vm, "Pool", pool_class)
+    pool_class.new_func = new_c_con_func(vm, Con_String(vm, "new_Pool"), False, _new_func_Pool, mod)
+
+    new_c_con_func_for_class(vm, "map", Pool_map, pool_class)
+
+
+
+################################################################################
+# Helpers
+#
+
+def _strs(vm, l_o):
+    l = []
+    vm.pre_get_slot_apply_pump(l_o, "iter")
+    while 1:
+        e_o = vm.apply_pump()
+        if not e_o:
+            break
+        l.append(type_check_string(vm, e_o).as_str())
+    return l
+
+
+def _exit_code(status):
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return -os.WTERMSIG(status)
+
+
+def _fd_to_file(vm, fd, mode):
+    if fd == -1:
+        return vm.get_builtin(BUILTIN_NULL_OBJ)
+    file_class = vm.get_builtin(BUILTIN_C_FILE_MODULE).get_defn(vm, "File")
+    return vm.get_slot_apply(file_class, "new", [Con_Int(vm, fd), Con_String(vm, mode)])
+
+
+def _pipe(vm):
+    # Returns a pipe whose ends are closed on exec; the ends dup2'd into a child are not.
+    r = w = -1
+    try:
+        r, w = os.pipe()
+    except OSError, e:
+        vm.raise_helper("Exception", [Con_String(vm, os.strerror(e.errno))])
+    fcntl(r, F_SETFD, FD_CLOEXEC)
+    fcntl(w, F_SETFD, FD_CLOEXEC)
+    return r, w
+
+
+def _spawn(vm, argv, env_o, cwd_o, capture):
+    # Starts argv[0] (searching PATH) directly, without a shell. If env_o is a dictionary, it is
+    # used as the child's environment; if cwd_o is a string, the child starts in that directory.
+    # If capture is True, the child's stdin, stdout and stderr are pipes to the parent.
+    if len(argv) == 0:
+        vm.raise_helper("Parameters_Exception", [Con_String(vm, "argv must not be empty.")])
+
+    if env_o is None:
+        envs = ["%s=%s" % (k, v) for (k, v) in os.environ.items()]
+    else:
+        env_o = type_check_dict(vm, env_o)
+        envs = []
+        for k_o, v_o in env_o.d.items():
+            envs.append("%s=%s" % (type_check_string(vm, k_o).as_str(), \
+              type_check_string(vm, v_o).as_str()))
+
+    cwd = None
+    old_cwd = None
+    if cwd_o is not None:
+        cwd = type_check_string(vm, cwd_o).as_str()
+        if not HAS_ADDCHDIR:
+            # Without posix_spawn_file_actions_addchdir_np, the child inherits the parent's
+            # directory, which is temporarily changed.
+            old_cwd = os.getcwd()
+            try:
+                os.chdir(cwd)
+            except OSError, e:
+                vm.raise_helper("Exception", \
+                  [Con_String(vm, "%s: %s." % (cwd, os.strerror(e.errno)))])
+
+    stdin = stdout = stderr = -1
+    child_fds = []
+    err = -1
+    fa = lltype.malloc(FILE_ACTIONSP.TO, flavor="raw")
+    file_actions_init(fa)
+    try:
+        if capture:
+            r, stdin = _pipe(vm)
+            child_fds.append(r)
+            file_actions_adddup2(fa, r, 0)
+            stdout, w = _pipe(vm)
+            child_fds.append(w)
+            file_actions_adddup2(fa, w, 1)
+            stderr, w2 = _pipe(vm)
+            child_fds.append(w2)
+            file_actions_adddup2(fa, w2, 2)
+        if cwd is not None and HAS_ADDCHDIR:
+            file_actions_addchdir(fa, cwd)
+
+        argvp = rffi.liststr2charpp(argv)
+        envp = rffi.liststr2charpp(envs)
+        with lltype.scoped_alloc(rffi.CArray(rffi.PID_T), 1) as pidp:
+            err = rarithmetic.intmask(posix_spawnp(pidp, argv[0], fa, \
+              lltype.nullptr(rffi.VOIDP.TO), argvp, envp))
+            pid = rarithmetic.intmask(pidp[0])
+        rffi.free_charpp(envp)
+        rffi.free_charpp(argvp)
+    finally:
+        file_actions_destroy(fa)
+        lltype.free(fa, flavor="raw")
+        for fd in child_fds:
+            os.close(fd)
+        if err != 0:
+            # Either the spawn failed, or a _pipe failed part way: either way, the parent's ends
+            # of any pipes already opened must not leak.
+            for fd in [stdin, stdout, stderr]:
+                if fd != -1:
+                    os.close(fd)
+        if old_cwd is not None:
+            os.chdir(old_cwd)
+
+    if err != 0:
+        vm.raise_helper("Exception", [Con_String(vm, "%s: %s." % (argv[0], os.strerror(err)))])
+
+    return _Spawned(pid, stdin, stdout, stderr)
@@ -19,6 +19,7 @@
 # IN THE SOFTWARE.
 
 
+from rpython.rlib.rstring import StringBuilder
 from Builtins import *
 
 
@@ -26,29 +27,204 @@ from Builtins import *
 
 def init(vm):
     return new_c_con_module(vm, "C_Strings", "C_Strings", __file__, import_, \
-      ["join"])
+      ["escape", "join", "replace_many", "split", "translate"])
 
 
 @con_object_proc
 def import_(vm):
     (mod,),_ = vm.decode_args("O")
     
+    new_c_con_func_for_mod(vm, "escape", escape, mod)
     new_c_con_func_for_mod(vm, "join", join, mod)
+    new_c_con_func_for_mod(vm, "replace_many", replace_many, mod)
+    new_c_con_func_for_mod(vm, "split", split, mod)
+    new_c_con_func_for_mod(vm, "translate", translate, mod)
     
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+
+################################################################################
+# Character tables
+#
+
+# A character table is a 256 element list, indexed by character, of replacement strings (or None
+# if a character is to be left as-is).
+
+_XML_ENTITIES = [None] * 256
+_XML_ENTITIES[ord("&")] = "&amp;"
+_XML_ENTITIES[ord("<")] = "&lt;"
+_XML_ENTITIES[ord(">")] = "&gt;"
+_XML_ENTITIES[ord("'")] = "&apos;"
+_XML_ENTITIES[ord("\"")] = "&quot;"
+
+
+def _dict_to_char_table(vm, map_o):
+    map_o = type_check_dict(vm, map_o)
+    tbl = [None] * 256
+    for k_o, v_o in map_o.d.iteritems():
+        k = type_check_string(vm, k_o).as_str()
+        if len(k) != 1:
+            vm.raise_helper("Parameters_Exception", \
+              [Con_String(vm, "Key '%s' is not a single character." % k)])
+        tbl[ord(k[0])] = type_check_string(vm, v_o).as_str()
+    return tbl
+
+
+def _translate(vm, s_o, tbl):
+    s = s_o.as_str()
+    s_len = len(s)
+    i = 0
+    while i < s_len:
+        if tbl[ord(s[i])] is not None:
+            break
+        i += 1
+    else:
+        # Nothing needs replacing, and since strings are immutable, s_o can be returned as-is.
+        return s_o
+
+    b = StringBuilder(s_len + s_len // 8)
+    j = 0 # Start of the run of unreplaced characters.
+    while i < s_len:
+        r = tbl[ord(s[i])]
+        if r is not None:
+            b.append_slice(s, j, i)
+            b.append(r)
+            j = i + 1
+        i += 1
+    b.append_slice(s, j, s_len)
+
+    return Con_String(vm, b.build())
+
+
+@con_object_proc
+def escape(vm):
+    (s_o, entities_o),_ = vm.decode_args("S", opt="D")
+    assert isinstance(s_o, Con_String)
+
+    if entities_o is None:
+        tbl = _XML_ENTITIES
+    else:
+        tbl = _dict_to_char_table(vm, entities_o)
+
+    return _translate(vm, s_o, tbl)
+
+
+@con_object_proc
+def translate(vm):
+    (s_o, map_o),_ = vm.decode_args("SD")
+    assert isinstance(s_o, Con_String)
+
+    return _translate(vm, s_o, _dict_to_char_table(vm, map_o))
+
+
+
+################################################################################
+# Other functions
+#
+
 @con_object_proc
 def join(vm):
     (list_o, sep_o),_ = vm.decode_args("OS")
     assert isinstance(sep_o, Con_String)
     
     out = []
-    vm.pre_get_slot_apply_pump(list_o, "iter")
-    while 1:
-        e_o = vm.apply_pump()
-        if not e_o:
+    if isinstance(list_o, Con_List):
+        for e_o in list_o.l:
+            out.append(type_check_string(vm, e_o).as_str())
+    else:
+        vm.pre_get_slot_apply_pump(list_o, "iter")
+        while 1:
+            e_o = vm.apply_pump()
+            if not e_o:
+                break
+            out.append(type_check_string(vm, e_o).as_str())
+
+    return Con_String(vm, sep_o.as_str().join(out))
+
+
+@con_object_proc
+def replace_many(vm):
+    (s_o, olds_o, news_o),_ = vm.decode_args("SLL")
+    assert isinstance(s_o, Con_String)
+    assert isinstance(olds_o, Con_List)
+    assert isinstance(news_o, Con_List)
+
+    if len(olds_o.l) != len(news_o.l):
+        vm.raise_helper("Parameters_Exception", \
+          [Con_String(vm, "Lists of old and new strings must be the same length.")])
+
+    olds = [type_check_string(vm, x).as_str() for x in olds_o.l]
+    news = [type_check_string(vm, x).as_str() for x in news_o.l]
+    # For each character, the indexes (in order) of the old strings which start with it.
+    firsts = [None] * 256
+    for k in range(len(olds)):
+        old = olds[k]
+        if len(old) == 0:
+            vm.raise_helper("Parameters_Exception", [Con_String(vm, "Empty old string.")])
+        c = ord(old[0])
+        if firsts[c] is None:
+            firsts[c] = [k]
+        else:
+            firsts[c].append(k)
+
+    s = s_o.as_str()
+    s_len = len(s)
+    b = StringBuilder(s_len)
+    i = 0
+    j = 0 # Start of the run of unreplaced characters.
+    while i < s_len:
+        cnds = firsts[ord(s[i])]
+        if cnds is not None:
+            for k in cnds:
+                old = olds[k]
+                end = i + len(old)
+                assert end >= 0
+                if end <= s_len and s.find(old, i, end) == i:
+                    b.append_slice(s, j, i)
+                    b.append(news[k])
+                    i = j = end
+                    break
+            else:
+                i += 1
+        else:
+            i += 1
+    if j == 0:
+        return s_o
+    b.append_slice(s, j, s_len)
+
+    return Con_String(vm, b.build())
+
+
+@con_object_proc
+def split(vm):
+    (s_o, sep_o, limit_o),_ = vm.decode_args("SS", opt="I")
+    assert isinstance(s_o, Con_String)
+    assert isinstance(sep_o, Con_String)
+
+    if limit_o is None:
+        limit = -1
+    else:
+        limit = type_check_int(vm, limit_o).v
+
+    s = s_o.as_str()
+    s_len = len(s)
+    sep = sep_o.as_str()
+    sep_len = len(sep)
+    if sep_len == 0:
+        vm.raise_helper("Parameters_Exception", [Con_String(vm, "Empty separator.")])
+
+    out = []
+    i = 0
+    while limit != 0:
+        j = s.find(sep, i, s_len)
+        if j == -1:
             break
-        out.append(type_check_string(vm, e_o).v)
+        out.append(new_con_string_slice(vm, s_o, i, j))
+        i = j + sep_len
+        assert i >= 0
+        limit -= 1
+    if i < s_len:
+        out.append(new_con_string_slice(vm, s_o, i, s_len))
 
-    return Con_String(vm, sep_o.v.join(out))
+    return Con_List(vm, out)
@@ -19,7 +19,8 @@
 # IN THE SOFTWARE.
 
 
-from rpython.rlib import rarithmetic
+import errno
+from rpython.rlib import rarithmetic, rposix
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rtyper.tool import rffi_platform as platform
 from rpython.translator.tool.cbuild import ExternalCompilationInfo
@@ -47,6 +48,8 @@ TIMESPECP       = lltype.Ptr(TIMESPEC)
 CLOCK_MONOTONIC = cconfig["CLOCK_MONOTONIC"]
 
 gettimeofday    = rffi.llexternal('gettimeofday', [TIMEVALP, TIMEZONEP], rffi.INT, compilation_info=eci)
+nanosleep       = rffi.llexternal('nanosleep', [TIMESPECP, TIMESPECP], rffi.INT, compilation_info=eci, \
+                    save_err=rffi.RFFI_SAVE_ERRNO)
 if platform.has("clock_gettime", "#include <sys/time.h>"):
     HAS_CLOCK_GETTIME = True
     clock_gettime   = rffi.llexternal('clock_gettime', [rffi.INT, TIMESPECP], rffi.INT, compilation_info=eci)
@@ -56,7 +59,7 @@ else:
 
 def init(vm):
     return new_c_con_module(vm, "C_Time", "C_Time", __file__, import_, \
-      ["current", "current_mono"])
+      ["current", "current_mono", "sleep"])
 
 
 @con_object_proc
@@ -70,6 +73,7 @@ def import_(vm):
         # OS X, and maybe other OSs, doesn't have clock_gettime, so we fall back on a less accurate
         # timing method as being better than nothing.
         new_c_con_func_for_mod(vm, "current_mono", current, mod)
+    new_c_con_func_for_mod(vm, "sleep", sleep, mod)
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -98,3 +102,25 @@ def current_mono(vm):
         nsec = rarithmetic.r_int(ts.c_tv_nsec)
 
     return Con_List(vm, [Con_Int(vm, sec), Con_Int(vm, nsec)])
+
+
+@con_object_proc
+def sleep(vm):
+    (sec_o, nsec_o),_ = vm.decode_args("II")
+    assert isinstance(sec_o, Con_Int)
+    assert isinstance(nsec_o, Con_Int)
+    if sec_o.v < 0 or nsec_o.v < 0 or nsec_o.v >= 1000000000:
+        vm.raise_helper("Parameters_Exception", [Con_String(vm, "Invalid sleep time.")])
+
+    # Other threads can run while this one sleeps, as nanosleep releases the GIL.
+    with lltype.scoped_alloc(TIMESPEC) as req:
+        with lltype.scoped_alloc(TIMESPEC) as rem:
+            rffi.setintfield(req, "c_tv_sec", sec_o.v)
+            rffi.setintfield(req, "c_tv_nsec", nsec_o.v)
+            while nanosleep(req, rem) != 0:
+                if rposix.get_saved_errno() != errno.EINTR:
+                    raise Exception("XXX")
+                rffi.setintfield(req, "c_tv_sec", rffi.getintfield(rem, "c_tv_sec"))
+                rffi.setintfield(req, "c_tv_nsec", rffi.getintfield(rem, "c_tv_nsec"))
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
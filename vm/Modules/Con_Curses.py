@@ -116,9 +116,9 @@ def tigetstr_func(vm):
     assert isinstance(capname_o, Con_String)
 
     if HAVE_CURSES:
-        r = tigetstr(capname_o.v)
+        r = tigetstr(capname_o.as_str())
         if rffi.cast(rffi.LONG, r) == -1 or rffi.cast(rffi.LONG, r) == -1:
-            msg = "'%s' not found or absent." % capname_o.v
+            msg = "'%s' not found or absent." % capname_o.as_str()
             cex_class = mod.get_defn(vm, "Curses_Exception")
             vm.raise_(vm.get_slot_apply(cex_class, "new", [Con_String(vm, msg)]))
         return Con_String(vm, rffi.charp2str(r))
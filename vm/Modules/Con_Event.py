@@ -0,0 +1,635 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+import errno, os, time
+from rpython.rlib import rarithmetic, rposix, rsocket
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rtyper.tool import rffi_platform as platform
+from rpython.translator.tool.cbuild import ExternalCompilationInfo
+from Builtins import *
+
+
+
+MAX_EVENTS = 256
+
+
+eci         = ExternalCompilationInfo(includes=["fcntl.h", "unistd.h"])
+c_close     = rffi.llexternal("close", [rffi.INT], rffi.INT, compilation_info=eci, releasegil=False)
+fcntl       = rffi.llexternal("fcntl", [rffi.INT, rffi.INT, rffi.INT], rffi.INT, \
+                compilation_info=eci, save_err=rffi.RFFI_SAVE_ERRNO)
+class CConfig:
+    _compilation_info_ = eci
+    F_GETFL            = platform.DefinedConstantInteger("F_GETFL")
+    F_SETFL            = platform.DefinedConstantInteger("F_SETFL")
+    O_NONBLOCK         = platform.DefinedConstantInteger("O_NONBLOCK")
+cconfig = platform.configure(CConfig)
+
+F_GETFL    = cconfig["F_GETFL"]
+F_SETFL    = cconfig["F_SETFL"]
+O_NONBLOCK = cconfig["O_NONBLOCK"]
+
+if platform.has("epoll_create", "#include <sys/epoll.h>"):
+    HAS_EPOLL = True
+    epoll_eci  = ExternalCompilationInfo(includes=["sys/epoll.h"])
+    class EpollConfig:
+        _compilation_info_ = epoll_eci
+        EPOLLERR           = platform.DefinedConstantInteger("EPOLLERR")
+        EPOLLHUP           = platform.DefinedConstantInteger("EPOLLHUP")
+        EPOLLIN            = platform.DefinedConstantInteger("EPOLLIN")
+        EPOLLOUT           = platform.DefinedConstantInteger("EPOLLOUT")
+        EPOLL_CTL_ADD      = platform.DefinedConstantInteger("EPOLL_CTL_ADD")
+        EPOLL_CTL_DEL      = platform.DefinedConstantInteger("EPOLL_CTL_DEL")
+        EPOLL_CTL_MOD      = platform.DefinedConstantInteger("EPOLL_CTL_MOD")
+        epoll_data         = platform.Struct("union epoll_data", [("fd", rffi.INT)])
+    cconfig = platform.configure(EpollConfig)
+
+    EPOLLERR      = cconfig["EPOLLERR"]
+    EPOLLHUP      = cconfig["EPOLLHUP"]
+    EPOLLIN       = cconfig["EPOLLIN"]
+    EPOLLOUT      = cconfig["EPOLLOUT"]
+    EPOLL_CTL_ADD = cconfig["EPOLL_CTL_ADD"]
+    EPOLL_CTL_DEL = cconfig["EPOLL_CTL_DEL"]
+    EPOLL_CTL_MOD = cconfig["EPOLL_CTL_MOD"]
+
+    # struct epoll_event is packed on some architectures, so its layout has to be determined by
+    # the C compiler, which in turn requires epoll_data to be known first.
+    class EpollEventConfig:
+        _compilation_info_ = epoll_eci
+        epoll_event        = platform.Struct("struct epoll_event", \
+                               [("events", rffi.UINT), ("data", cconfig["epoll_data"])])
+    cconfig = platform.configure(EpollEventConfig)
+
+    EPOLL_EVENT  = cconfig["epoll_event"]
+    EPOLL_EVENTS = rffi.CArray(EPOLL_EVENT)
+
+    epoll_create = rffi.llexternal("epoll_create", [rffi.INT], rffi.INT, \
+                     compilation_info=epoll_eci, save_err=rffi.RFFI_SAVE_ERRNO)
+    epoll_ctl    = rffi.llexternal("epoll_ctl", [rffi.INT, rffi.INT, rffi.INT, \
+                     lltype.Ptr(EPOLL_EVENT)], rffi.INT, compilation_info=epoll_eci, \
+                     save_err=rffi.RFFI_SAVE_ERRNO)
+    epoll_wait   = rffi.llexternal("epoll_wait", [rffi.INT, lltype.Ptr(EPOLL_EVENTS), rffi.INT, \
+                     rffi.INT], rffi.INT, compilation_info=epoll_eci, save_err=rffi.RFFI_SAVE_ERRNO)
+else:
+    HAS_EPOLL = False
+    # Loops can't be created without epoll, but Loop's methods are still translated, so they need
+    # stand-ins for the epoll names they use. The functions fail as the real ones would.
+    EPOLLERR      = 0
+    EPOLLHUP      = 0
+    EPOLLIN       = 0
+    EPOLLOUT      = 0
+    EPOLL_CTL_ADD = 0
+    EPOLL_CTL_DEL = 0
+    EPOLL_CTL_MOD = 0
+
+    EPOLL_EVENT  = lltype.Struct("epoll_event", ("c_events", rffi.UINT), \
+                     ("c_data", lltype.Struct("epoll_data", ("c_fd", rffi.INT))))
+    EPOLL_EVENTS = rffi.CArray(EPOLL_EVENT)
+
+    def epoll_create(size):
+        return rffi.cast(rffi.INT, -1)
+
+    def epoll_ctl(epfd, op, fd, event):
+        return rffi.cast(rffi.INT, -1)
+
+    def epoll_wait(epfd, events, maxevents, timeout):
+        return rffi.cast(rffi.INT, -1)
+
+
+
+def init(vm):
+    return new_c_con_module(vm, "Event", "Event", __file__, import_, \
+      ["Loop", "accept", "close", "local_port", "pipe", "read", "set_nonblocking", "tcp_connect",
+       "tcp_listen", "unix_connect", "unix_listen", "write"])
+
+
+@con_object_proc
+def import_(vm):
+    (mod,),_ = vm.decode_args("O")
+
+    bootstrap_loop_class(vm, mod)
+
+    new_c_con_func_for_mod(vm, "accept", accept, mod)
+    new_c_con_func_for_mod(vm, "close", close, mod)
+    new_c_con_func_for_mod(vm, "local_port", local_port, mod)
+    new_c_con_func_for_mod(vm, "pipe", pipe, mod)
+    new_c_con_func_for_mod(vm, "read", read, mod)
+    new_c_con_func_for_mod(vm, "set_nonblocking", set_nonblocking, mod)
+    new_c_con_func_for_mod(vm, "tcp_connect", tcp_connect, mod)
+    new_c_con_func_for_mod(vm, "tcp_listen", tcp_listen, mod)
+    new_c_con_func_for_mod(vm, "unix_connect", unix_connect, mod)
+    new_c_con_func_for_mod(vm, "unix_listen", unix_listen, mod)
+    new_c_con_func_for_mod(vm, "write", write, mod)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def _errno_raise(vm, en):
+    vm.raise_helper("IO_Exception", [Con_String(vm, os.strerror(en))])
+
+
+def _socket_raise(vm, e):
+    vm.raise_helper("IO_Exception", [Con_String(vm, e.get_msg())])
+
+
+
+################################################################################
+# class Loop
+#
+
+# A Loop waits (using epoll) for file descriptors to become readable or writable, and for timers to
+# expire, calling the function registered for each as it does so. Converge generators can only be
+# resumed by their caller, so callbacks rather than coroutines are the unit of scheduling.
+
+class _Handler(object):
+    __slots__ = ("read_func", "write_func")
+
+    def __init__(self):
+        self.read_func = None
+        self.write_func = None
+
+
+class _Timer(object):
+    __slots__ = ("deadline", "id", "func")
+
+    def __init__(self, deadline, id, func):
+        self.deadline = deadline
+        self.id = id
+        self.func = func
+
+
+class Loop(Con_Boxed_Object):
+    __slots__ = ("epfd", "events", "handlers", "timers", "next_timer_id", "stopped")
+    _immutable_fields_ = ("epfd", "events")
+
+
+    def __init__(self, vm, instance_of, epfd):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.epfd = epfd
+        self.events = lltype.malloc(EPOLL_EVENTS, MAX_EVENTS, flavor="raw")
+        self.handlers = {}
+        # Pending timers, ordered by deadline.
+        self.timers = []
+        self.next_timer_id = 0
+        self.stopped = False
+
+
+    def __del__(self):
+        c_close(self.epfd)
+        lltype.free(self.events, flavor="raw")
+
+
+    def update(self, vm, fd, had_events):
+        # Tells epoll about the events now wanted for fd, given that it previously wanted
+        # had_events.
+        events = _handler_events(self.handlers[fd])
+        if events == 0:
+            del self.handlers[fd]
+            op = EPOLL_CTL_DEL
+        elif had_events == 0:
+            op = EPOLL_CTL_ADD
+        else:
+            op = EPOLL_CTL_MOD
+        with lltype.scoped_alloc(EPOLL_EVENT) as ev:
+            rffi.setintfield(ev, "c_events", events)
+            rffi.setintfield(ev.c_data, "c_fd", fd)
+            if epoll_ctl(self.epfd, op, fd, ev) == -1:
+                _errno_raise(vm, rposix.get_saved_errno())
+
+
+def _handler_events(h):
+    events = 0
+    if h.read_func is not None:
+        events |= EPOLLIN
+    if h.write_func is not None:
+        events |= EPOLLOUT
+    return events
+
+
+@con_object_proc
+def _new_func_Loop(vm):
+    (class_,),_ = vm.decode_args("C")
+
+    if not HAS_EPOLL:
+        vm.raise_helper("IO_Exception", [Con_String(vm, "epoll is not available on this platform.")])
+        return vm.get_builtin(BUILTIN_NULL_OBJ)
+    epfd = rarithmetic.intmask(epoll_create(MAX_EVENTS))
+    if epfd == -1:
+        _errno_raise(vm, rposix.get_saved_errno())
+    l_o = Loop(vm, class_, epfd)
+    vm.get_slot_apply(l_o, "init")
+
+    return l_o
+
+
+@con_object_proc
+def Loop_call_later(vm):
+    (self, delay_o, func_o),_ = vm.decode_args("!NO", self_of=Loop)
+    assert isinstance(self, Loop)
+    assert isinstance(delay_o, Con_Number)
+
+    t = _Timer(time.time() + delay_o.as_float(), self.next_timer_id, func_o)
+    self.next_timer_id += 1
+    i = len(self.timers)
+    while i > 0 and self.timers[i - 1].deadline > t.deadline:
+        i -= 1
+    assert i >= 0
+    self.timers.insert(i, t)
+
+    return Con_Int(vm, t.id)
+
+
+@con_object_proc
+def Loop_cancel(vm):
+    (self, id_o),_ = vm.decode_args("!I", self_of=Loop)
+    assert isinstance(self, Loop)
+    assert isinstance(id_o, Con_Int)
+
+    for i in range(len(self.timers)):
+        if self.timers[i].id == id_o.v:
+            del self.timers[i]
+            return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+    return vm.get_builtin(BUILTIN_FAIL_OBJ)
+
+
+@con_object_proc
+def Loop_on_readable(vm):
+    (self, fd_o, func_o),_ = vm.decode_args("!Io", self_of=Loop)
+    assert isinstance(self, Loop)
+    assert isinstance(fd_o, Con_Int)
+
+    _set_handler(vm, self, fd_o.v, func_o, True)
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Loop_on_writable(vm):
+    (self, fd_o, func_o),_ = vm.decode_args("!Io", self_of=Loop)
+    assert isinstance(self, Loop)
+    assert isinstance(fd_o, Con_Int)
+
+    _set_handler(vm, self, fd_o.v, func_o, False)
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def _set_handler(vm, self, fd, func_o, read):
+    if fd in self.handlers:
+        h = self.handlers[fd]
+    elif func_o is None:
+        return
+    else:
+        h = _Handler()
+        self.handlers[fd] = h
+    had_events = _handler_events(h)
+    if read:
+        h.read_func = func_o
+    else:
+        h.write_func = func_o
+    if _handler_events(h) != had_events:
+        self.update(vm, fd, had_events)
+
+
+@con_object_proc
+def Loop_remove(vm):
+    (self, fd_o),_ = vm.decode_args("!I", self_of=Loop)
+    assert isinstance(self, Loop)
+    assert isinstance(fd_o, Con_Int)
+
+    fd = fd_o.v
+    if fd not in self.handlers:
+        return vm.get_builtin(BUILTIN_FAIL_OBJ)
+    h = self.handlers[fd]
+    had_events = _handler_events(h)
+    h.read_func = h.write_func = None
+    self.update(vm, fd, had_events)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Loop_run(vm):
+    (self,),_ = vm.decode_args("!", self_of=Loop)
+    assert isinstance(self, Loop)
+
+    self.stopped = False
+    while not self.stopped and (len(self.handlers) > 0 or len(self.timers) > 0):
+        if len(self.timers) > 0:
+            timeout = int((self.timers[0].deadline - time.time()) * 1000.0)
+            if timeout < 0:
+                timeout = 0
+        else:
+            timeout = -1
+        n = rarithmetic.intmask(epoll_wait(self.epfd, self.events, MAX_EVENTS, timeout))
+        if n == -1:
+            en = rposix.get_saved_errno()
+            if en == errno.EINTR:
+                continue
+            _errno_raise(vm, en)
+
+        for i in range(n):
+            ev = self.events[i]
+            fd = rarithmetic.intmask(rffi.getintfield(ev.c_data, "c_fd"))
+            events = rarithmetic.intmask(rffi.getintfield(ev, "c_events"))
+            fd_o = Con_Int(vm, fd)
+            # Errors and hang ups are reported as readiness, so that the callback discovers them
+            # when it next reads or writes. Earlier callbacks may have removed later handlers.
+            if events & (EPOLLIN | EPOLLERR | EPOLLHUP) and fd in self.handlers:
+                func_o = self.handlers[fd].read_func
+                if func_o is not None:
+                    vm.apply(func_o, [fd_o], allow_fail=True)
+            if events & (EPOLLOUT | EPOLLERR | EPOLLHUP) and fd in self.handlers:
+                func_o = self.handlers[fd].write_func
+                if func_o is not None:
+                    vm.apply(func_o, [fd_o], allow_fail=True)
+
+        now = time.time()
+        while len(self.timers) > 0 and self.timers[0].deadline <= now and not self.stopped:
+            t = self.timers.pop(0)
+            vm.apply(t.func, allow_fail=True)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Loop_stop(vm):
+    (self,),_ = vm.decode_args("!", self_of=Loop)
+    assert isinstance(self, Loop)
+
+    self.stopped = True
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def bootstrap_loop_class(vm, mod):
+    loop_class = Con_Class(vm, Con_String(vm, "Loop"), [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
+    mod.set_defn(vm, "Loop", loop_class)
+    loop_class.new_func = new_c_con_func(vm, Con_String(vm, "new_Loop"), False, _new_func_Loop, mod)
+
+    new_c_con_func_for_class(vm, "call_later", Loop_call_later, loop_class)
+    new_c_con_func_for_class(vm, "cancel", Loop_cancel, loop_class)
+    new_c_con_func_for_class(vm, "on_readable", Loop_on_readable, loop_class)
+    new_c_con_func_for_class(vm, "on_writable", Loop_on_writable, loop_class)
+    new_c_con_func_for_class(vm, "remove", Loop_remove, loop_class)
+    new_c_con_func_for_class(vm, "run", Loop_run, loop_class)
+    new_c_con_func_for_class(vm, "stop", Loop_stop, loop_class)
+
+
+
+################################################################################
+# Non-blocking file descriptors
+#
+
+# All file descriptors created by this module are non-blocking. Operations which would block fail
+# rather than wait.
+
+def _set_nonblocking(vm, fd):
+    flags = rarithmetic.intmask(fcntl(fd, F_GETFL, 0))
+    if flags == -1 or fcntl(fd, F_SETFL, flags | O_NONBLOCK) == -1:
+        _errno_raise(vm, rposix.get_saved_errno())
+
+
+def _socket_family(vm, fd):
+    # Returns AF_UNIX if fd is a Unix domain socket and AF_INET otherwise. A UNIX address is large
+    # enough to hold the address of any socket this module creates, and getsockname overwrites its
+    # family with the socket's real one.
+    s = rsocket.make_socket(fd, rsocket.AF_UNIX, rsocket.SOCK_STREAM, 0)
+    family = rsocket.AF_INET
+    try:
+        try:
+            addr = s.getsockname()
+            addr_p = addr.lock()
+            if rffi.cast(lltype.Signed, addr_p.c_sa_family) == rsocket.AF_UNIX:
+                family = rsocket.AF_UNIX
+            addr.unlock()
+        except rsocket.SocketError, e:
+            _socket_raise(vm, e)
+    finally:
+        s.detach()
+    return family
+
+
+@con_object_proc
+def accept(vm):
+    (fd_o,),_ = vm.decode_args("I")
+    assert isinstance(fd_o, Con_Int)
+
+    s = rsocket.make_socket(fd_o.v, _socket_family(vm, fd_o.v), rsocket.SOCK_STREAM, 0)
+    newfd = -1
+    try:
+        try:
+            newfd, _ = s.accept()
+        except rsocket.SocketError, e:
+            if isinstance(e, rsocket.CSocketError) and \
+              (e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK):
+                return vm.get_builtin(BUILTIN_FAIL_OBJ)
+            _socket_raise(vm, e)
+    finally:
+        s.detach()
+    _set_nonblocking(vm, newfd)
+
+    return Con_Int(vm, newfd)
+
+
+@con_object_proc
+def close(vm):
+    (fd_o,),_ = vm.decode_args("I")
+    assert isinstance(fd_o, Con_Int)
+
+    try:
+        os.close(fd_o.v)
+    except OSError, e:
+        _errno_raise(vm, e.errno)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def local_port(vm):
+    (fd_o,),_ = vm.decode_args("I")
+    assert isinstance(fd_o, Con_Int)
+
+    if _socket_family(vm, fd_o.v) != rsocket.AF_INET:
+        vm.raise_helper("IO_Exception", [Con_String(vm, "Not a TCP socket.")])
+    s = rsocket.make_socket(fd_o.v, rsocket.AF_INET, rsocket.SOCK_STREAM, 0)
+    port = 0
+    try:
+        try:
+            addr = s.getsockname()
+            assert isinstance(addr, rsocket.INETAddress)
+            port = addr.get_port()
+        except rsocket.SocketError, e:
+            _socket_raise(vm, e)
+    finally:
+        s.detach()
+
+    return Con_Int(vm, port)
+
+
+@con_object_proc
+def pipe(vm):
+    vm.decode_args()
+
+    r = w = -1
+    try:
+        r, w = os.pipe()
+    except OSError, e:
+        _errno_raise(vm, e.errno)
+    _set_nonblocking(vm, r)
+    _set_nonblocking(vm, w)
+
+    return Con_List(vm, [Con_Int(vm, r), Con_Int(vm, w)])
+
+
+@con_object_proc
+def read(vm):
+    (fd_o, n_o),_ = vm.decode_args("II")
+    assert isinstance(fd_o, Con_Int)
+    assert isinstance(n_o, Con_Int)
+
+    s = ""
+    try:
+        s = os.read(fd_o.v, n_o.v)
+    except OSError, e:
+        if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
+            return vm.get_builtin(BUILTIN_FAIL_OBJ)
+        _errno_raise(vm, e.errno)
+
+    return Con_String(vm, s)
+
+
+@con_object_proc
+def set_nonblocking(vm):
+    (fd_o,),_ = vm.decode_args("I")
+    assert isinstance(fd_o, Con_Int)
+
+    _set_nonblocking(vm, fd_o.v)
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def _connect(vm, s, addr):
+    # Starts a non-blocking connect of s to addr, returning s's fd. The fd becomes writable once the
+    # connection has been made.
+    try:
+        s.setblocking(False)
+        err = s.connect_ex(addr)
+        if err != 0 and err != errno.EINPROGRESS and err != errno.EAGAIN:
+            s.close()
+            _errno_raise(vm, err)
+    except rsocket.SocketError, e:
+        _socket_raise(vm, e)
+    return s.detach()
+
+
+def _listen(vm, s, addr, backlog):
+    try:
+        s.setsockopt_int(rsocket.SOL_SOCKET, rsocket.SO_REUSEADDR, 1)
+        s.bind(addr)
+        s.listen(backlog)
+        s.setblocking(False)
+    except rsocket.SocketError, e:
+        _socket_raise(vm, e)
+    return s.detach()
+
+
+@con_object_proc
+def tcp_connect(vm):
+    (host_o, port_o),_ = vm.decode_args("SI")
+    assert isinstance(host_o, Con_String)
+    assert isinstance(port_o, Con_Int)
+
+    fd = -1
+    try:
+        addr = rsocket.INETAddress(host_o.as_str(), port_o.v)
+        fd = _connect(vm, rsocket.RSocket(rsocket.AF_INET, rsocket.SOCK_STREAM), addr)
+    except rsocket.SocketError, e:
+        _socket_raise(vm, e)
+
+    return Con_Int(vm, fd)
+
+
+@con_object_proc
+def tcp_listen(vm):
+    (host_o, port_o, backlog_o),_ = vm.decode_args("SI", opt="I")
+    assert isinstance(host_o, Con_String)
+    assert isinstance(port_o, Con_Int)
+
+    if backlog_o is None:
+        backlog = 128
+    else:
+        backlog = type_check_int(vm, backlog_o).v
+    fd = -1
+    try:
+        addr = rsocket.INETAddress(host_o.as_str(), port_o.v)
+        fd = _listen(vm, rsocket.RSocket(rsocket.AF_INET, rsocket.SOCK_STREAM), addr, backlog)
+    except rsocket.SocketError, e:
+        _socket_raise(vm, e)
+
+    return Con_Int(vm, fd)
+
+
+@con_object_proc
+def unix_connect(vm):
+    (path_o,),_ = vm.decode_args("S")
+    assert isinstance(path_o, Con_String)
+
+    fd = -1
+    try:
+        addr = rsocket.UNIXAddress(path_o.as_str())
+        fd = _connect(vm, rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM), addr)
+    except rsocket.SocketError, e:
+        _socket_raise(vm, e)
+
+    return Con_Int(vm, fd)
+
+
+@con_object_proc
+def unix_listen(vm):
+    (path_o, backlog_o),_ = vm.decode_args("S", opt="I")
+    assert isinstance(path_o, Con_String)
+
+    if backlog_o is None:
+        backlog = 128
+    else:
+        backlog = type_check_int(vm, backlog_o).v
+    fd = -1
+    try:
+        addr = rsocket.UNIXAddress(path_o.as_str())
+        fd = _listen(vm, rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM), addr, backlog)
+    except rsocket.SocketError, e:
+        _socket_raise(vm, e)
+
+    return Con_Int(vm, fd)
+
+
+@con_object_proc
+def write(vm):
+    (fd_o, s_o),_ = vm.decode_args("IS")
+    assert isinstance(fd_o, Con_Int)
+    assert isinstance(s_o, Con_String)
+
+    n = 0
+    try:
+        n = os.write(fd_o.v, s_o.as_str())
+    except OSError, e:
+        if e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
+            return vm.get_builtin(BUILTIN_FAIL_OBJ)
+        _errno_raise(vm, e.errno)
+
+    return Con_Int(vm, n)
@@ -93,7 +93,7 @@ def _mk_simple_exception(vm, mod, n, init_func=None, superclass=None):
 @con_object_proc
 def _Apply_Exception_init_func(vm):
     (self, o_o),_ = vm.decode_args("OO")
-    p = type_check_string(vm, vm.get_slot_apply(o_o.get_slot(vm, "instance_of"), "path")).v
+    p = type_check_string(vm, vm.get_slot_apply(o_o.get_slot(vm, "instance_of"), "path")).as_str()
     self.set_slot(vm, "msg", Con_String(vm, "Do not know how to apply instance of '%s'." % p))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -115,8 +115,8 @@ def _Bounds_Exception_init_func(vm):
 def _Field_Exception_init_func(vm):
     (self, n_o, class_o),_ = vm.decode_args("OSO")
     assert isinstance(n_o, Con_String)
-    classp = type_check_string(vm, vm.get_slot_apply(class_o, "path")).v
-    msg = "No such field '%s' in class '%s'." % (n_o.v, classp)
+    classp = type_check_string(vm, vm.get_slot_apply(class_o, "path")).as_str()
+    msg = "No such field '%s' in class '%s'." % (n_o.as_str(), classp)
     self.set_slot(vm, "msg", Con_String(vm, msg))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -125,7 +125,7 @@ def _Field_Exception_init_func(vm):
 def _Import_Exception_init_func(vm):
     (self, mod_id),_ = vm.decode_args("OS")
     assert isinstance(mod_id, Con_String)
-    self.set_slot(vm, "msg", Con_String(vm, "Unable to import '%s'." % mod_id.v))
+    self.set_slot(vm, "msg", Con_String(vm, "Unable to import '%s'." % mod_id.as_str()))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
@@ -143,7 +143,7 @@ def _Indices_Exception_init_func(vm):
 def _Key_Exception_init_func(vm):
     (self, k),_ = vm.decode_args("OO")
     k_s = type_check_string(vm, vm.get_slot_apply(k, "to_str"))
-    self.set_slot(vm, "msg", Con_String(vm, "Key '%s' not found." % k_s.v))
+    self.set_slot(vm, "msg", Con_String(vm, "Key '%s' not found." % k_s.as_str()))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
@@ -151,7 +151,7 @@ def _Key_Exception_init_func(vm):
 def _Number_Exception_init_func(vm):
     (self, o),_ = vm.decode_args("OO")
     o_s = type_check_string(vm, vm.get_slot_apply(o, "to_str"))
-    self.set_slot(vm, "msg", Con_String(vm, "Number '%s' not valid." % o_s.v))
+    self.set_slot(vm, "msg", Con_String(vm, "Number '%s' not valid." % o_s.as_str()))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
@@ -160,7 +160,7 @@ def _Slot_Exception_init_func(vm):
     (self, n, o),_ = vm.decode_args("OSO")
     assert isinstance(n, Con_String)
     name = type_check_string(vm, o.get_slot(vm, "instance_of").get_slot(vm, "name"))
-    msg = "No such slot '%s' in instance of '%s'." % (n.v, name.v)
+    msg = "No such slot '%s' in instance of '%s'." % (n.as_str(), name.as_str())
     self.set_slot(vm, "msg", Con_String(vm, msg))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -178,12 +178,12 @@ def _Type_Exception_init_func(vm):
     assert isinstance(should_be, Con_String)
     if extra is not None:
         msg = "Expected '%s' to be conformant to " % \
-          type_check_string(vm, extra).v
+          type_check_string(vm, extra).as_str()
     else:
         msg = "Expected to be conformant to "
-    msg += should_be.v
+    msg += should_be.as_str()
     o_path = type_check_string(vm, vm.get_slot_apply(o.get_slot(vm, "instance_of"), "path"))
-    msg += ", but got instance of %s." % o_path.v
+    msg += ", but got instance of %s." % o_path.as_str()
     self.set_slot(vm, "msg", Con_String(vm, msg))
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -0,0 +1,400 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+
+from rpython.rlib.rarithmetic import LONG_BIT, intmask, r_uint, r_ulonglong
+from rpython.rlib.rstruct import ieee
+from rpython.rlib.rstring import StringBuilder
+from Builtins import *
+import Con_Array, Con_POSIX_File
+
+
+
+# Marshalled data starts with MAGIC followed by a one byte version number. The version must be
+# incremented whenever the format changes incompatibly.
+MAGIC   = "CVMA"
+VERSION = 1
+
+# dump_to writes its output whenever this many bytes have been encoded.
+DUMP_CHUNK_SIZE = 65536
+
+# Objects are encoded as a one byte tag followed by their contents. Ints (zigzag encoded, so that
+# small negative numbers are small too) and lengths are variable length, 7 bits per byte, least
+# significant first. Every String, List, Dict, Set and Array is numbered, in the order encoding of
+# it starts, as it is encoded; if it is encountered again, only a TAG_REF and its number are
+# written. This preserves sharing and allows cycles.
+
+TAG_NULL   = "n"
+TAG_INT    = "i"
+TAG_FLOAT  = "f"
+TAG_STRING = "s"
+TAG_LIST   = "l"
+TAG_DICT   = "d"
+TAG_SET    = "e"
+TAG_ARRAY  = "a"
+TAG_REF    = "r"
+
+
+
+def init(vm):
+    return new_c_con_module(vm, "Marshal", "Marshal", __file__, import_, \
+      ["Marshal_Exception", "dump_to", "dumps", "load_from", "loads"])
+
+
+@con_object_proc
+def import_(vm):
+    (mod,),_ = vm.decode_args("O")
+
+    class_class = vm.get_builtin(BUILTIN_CLASS_CLASS)
+    user_exception_class = vm.get_builtin(BUILTIN_EXCEPTIONS_MODULE). \
+      get_defn(vm, "User_Exception")
+    marshal_exception = vm.get_slot_apply(class_class, "new", \
+      [Con_String(vm, "Marshal_Exception"), Con_List(vm, [user_exception_class]), mod])
+    mod.set_defn(vm, "Marshal_Exception", marshal_exception)
+
+    new_c_con_func_for_mod(vm, "dump_to", dump_to, mod)
+    new_c_con_func_for_mod(vm, "dumps", dumps, mod)
+    new_c_con_func_for_mod(vm, "load_from", load_from, mod)
+    new_c_con_func_for_mod(vm, "loads", loads, mod)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def dump_to(vm):
+    (o, file_o),_ = vm.decode_args("OO")
+    f = _type_check_file(vm, file_o)
+
+    e = _Encoder(vm, f)
+    e.encode(o)
+    e.flush()
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def dumps(vm):
+    (o,),_ = vm.decode_args("O")
+
+    return Con_String(vm, dump_str(vm, o))
+
+
+@con_object_proc
+def load_from(vm):
+    (file_o,),_ = vm.decode_args("O")
+    f = _type_check_file(vm, file_o)
+
+    return _File_Decoder(vm, f).decode_all()
+
+
+@con_object_proc
+def loads(vm):
+    (s_o,),_ = vm.decode_args("S")
+    assert isinstance(s_o, Con_String)
+
+    return load_str(vm, s_o.as_str(), 0)
+
+
+def dump_str(vm, o):
+    # Returns the marshalled form of o.
+    e = _Encoder(vm, None)
+    e.encode(o)
+    return e.b.build()
+
+
+def load_str(vm, s, off):
+    # Returns the object marshalled in s, starting at offset off.
+    return _String_Decoder(vm, s, off).decode_all()
+
+
+def _type_check_file(vm, o):
+    file_class = vm.get_builtin(BUILTIN_C_FILE_MODULE).get_defn(vm, "File")
+    if not isinstance(o, Con_POSIX_File.File):
+        vm.raise_helper("Type_Exception", [file_class, o])
+    assert isinstance(o, Con_POSIX_File.File)
+    return o
+
+
+def _raise_marshal_exception(vm, msg):
+    mod = vm.get_mod("Marshal")
+    mex_class = mod.get_defn(vm, "Marshal_Exception")
+    vm.raise_(vm.get_slot_apply(mex_class, "new", [Con_String(vm, msg)]))
+
+
+
+################################################################################
+# Encoding
+#
+
+class _Encoder(object):
+    __slots__ = ("vm", "file", "b", "refs")
+
+    def __init__(self, vm, file):
+        # If file is not None, the encoded data is written to it as encoding progresses (though
+        # flush must be called once encoding has finished); otherwise it is left in b.
+        self.vm = vm
+        self.file = file
+        self.b = StringBuilder()
+        self.b.append(MAGIC)
+        self.b.append(chr(VERSION))
+        self.refs = {}
+
+
+    def encode(self, o):
+        vm = self.vm
+        b = self.b
+        if o is vm.get_builtin(BUILTIN_NULL_OBJ):
+            b.append(TAG_NULL)
+        elif isinstance(o, Con_Int):
+            b.append(TAG_INT)
+            v = o.v
+            self.encode_uint((r_uint(v) << 1) ^ r_uint(v >> (LONG_BIT - 1)))
+        elif isinstance(o, Con_Float):
+            b.append(TAG_FLOAT)
+            v = ieee.float_pack(o.v, 8)
+            for i in range(8):
+                b.append(chr(intmask(v & 0xFF)))
+                v >>= 8
+        elif o in self.refs:
+            b.append(TAG_REF)
+            self.encode_uint(r_uint(self.refs[o]))
+        elif isinstance(o, Con_String):
+            self.refs[o] = len(self.refs)
+            b.append(TAG_STRING)
+            self.encode_str(o.as_str())
+        elif isinstance(o, Con_List):
+            self.refs[o] = len(self.refs)
+            b.append(TAG_LIST)
+            self.encode_uint(r_uint(len(o.l)))
+            for e in o.l:
+                self.encode(e)
+        elif isinstance(o, Con_Dict):
+            self.refs[o] = len(self.refs)
+            b.append(TAG_DICT)
+            self.encode_uint(r_uint(len(o.d)))
+            for k, v in o.d.items():
+                self.encode(k)
+                self.encode(v)
+        elif isinstance(o, Con_Set):
+            self.refs[o] = len(self.refs)
+            b.append(TAG_SET)
+            self.encode_uint(r_uint(len(o.s)))
+            for e in o.s.keys():
+                self.encode(e)
+        elif isinstance(o, Con_Array.Array):
+            self.refs[o] = len(self.refs)
+            b.append(TAG_ARRAY)
+            self.encode_str(o.type_name)
+            self.encode_str(o.serialized())
+        else:
+            p = type_check_string(vm, vm.get_slot_apply(o.get_slot(vm, "instance_of"), "path"))
+            _raise_marshal_exception(vm, "Can not marshal instance of '%s'." % p.as_str())
+
+        if self.file is not None and self.b.getlength() >= DUMP_CHUNK_SIZE:
+            self.flush()
+
+
+    def encode_uint(self, v):
+        while v >= 0x80:
+            self.b.append(chr(intmask(v & 0x7F) | 0x80))
+            v >>= 7
+        self.b.append(chr(intmask(v)))
+
+
+    def encode_str(self, s):
+        self.encode_uint(r_uint(len(s)))
+        self.b.append(s)
+
+
+    def flush(self):
+        self.file.write_strs(self.vm, [self.b.build()], False)
+        self.b = StringBuilder()
+
+
+
+################################################################################
+# Decoding
+#
+# Decoders read straight from their source: _String_Decoder from a string, and _File_Decoder
+# from a file, reading no further than the end of the object it is decoding.
+
+class _Decoder(object):
+    __slots__ = ("vm", "refs")
+
+    def __init__(self, vm):
+        self.vm = vm
+        self.refs = []
+
+
+    def decode_all(self):
+        hd = self.read(len(MAGIC))
+        if hd != MAGIC:
+            _raise_marshal_exception(self.vm, "Not marshalled data.")
+        version = self.read_byte()
+        if version != VERSION:
+            _raise_marshal_exception(self.vm, "Unsupported marshal version %d." % version)
+        return self.decode()
+
+
+    def decode(self):
+        vm = self.vm
+        tag = chr(self.read_byte())
+        if tag == TAG_NULL:
+            return vm.get_builtin(BUILTIN_NULL_OBJ)
+        elif tag == TAG_INT:
+            v = self.decode_uint()
+            return Con_Int(vm, intmask(v >> 1) ^ -intmask(v & 1))
+        elif tag == TAG_FLOAT:
+            s = self.read(8)
+            v = r_ulonglong(0)
+            for i in range(7, -1, -1):
+                v = (v << 8) | r_ulonglong(ord(s[i]))
+            return Con_Float(vm, ieee.float_unpack(v, 8))
+        elif tag == TAG_STRING:
+            o = Con_String(vm, self.decode_str())
+            self.refs.append(o)
+            return o
+        elif tag == TAG_LIST:
+            # Containers are numbered before their elements are decoded, as the elements may refer
+            # back to them.
+            l = Con_List(vm, [])
+            self.refs.append(l)
+            for i in range(self.decode_len()):
+                l.l.append(self.decode())
+            return l
+        elif tag == TAG_DICT:
+            d = Con_Dict(vm, [])
+            self.refs.append(d)
+            for i in range(self.decode_len()):
+                k = self.decode()
+                d.d[k] = self.decode()
+            return d
+        elif tag == TAG_SET:
+            s = Con_Set(vm, [])
+            self.refs.append(s)
+            for i in range(self.decode_len()):
+                s.s[self.decode()] = None
+            return s
+        elif tag == TAG_ARRAY:
+            type_name = self.decode_str()
+            data = self.decode_str()
+            array_mod = vm.get_mod("Array")
+            array_mod.import_(vm)
+            a = Con_Array.Array(vm, array_mod.get_defn(vm, "Array"), type_name, \
+              Con_String(vm, data))
+            self.refs.append(a)
+            return a
+        elif tag == TAG_REF:
+            i = self.decode_len()
+            if i >= len(self.refs):
+                _raise_marshal_exception(vm, "Corrupt data.")
+            return self.refs[i]
+        else:
+            _raise_marshal_exception(vm, "Corrupt data.")
+            return None
+
+
+    def decode_uint(self):
+        v = r_uint(0)
+        shift = 0
+        while 1:
+            c = self.read_byte()
+            if shift >= LONG_BIT:
+                _raise_marshal_exception(self.vm, "Corrupt data.")
+            v |= r_uint(c & 0x7F) << shift
+            if c < 0x80:
+                return v
+            shift += 7
+
+
+    def decode_len(self):
+        n = intmask(self.decode_uint())
+        if n < 0:
+            _raise_marshal_exception(self.vm, "Corrupt data.")
+        return n
+
+
+    def decode_str(self):
+        return self.read(self.decode_len())
+
+
+    def read(self, n):
+        # Returns the next n bytes.
+        raise NotImplementedError
+
+
+    def read_byte(self):
+        # Returns the next byte as an integer.
+        raise NotImplementedError
+
+
+    def truncated(self):
+        _raise_marshal_exception(self.vm, "Truncated data.")
+
+
+
+class _String_Decoder(_Decoder):
+    __slots__ = ("s", "i")
+
+    def __init__(self, vm, s, i):
+        _Decoder.__init__(self, vm)
+        self.s = s
+        self.i = i
+
+
+    def read(self, n):
+        i = self.i
+        if n > len(self.s) - i:
+            self.truncated()
+        assert i >= 0 and n >= 0
+        self.i += n
+        return self.s[i:i + n]
+
+
+    def read_byte(self):
+        if self.i >= len(self.s):
+            self.truncated()
+        c = ord(self.s[self.i])
+        self.i += 1
+        return c
+
+
+
+class _File_Decoder(_Decoder):
+    __slots__ = ("file",)
+
+    def __init__(self, vm, file):
+        _Decoder.__init__(self, vm)
+        self.file = file
+
+
+    def read(self, n):
+        s = self.file.read_str(self.vm, n)
+        if len(s) < n:
+            self.truncated()
+        return s
+
+
+    def read_byte(self):
+        c = self.file.read_byte(self.vm)
+        if c == -1:
+            self.truncated()
+        return c
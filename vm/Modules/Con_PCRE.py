@@ -21,11 +21,13 @@
 
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rtyper.tool import rffi_platform as platform
+from rpython.rlib import rgc
 from rpython.rlib.rsre import rsre_re
 from rpython.translator.tool.cbuild import ExternalCompilationInfo
 import Config
 from Builtins import *
 from Core import *
+import Heap
 
 
 eci                        = ExternalCompilationInfo(includes=["pcre.h"], \
@@ -40,6 +42,7 @@ class CConfig:
     PCRE_DOTALL            = platform.DefinedConstantInteger("PCRE_DOTALL")
     PCRE_MULTILINE         = platform.DefinedConstantInteger("PCRE_MULTILINE")
     PCRE_INFO_CAPTURECOUNT = platform.DefinedConstantInteger("PCRE_INFO_CAPTURECOUNT")
+    PCRE_INFO_SIZE         = platform.DefinedConstantInteger("PCRE_INFO_SIZE")
     PCRE_ANCHORED          = platform.DefinedConstantInteger("PCRE_ANCHORED")
     PCRE_ERROR_NOMATCH     = platform.DefinedConstantInteger("PCRE_ERROR_NOMATCH")
 
@@ -49,6 +52,7 @@ PCREP                  = rffi.COpaquePtr("pcre")
 PCRE_DOTALL            = cconfig["PCRE_DOTALL"]
 PCRE_MULTILINE         = cconfig["PCRE_MULTILINE"]
 PCRE_INFO_CAPTURECOUNT = cconfig["PCRE_INFO_CAPTURECOUNT"]
+PCRE_INFO_SIZE         = cconfig["PCRE_INFO_SIZE"]
 PCRE_ANCHORED          = cconfig["PCRE_ANCHORED"]
 PCRE_ERROR_NOMATCH     = cconfig["PCRE_ERROR_NOMATCH"]
 
@@ -59,6 +63,9 @@ pcre_fullinfo = rffi.llexternal("pcre_fullinfo", \
 pcre_exec = rffi.llexternal("pcre_exec", \
   [PCREP, rffi.VOIDP, rffi.CCHARP, rffi.INT, rffi.INT, rffi.INT, rffi.INTP, rffi.INT], \
   rffi.INT, compilation_info=eci)
+# pcre_free is a function pointer variable, hence macro=True.
+pcre_free = rffi.llexternal("pcre_free", [PCREP], lltype.Void, compilation_info=eci, \
+  macro=True, releasegil=False)
 
 
 
@@ -94,6 +101,24 @@ class Pattern(Con_Boxed_Object):
         self.num_caps = num_caps
 
 
+class _Compiled(Heap.Raw_Memory):
+    # A compiled pattern, which PCRE allocated, and which is freed when the pattern is garbage
+    # collected.
+    __slots__ = ("data",)
+    _immutable_fields_ = ("data",)
+    RAW_KIND = "PCRE compiled patterns"
+
+    def __init__(self, data, size):
+        self.data = data
+        self.own(size, True)
+
+
+    @rgc.must_be_light_finalizer
+    def __del__(self):
+        self.disown()
+        pcre_free(self.data)
+
+
 @con_object_proc
 def Pattern_match(vm):
     return _Pattern_match_search(vm, True)
@@ -110,23 +135,29 @@ def _Pattern_match_search(vm, anchored):
     assert isinstance(self, Pattern)
     assert isinstance(s_o, Con_String)
     
-    ovect_size = (1 + self.num_caps) * 3
-    ovect = lltype.malloc(rffi.INTP.TO, ovect_size, flavor="raw")
     if anchored:
         flags = PCRE_ANCHORED
     else:
         flags = 0
-    sp = translate_idx_obj(vm, sp_o, len(s_o.v))
-    with rffi.scoped_nonmovingbuffer(s_o.v) as rs:
-        r = int(pcre_exec(self.cp, None, rs, len(s_o.v), sp, flags, ovect, ovect_size))
-    if r < 0:
-        if r == PCRE_ERROR_NOMATCH:
-            lltype.free(ovect, flavor="raw")
-            return vm.get_builtin(BUILTIN_FAIL_OBJ)
-        else:
-            raise Exception("XXX")
-            
-    return Match(vm, mod.get_defn(vm, "Match"), ovect, self.num_caps, s_o)
+    s = s_o.as_str()
+    sp = translate_idx_obj(vm, sp_o, len(s))
+    # PCRE needs an output vector 3 times the number of groups (including group 0), but only uses
+    # the first two thirds of it for the groups' offsets, which are then copied out of it. The vector
+    # is only needed for the duration of pcre_exec, so matches don't own any raw memory.
+    ovect_size = (1 + self.num_caps) * 3
+    offs = [0] * ((1 + self.num_caps) * 2)
+    with lltype.scoped_alloc(rffi.INTP.TO, ovect_size) as ovect:
+        with rffi.scoped_nonmovingbuffer(s) as rs:
+            r = int(pcre_exec(self.cp.data, None, rs, len(s), sp, flags, ovect, ovect_size))
+        if r < 0:
+            if r == PCRE_ERROR_NOMATCH:
+                return vm.get_builtin(BUILTIN_FAIL_OBJ)
+            else:
+                raise Exception("XXX")
+        for i in range(len(offs)):
+            offs[i] = int(ovect[i])
+
+    return Match(vm, mod.get_defn(vm, "Match"), offs, self.num_caps, s_o)
 
 
 def bootstrap_pattern_class(vm, mod):
@@ -153,7 +184,7 @@ def compile(vm):
     errptr = lltype.malloc(rffi.CCHARPP.TO, 1, flavor="raw")
     erroff = lltype.malloc(rffi.INTP.TO, 1, flavor="raw")
     try:
-        cp = pcre_compile(pat.v, PCRE_DOTALL | PCRE_MULTILINE, errptr, erroff, None)
+        cp = pcre_compile(pat.as_str(), PCRE_DOTALL | PCRE_MULTILINE, errptr, erroff, None)
         if cp is None:
             raise Exception("XXX")
     finally:
@@ -166,7 +197,13 @@ def compile(vm):
             raise Exception("XXX")
         num_caps = int(num_capsp[0])
 
-    return Pattern(vm, mod.get_defn(vm, "Pattern"), cp, num_caps)
+    with lltype.scoped_alloc(rffi.CArray(rffi.SIZE_T), 1) as sizep:
+        r = int(pcre_fullinfo(cp, None, PCRE_INFO_SIZE, rffi.cast(rffi.INTP, sizep)))
+        if r != 0:
+            raise Exception("XXX")
+        size = rffi.cast(lltype.Signed, sizep[0])
+
+    return Pattern(vm, mod.get_defn(vm, "Pattern"), _Compiled(cp, size), num_caps)
 
 
 
@@ -175,19 +212,18 @@ def compile(vm):
 #
 
 class Match(Con_Boxed_Object):
-    __slots__ = ("ovect", "num_caps", "s")
-    _immutable_fields_ = ("ovect", "num_caps", "s")
+    __slots__ = ("offs", "num_caps", "s")
+    _immutable_fields_ = ("offs[*]", "num_caps", "s")
 
 
-    def __init__(self, vm, instance_of, ovect, num_caps, s):
+    def __init__(self, vm, instance_of, offs, num_caps, s):
         Con_Boxed_Object.__init__(self, vm, instance_of)
-        self.ovect = ovect
+        # offs is a list of (start, end) offset pairs, one for each group (including group 0).
+        self.offs = offs
         self.num_caps = num_caps
         self.s = s
 
 
-    def __del__(self):
-        lltype.free(self.ovect, flavor="raw")
 
 
 @con_object_proc
@@ -200,9 +236,7 @@ def Match_get(vm):
 	# num_captures.
     i = translate_idx(vm, i_o.v, 1 + self.num_caps)
     
-    o = self.s.get_slice(vm, int(self.ovect[i * 2]), int(self.ovect[i * 2 + 1]))
-    objectmodel.keepalive_until_here(self)
-    return o
+    return self.s.get_slice(vm, self.offs[i * 2], self.offs[i * 2 + 1])
 
 
 @con_object_proc
@@ -213,9 +247,7 @@ def Match_get_indexes(vm):
     
     i = translate_idx(vm, i_o.v, 1 + self.num_caps)
     
-    o = Con_List(vm, [Con_Int(vm, int(self.ovect[i * 2])), Con_Int(vm, int(self.ovect[i * 2 + 1]))])
-    objectmodel.keepalive_until_here(self)
-    return o
+    return Con_List(vm, [Con_Int(vm, self.offs[i * 2]), Con_Int(vm, self.offs[i * 2 + 1])])
 
 
 def bootstrap_match_class(vm, mod):
@@ -19,29 +19,19 @@
 # IN THE SOFTWARE.
 
 
-import os
+import os, stat
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rtyper.tool import rffi_platform as platform
-from rpython.rlib import rarithmetic, rposix
+from rpython.rlib import rarithmetic, rgc, rposix, rposix_scandir
+from rpython.rlib.rstring import StringBuilder
 from rpython.translator.tool.cbuild import ExternalCompilationInfo
 from Builtins import *
-import Stdlib_Modules
+import Con_Array, Stdlib_Modules
 
 
 
-if not platform.has("fgetln", "#include <stdio.h>"):
-    # This should use separate_module_files, but that appears to be broken, hence
-    # this horrible hack.
-    f = open(os.path.join(os.path.split(os.path.abspath(__file__))[0], "../platform/fgetln.c"))
-    d = f.read()
-    separate_module_sources = [d]
-    extra_includes = [os.path.join(os.path.split(os.path.abspath(__file__))[0], "../platform/fgetln.h")]
-else:
-    separate_module_sources = []
-    extra_includes = []
-
-eci         = ExternalCompilationInfo(includes=["limits.h", "stdio.h", "stdlib.h", "string.h",
-                "unistd.h"] + extra_includes, separate_module_sources=separate_module_sources)
+eci         = ExternalCompilationInfo(includes=["fnmatch.h", "limits.h", "stdio.h", "stdlib.h",
+                "string.h", "unistd.h"])
 
 FILEP       = rffi.COpaquePtr("FILE")
 fclose      = rffi.llexternal("fclose", [FILEP], rffi.INT, compilation_info=eci, releasegil=False)
@@ -49,16 +39,23 @@ fdopen      = rffi.llexternal("fdopen", [rffi.INT, rffi.CCHARP], FILEP, compilat
 feof        = rffi.llexternal("feof", [FILEP], rffi.INT, compilation_info=eci)
 ferror      = rffi.llexternal("ferror", [FILEP], rffi.INT, compilation_info=eci)
 fflush      = rffi.llexternal("fflush", [FILEP], rffi.INT, compilation_info=eci)
-fgetln      = rffi.llexternal("fgetln", [FILEP, rffi.SIZE_TP], rffi.CCHARP, compilation_info=eci)
+fgetc       = rffi.llexternal("fgetc", [FILEP], rffi.INT, compilation_info=eci)
+fnmatch     = rffi.llexternal("fnmatch", [rffi.CCHARP, rffi.CCHARP, rffi.INT], rffi.INT, \
+                compilation_info=eci)
 fileno      = rffi.llexternal("fileno", [FILEP], rffi.INT, compilation_info=eci)
 flockfile   = rffi.llexternal("flockfile", [FILEP], lltype.Void, compilation_info=eci)
 fopen       = rffi.llexternal("fopen", [rffi.CCHARP, rffi.CCHARP], FILEP, compilation_info=eci)
 fread       = rffi.llexternal("fread", [rffi.CCHARP, rffi.SIZE_T, rffi.SIZE_T, FILEP], rffi.SIZE_T, \
                 compilation_info=eci)
+fputc       = rffi.llexternal("fputc", [rffi.INT, FILEP], rffi.INT, compilation_info=eci)
 fseek       = rffi.llexternal("fseek", [FILEP, rffi.INT, rffi.INT], rffi.INT, compilation_info=eci)
+free        = rffi.llexternal("free", [rffi.CCHARP], lltype.Void, compilation_info=eci, \
+                releasegil=False)
 funlockfile = rffi.llexternal("funlockfile", [FILEP], lltype.Void, compilation_info=eci)
 fwrite      = rffi.llexternal("fwrite", [rffi.CCHARP, rffi.SIZE_T, rffi.SIZE_T, FILEP], rffi.SIZE_T, \
                 compilation_info=eci)
+getline     = rffi.llexternal("getline", [rffi.CCHARPP, rffi.SIZE_TP, FILEP], rffi.SSIZE_T, \
+                compilation_info=eci, save_err=rffi.RFFI_SAVE_ERRNO)
 
 if platform.has("mkstemp", "#include <stdlib.h>"):
     HAS_MKSTEMP = True
@@ -66,6 +63,8 @@ if platform.has("mkstemp", "#include <stdlib.h>"):
 else:
     HAS_MKSTEMP = False
     tmpnam  = rffi.llexternal("tmpnam", [rffi.CCHARP], rffi.CCHARP, compilation_info=eci)
+setvbuf     = rffi.llexternal("setvbuf", [FILEP, rffi.CCHARP, rffi.INT, rffi.SIZE_T], rffi.INT, \
+                compilation_info=eci)
 realpath    = rffi.llexternal("realpath", \
                 [rffi.CCHARP, rffi.CCHARP], rffi.CCHARP, compilation_info=eci)
 
@@ -75,18 +74,26 @@ class CConfig:
     _compilation_info_ = eci
     PATH_MAX           = platform.DefinedConstantInteger("PATH_MAX")
     SEEK_SET           = platform.DefinedConstantInteger("SEEK_SET")
+    _IOFBF             = platform.DefinedConstantInteger("_IOFBF")
+    _IOLBF             = platform.DefinedConstantInteger("_IOLBF")
+    _IONBF             = platform.DefinedConstantInteger("_IONBF")
 
 cconfig = platform.configure(CConfig)
 
 PATH_MAX = cconfig["PATH_MAX"]
 SEEK_SET = cconfig["SEEK_SET"]
+_IOFBF   = cconfig["_IOFBF"]
+_IOLBF   = cconfig["_IOLBF"]
+_IONBF   = cconfig["_IONBF"]
+
+READ_CHUNK_SIZE = 65536
 
 
 
 def init(vm):
     return new_c_con_module(vm, "POSIX_File", "POSIX_File", __file__, import_, \
-      ["DIR_SEP", "EXT_SEP", "NULL_DEV", "File_Atom_Def", "File", "canon_path", "exists", "is_dir",
-       "is_file", "chmod", "iter_dir_entries", "mtime", "rm", "temp_file"])
+      ["DIR_SEP", "EXT_SEP", "NULL_DEV", "File_Atom_Def", "File", "Dir_Entry", "canon_path", "exists",
+       "is_dir", "is_file", "chmod", "iter_dir_entries", "mtime", "rm", "temp_file", "walk"])
 
 
 @con_object_proc
@@ -98,6 +105,7 @@ def import_(vm):
     mod.set_defn(vm, "NULL_DEV", Con_String(vm, "/dev/null"))
 
     bootstrap_file_class(vm, mod)
+    bootstrap_dir_entry_class(vm, mod)
 
     new_c_con_func_for_mod(vm, "canon_path", canon_path, mod)
     new_c_con_func_for_mod(vm, "chmod", chmod, mod)
@@ -108,6 +116,7 @@ def import_(vm):
     new_c_con_func_for_mod(vm, "mtime", mtime, mod)
     new_c_con_func_for_mod(vm, "rm", rm, mod)
     new_c_con_func_for_mod(vm, "temp_file", temp_file, mod)
+    new_c_con_func_for_mod(vm, "walk", walk, mod)
     
     vm.set_builtin(BUILTIN_C_FILE_MODULE, mod)
     
@@ -116,7 +125,7 @@ def import_(vm):
 
 def _errno_raise(vm, path):
     if isinstance(path, Con_String):
-        msg = "File '%s': %s." % (path.v, os.strerror(rposix.get_saved_errno()))
+        msg = "File '%s': %s." % (path.as_str(), os.strerror(rposix.get_saved_errno()))
     else:
         msg = os.strerror(rposix.get_saved_errno())
     vm.raise_helper("File_Exception", [Con_String(vm, msg)])
@@ -127,7 +136,7 @@ def _errno_raise(vm, path):
 #
 
 class File(Con_Boxed_Object):
-    __slots__ = ("filep", "closed")
+    __slots__ = ("filep", "closed", "linebuf", "linebufp", "linesizep", "iobuf")
     _immutable_fields_ = ("file", )
 
 
@@ -135,16 +144,109 @@ class File(Con_Boxed_Object):
         Con_Boxed_Object.__init__(self, vm, instance_of)
         self.filep = filep
         self.closed = False
+        # The buffer getline reads lines into. It is allocated on first use, and then reused (being
+        # grown by getline as necessary) for every subsequent line. linebuf mirrors linebufp[0] so
+        # that __del__ need not read from linebufp.
+        self.linebuf = lltype.nullptr(rffi.CCHARP.TO)
+        self.linebufp = lltype.nullptr(rffi.CCHARPP.TO)
+        self.linesizep = lltype.nullptr(rffi.SIZE_TP.TO)
+        # The stdio buffer given by set_buffering, if any. It must outlive fclose, which flushes it.
+        self.iobuf = lltype.nullptr(rffi.CCHARP.TO)
         
         self.set_slot(vm, "path", path)
 
 
+    # File's finalizer is light (i.e. it neither allocates nor releases the GIL), so the GC runs it
+    # as soon as a File dies. Calling close frees everything the finalizer would have.
+
+    @rgc.must_be_light_finalizer
     def __del__(self):
         if not self.closed:
             # If the file is still open, we now close it to prevent a memory leak, as well as return
             # resources to the OS. Errors from fclose are ignored as there's nothing sensible we can
             # do with them at this point.
             fclose(self.filep)
+        self.free_linebuf()
+        self.free_iobuf()
+
+
+    def free_linebuf(self):
+        if self.linebufp:
+            free(self.linebuf)
+            lltype.free(self.linebufp, flavor="raw")
+            lltype.free(self.linesizep, flavor="raw")
+            self.linebuf = lltype.nullptr(rffi.CCHARP.TO)
+            self.linebufp = lltype.nullptr(rffi.CCHARPP.TO)
+            self.linesizep = lltype.nullptr(rffi.SIZE_TP.TO)
+
+
+    def free_iobuf(self):
+        if self.iobuf:
+            lltype.free(self.iobuf, flavor="raw")
+            self.iobuf = lltype.nullptr(rffi.CCHARP.TO)
+
+
+    def write_strs(self, vm, ss, newline):
+        # Writes each string in ss, followed by a newline if newline is True. The stream is locked
+        # once for the whole batch, so the strings are not interleaved with other threads' output.
+        _check_open(vm, self)
+        flockfile(self.filep)
+        try:
+            for s in ss:
+                if len(s) > 0 and fwrite(s, len(s), 1, self.filep) < 1:
+                    vm.raise_helper("File_Exception", [Con_String(vm, "Write error.")])
+            if newline and fputc(ord("\n"), self.filep) == -1:
+                vm.raise_helper("File_Exception", [Con_String(vm, "Write error.")])
+        finally:
+            funlockfile(self.filep)
+
+
+    def read_str(self, vm, n):
+        # Reads up to n bytes (or, if n is -1, everything up to the end of the file), returning
+        # fewer only if the end of the file is reached. The file is read in chunks, so that files
+        # whose size fstat doesn't know (e.g. pipes) are read correctly.
+        _check_open(vm, self)
+        flockfile(self.filep)
+        try:
+            if objectmodel.we_are_translated():
+                b = StringBuilder()
+                bsize = READ_CHUNK_SIZE
+                if n >= 0 and n < READ_CHUNK_SIZE:
+                    bsize = n
+                with lltype.scoped_alloc(rffi.CCHARP.TO, bsize) as buf:
+                    while n != 0:
+                        if n > 0 and n < bsize:
+                            csize = n
+                        else:
+                            csize = bsize
+                        r = rarithmetic.intmask(fread(buf, 1, csize, self.filep))
+                        b.append_charpsize(buf, r)
+                        if n > 0:
+                            n -= r
+                        if r < csize:
+                            if ferror(self.filep) != 0:
+                                vm.raise_helper("File_Exception", [Con_String(vm, "Read error.")])
+                            break
+                s = b.build()
+            else:
+                # rffi.charpsize2str is so slow (taking minutes for big strings) that it's worth
+                # bypassing it when things are run untranslated.
+                if n == -1:
+                    n = os.fstat(fileno(self.filep)).st_size
+                s = os.read(fileno(self.filep), n)
+        finally:
+            funlockfile(self.filep)
+
+        return s
+
+
+    def read_byte(self, vm):
+        # Reads a single byte, returning -1 at the end of the file.
+        _check_open(vm, self)
+        c = rffi.cast(lltype.Signed, fgetc(self.filep))
+        if c == -1 and ferror(self.filep) != 0:
+            vm.raise_helper("File_Exception", [Con_String(vm, "Read error.")])
+        return c
 
 
 @con_object_proc
@@ -154,11 +256,11 @@ def _new_func_File(vm):
 
     f = path_s = None
     if isinstance(path_o, Con_String):
-        path_s = path_o.v
-        f = fopen(path_s, mode_o.v)
+        path_s = path_o.as_str()
+        f = fopen(path_s, mode_o.as_str())
     elif isinstance(path_o, Con_Int):
         path_s = None
-        f = fdopen(path_o.v, mode_o.v)
+        f = fdopen(path_o.v, mode_o.as_str())
     else:
         vm.raise_helper("Type_Exception", [Con_String(vm, "[String, Int]"), path_o])
 
@@ -177,9 +279,12 @@ def File_close(vm):
     assert isinstance(self, File)
     _check_open(vm, self)
 
-    if fclose(self.filep) != 0:
-        _errno_raise(vm, self.get_slot(vm, "path"))
     self.closed = True
+    self.free_linebuf()
+    r = fclose(self.filep)
+    self.free_iobuf()
+    if r != 0:
+        _errno_raise(vm, self.get_slot(vm, "path"))
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -211,32 +316,122 @@ def File_read(vm):
     assert isinstance(self, File)
     _check_open(vm, self)
     
-    flockfile(self.filep)
-    fsize = os.fstat(fileno(self.filep)).st_size
     if rsize_o is None:
-        rsize = fsize
+        rsize = -1
     else:
         assert isinstance(rsize_o, Con_Int)
         rsize = rsize_o.v
         if rsize < 0:
             vm.raise_helper("File_Exception", \
               [Con_String(vm, "Can not read less than 0 bytes from file.")])
-        elif rsize > fsize:
-            rsize = fsize
-
-    if objectmodel.we_are_translated():
-        with lltype.scoped_alloc(rffi.CCHARP.TO, rsize) as buf:
-            r = fread(buf, 1, rsize, self.filep)
-            if r < rffi.r_size_t(rsize) and ferror(self.filep) != 0:
-                vm.raise_helper("File_Exception", [Con_String(vm, "Read error.")])
-            s = rffi.charpsize2str(buf, rarithmetic.intmask(r))
+
+    return Con_String(vm, self.read_str(vm, rsize))
+
+
+@con_object_proc
+def File_read_into(vm):
+    (self, a_o, n_o, off_o),_ = vm.decode_args(mand="!OI", opt="i", self_of=File)
+    assert isinstance(self, File)
+    assert isinstance(n_o, Con_Int)
+    _check_open(vm, self)
+    a_o = _type_check_array(vm, a_o)
+
+    n = n_o.v
+    if n < 0:
+        vm.raise_helper("File_Exception", \
+          [Con_String(vm, "Can not read less than 0 elements from file.")])
+    # The elements are read straight into the array's memory.
+    size = a_o.type_size
+    if off_o is None:
+        p = a_o.reserve(vm, n)
+        r = rarithmetic.intmask(fread(p, 1, n * size, self.filep))
+        a_o.num_entries += r // size
     else:
-        # rffi.charpsize2str is so slow (taking minutes for big strings) that it's worth bypassing
-        # it when things are run untranslated.
-        s = os.read(fileno(self.filep), rsize)
-    funlockfile(self.filep)
+        # Overwrite existing elements, so that arrays which can not grow (e.g. shared memory,
+        # mapped files and views) can be read into.
+        if a_o.read_only:
+            vm.raise_helper("File_Exception", [Con_String(vm, "Array is read-only.")])
+        off = translate_slice_idx_obj(vm, off_o, a_o.num_entries)
+        translate_slice_idx(vm, off + n, a_o.num_entries)
+        if a_o.stride == 1:
+            r = rarithmetic.intmask(fread(rffi.ptradd(a_o.data, off * size), 1, n * size, \
+              self.filep))
+        else:
+            r = 0
+            for k in range(off, off + n):
+                e = rarithmetic.intmask(fread(rffi.ptradd(a_o.data, k * a_o.stride * size), 1, \
+                  size, self.filep))
+                r += e
+                if e < size:
+                    break
+    objectmodel.keepalive_until_here(a_o)
+    if r < n * size:
+        if ferror(self.filep) != 0:
+            vm.raise_helper("File_Exception", [Con_String(vm, "Read error.")])
+        if r % size != 0:
+            vm.raise_helper("File_Exception", \
+              [Con_String(vm, "File ends part way through an element.")])
+        if r == 0 and n > 0:
+            return vm.get_builtin(BUILTIN_FAIL_OBJ)
 
-    return Con_String(vm, s)
+    return Con_Int(vm, r // size)
+
+
+@con_object_gen
+def File_iter_chunks(vm):
+    (self, size_o),_ = vm.decode_args(mand="!I", self_of=File)
+    assert isinstance(self, File)
+    assert isinstance(size_o, Con_Int)
+    _check_open(vm, self)
+
+    size = size_o.v
+    if size <= 0:
+        vm.raise_helper("File_Exception", [Con_String(vm, "Chunk size must be greater than 0.")])
+    # Each chunk is read with read_str, so no raw buffer is held across a yield: if the caller
+    # stops iterating early, this generator is never resumed, and such a buffer would leak.
+    while 1:
+        s = self.read_str(vm, size)
+        if len(s) == 0:
+            break
+        yield Con_String(vm, s)
+        if len(s) < size:
+            break
+
+
+@con_object_gen
+def File_iter_lines(vm):
+    (self, strip_o),_ = vm.decode_args(mand="!", opt="i", self_of=File)
+    assert isinstance(self, File)
+    _check_open(vm, self)
+
+    strip = strip_o is not None and type_check_int(vm, strip_o).v != 0
+    while 1:
+        _check_open(vm, self)
+        l = _getline(vm, self, strip)
+        if l is None:
+            break
+        yield Con_String(vm, l)
+
+
+@con_object_proc
+def File_read_lines(vm):
+    (self, max_n_o, strip_o),_ = vm.decode_args(mand="!I", opt="i", self_of=File)
+    assert isinstance(self, File)
+    assert isinstance(max_n_o, Con_Int)
+    _check_open(vm, self)
+
+    strip = strip_o is not None and type_check_int(vm, strip_o).v != 0
+    max_n = max_n_o.v
+    lines = []
+    while len(lines) < max_n:
+        l = _getline(vm, self, strip)
+        if l is None:
+            break
+        lines.append(Con_String(vm, l))
+    if len(lines) == 0 and max_n > 0:
+        return vm.get_builtin(BUILTIN_FAIL_OBJ)
+
+    return Con_List(vm, lines)
 
 
 @con_object_gen
@@ -246,14 +441,11 @@ def File_readln(vm):
     _check_open(vm, self)
     
     while 1:
-        with lltype.scoped_alloc(rffi.SIZE_TP.TO, 1) as lenp:
-            l = fgetln(self.filep, lenp)
-            if not l:
-                if feof(self.filep) != 0:
-                    break
-                _errno_raise(vm, self.get_slot(vm, "path"))
-            l_o = Con_String(vm, rffi.charpsize2str(l, rarithmetic.intmask(lenp[0])))
-            yield l_o
+        _check_open(vm, self)
+        l = _getline(vm, self, False)
+        if l is None:
+            break
+        yield Con_String(vm, l)
 
 
 @con_object_proc
@@ -269,6 +461,45 @@ def File_seek(vm):
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+@con_object_proc
+def File_set_buffering(vm):
+    (self, mode_o),_ = vm.decode_args(mand="!O", self_of=File)
+    assert isinstance(self, File)
+    _check_open(vm, self)
+
+    size = 0
+    if isinstance(mode_o, Con_Int):
+        mode = _IOFBF
+        size = mode_o.v
+        if size <= 0:
+            vm.raise_helper("File_Exception", \
+              [Con_String(vm, "Buffer size must be greater than 0.")])
+    else:
+        mode_s = type_check_string(vm, mode_o).as_str()
+        if mode_s == "line":
+            mode = _IOLBF
+        elif mode_s == "none":
+            mode = _IONBF
+        else:
+            vm.raise_helper("File_Exception", \
+              [Con_String(vm, "Unknown buffering mode '%s'." % mode_s)])
+            mode = _IONBF
+    # Some C libraries (e.g. glibc) ignore the size if they are left to allocate the buffer
+    # themselves, so a fully buffered file is given a buffer it owns. Once setvbuf has succeeded
+    # the stream no longer uses any buffer it was previously given.
+    buf = lltype.nullptr(rffi.CCHARP.TO)
+    if size > 0:
+        buf = lltype.malloc(rffi.CCHARP.TO, size, flavor="raw")
+    if setvbuf(self.filep, buf, mode, size) != 0:
+        if buf:
+            lltype.free(buf, flavor="raw")
+        vm.raise_helper("File_Exception", [Con_String(vm, "Can not set buffering.")])
+    self.free_iobuf()
+    self.iobuf = buf
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
 @con_object_proc
 def File_write(vm):
     (self, s_o),_ = vm.decode_args(mand="!S", self_of=File)
@@ -276,23 +507,62 @@ def File_write(vm):
     assert isinstance(s_o, Con_String)
     _check_open(vm, self)
     
-    s = s_o.v
+    s = s_o.as_str()
     if len(s) > 0 and fwrite(s, len(s), 1, self.filep) < 1:
         vm.raise_helper("File_Exception", [Con_String(vm, "Write error.")])
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+@con_object_proc
+def File_write_all(vm):
+    (self, ss_o),_ = vm.decode_args(mand="!O", self_of=File)
+    assert isinstance(self, File)
+
+    if isinstance(ss_o, Con_List):
+        ss = [type_check_string(vm, s_o).as_str() for s_o in ss_o.l]
+    else:
+        ss = []
+        vm.pre_get_slot_apply_pump(ss_o, "iter")
+        while 1:
+            s_o = vm.apply_pump()
+            if not s_o:
+                break
+            ss.append(type_check_string(vm, s_o).as_str())
+    self.write_strs(vm, ss, False)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def File_write_from(vm):
+    (self, a_o, i_o, j_o),_ = vm.decode_args(mand="!O", opt="ii", self_of=File)
+    assert isinstance(self, File)
+    _check_open(vm, self)
+    a_o = _type_check_array(vm, a_o)
+
+    i, j = translate_slice_idx_objs(vm, i_o, j_o, a_o.num_entries)
+    size = a_o.type_size
+    if a_o.stride == 1:
+        if j > i and rarithmetic.intmask( \
+          fwrite(rffi.ptradd(a_o.data, i * size), size, j - i, self.filep)) < j - i:
+            vm.raise_helper("File_Exception", [Con_String(vm, "Write error.")])
+    else:
+        for k in range(i, j):
+            if fwrite(rffi.ptradd(a_o.data, k * a_o.stride * size), size, 1, self.filep) < 1:
+                vm.raise_helper("File_Exception", [Con_String(vm, "Write error.")])
+    objectmodel.keepalive_until_here(a_o)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
 @con_object_proc
 def File_writeln(vm):
     (self, s_o),_ = vm.decode_args(mand="!S", self_of=File)
     assert isinstance(self, File)
     assert isinstance(s_o, Con_String)
-    _check_open(vm, self)
     
-    s = s_o.v + "\n"
-    if fwrite(s, len(s), 1, self.filep) < 1:
-        vm.raise_helper("File_Exception", [Con_String(vm, "Write error.")])
+    self.write_strs(vm, [s_o.as_str()], True)
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -302,6 +572,33 @@ def _check_open(vm, file):
         vm.raise_helper("File_Exception", [Con_String(vm, "File previously closed.")])
 
 
+def _getline(vm, file, strip):
+    # Returns the next line from file (without its trailing newline if strip is True), or None at
+    # the end of the file.
+    if not file.linebufp:
+        file.linebufp = lltype.malloc(rffi.CCHARPP.TO, 1, flavor="raw")
+        file.linebufp[0] = lltype.nullptr(rffi.CCHARP.TO)
+        file.linesizep = lltype.malloc(rffi.SIZE_TP.TO, 1, flavor="raw")
+        file.linesizep[0] = rffi.cast(rffi.SIZE_T, 0)
+    r = rarithmetic.intmask(getline(file.linebufp, file.linesizep, file.filep))
+    file.linebuf = file.linebufp[0]
+    if r == -1:
+        if feof(file.filep) != 0:
+            return None
+        _errno_raise(vm, file.get_slot(vm, "path"))
+    buf = file.linebuf
+    if strip and r > 0 and buf[r - 1] == "\n":
+        r -= 1
+    return rffi.charpsize2str(buf, r)
+
+
+def _type_check_array(vm, o):
+    if not isinstance(o, Con_Array.Array):
+        vm.raise_helper("Type_Exception", [Con_String(vm, "Array"), o])
+    assert isinstance(o, Con_Array.Array)
+    return o
+
+
 def bootstrap_file_class(vm, mod):
     file_class = Con_Class(vm, Con_String(vm, "File"), [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
     mod.set_defn(vm, "File", file_class)
@@ -310,14 +607,126 @@ def bootstrap_file_class(vm, mod):
     new_c_con_func_for_class(vm, "close", File_close, file_class)
     new_c_con_func_for_class(vm, "fileno", File_fileno, file_class)
     new_c_con_func_for_class(vm, "flush", File_flush, file_class)
+    new_c_con_func_for_class(vm, "iter_chunks", File_iter_chunks, file_class)
+    new_c_con_func_for_class(vm, "iter_lines", File_iter_lines, file_class)
     new_c_con_func_for_class(vm, "read", File_read, file_class)
+    new_c_con_func_for_class(vm, "read_into", File_read_into, file_class)
+    new_c_con_func_for_class(vm, "read_lines", File_read_lines, file_class)
     new_c_con_func_for_class(vm, "readln", File_readln, file_class)
     new_c_con_func_for_class(vm, "seek", File_seek, file_class)
+    new_c_con_func_for_class(vm, "set_buffering", File_set_buffering, file_class)
     new_c_con_func_for_class(vm, "write", File_write, file_class)
+    new_c_con_func_for_class(vm, "write_all", File_write_all, file_class)
+    new_c_con_func_for_class(vm, "write_from", File_write_from, file_class)
     new_c_con_func_for_class(vm, "writeln", File_writeln, file_class)
 
 
 
+################################################################################
+# class Dir_Entry
+#
+
+ENTRY_FILE  = 0
+ENTRY_DIR   = 1
+ENTRY_LINK  = 2
+ENTRY_OTHER = 3
+
+class Dir_Entry(Con_Boxed_Object):
+    __slots__ = ("path", "type", "follow_links", "have_stat", "size", "mtime")
+    _immutable_fields_ = ("path", "type", "follow_links")
+
+
+    def __init__(self, vm, instance_of, path, name, type, follow_links):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.path = path
+        self.type = type
+        self.follow_links = follow_links
+        self.have_stat = False
+        self.size = 0
+        self.mtime = 0.0
+
+        self.set_slot(vm, "path", Con_String(vm, path))
+        self.set_slot(vm, "name", Con_String(vm, name))
+
+
+    def stat(self, vm):
+        # The entry's type is known without stat'ing it, so stat is only called if the size or
+        # mtime are needed.
+        if self.have_stat:
+            return
+        try:
+            if self.follow_links:
+                st = os.stat(self.path)
+            else:
+                st = os.lstat(self.path)
+            self.size = rarithmetic.intmask(st.st_size)
+            self.mtime = st.st_mtime
+        except OSError, e:
+            _errno_raise(vm, Con_String(vm, self.path))
+        self.have_stat = True
+
+
+@con_object_proc
+def Dir_Entry_is_dir(vm):
+    (self,),_ = vm.decode_args("!", self_of=Dir_Entry)
+    assert isinstance(self, Dir_Entry)
+
+    if self.type == ENTRY_DIR:
+        return vm.get_builtin(BUILTIN_NULL_OBJ)
+    return vm.get_builtin(BUILTIN_FAIL_OBJ)
+
+
+@con_object_proc
+def Dir_Entry_is_file(vm):
+    (self,),_ = vm.decode_args("!", self_of=Dir_Entry)
+    assert isinstance(self, Dir_Entry)
+
+    if self.type == ENTRY_FILE:
+        return vm.get_builtin(BUILTIN_NULL_OBJ)
+    return vm.get_builtin(BUILTIN_FAIL_OBJ)
+
+
+@con_object_proc
+def Dir_Entry_is_link(vm):
+    (self,),_ = vm.decode_args("!", self_of=Dir_Entry)
+    assert isinstance(self, Dir_Entry)
+
+    if self.type == ENTRY_LINK:
+        return vm.get_builtin(BUILTIN_NULL_OBJ)
+    return vm.get_builtin(BUILTIN_FAIL_OBJ)
+
+
+@con_object_proc
+def Dir_Entry_mtime(vm):
+    (self,),_ = vm.decode_args("!", self_of=Dir_Entry)
+    assert isinstance(self, Dir_Entry)
+
+    self.stat(vm)
+    return _mk_timespec(vm, self.mtime)
+
+
+@con_object_proc
+def Dir_Entry_size(vm):
+    (self,),_ = vm.decode_args("!", self_of=Dir_Entry)
+    assert isinstance(self, Dir_Entry)
+
+    self.stat(vm)
+    return Con_Int(vm, self.size)
+
+
+def bootstrap_dir_entry_class(vm, mod):
+    dir_entry_class = Con_Class(vm, Con_String(vm, "Dir_Entry"), \
+      [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
+    mod.set_defn(vm, "Dir_Entry", dir_entry_class)
+
+    new_c_con_func_for_class(vm, "is_dir", Dir_Entry_is_dir, dir_entry_class)
+    new_c_con_func_for_class(vm, "is_file", Dir_Entry_is_file, dir_entry_class)
+    new_c_con_func_for_class(vm, "is_link", Dir_Entry_is_link, dir_entry_class)
+    new_c_con_func_for_class(vm, "mtime", Dir_Entry_mtime, dir_entry_class)
+    new_c_con_func_for_class(vm, "size", Dir_Entry_size, dir_entry_class)
+
+
+
 ################################################################################
 # Other module-level functions
 #
@@ -328,7 +737,7 @@ def canon_path(vm):
     assert isinstance(p_o, Con_String)
 
     with lltype.scoped_alloc(rffi.CCHARP.TO, PATH_MAX) as resolved:
-        r = realpath(p_o.v, resolved)
+        r = realpath(p_o.as_str(), resolved)
         if not r:
             _errno_raise(vm, p_o)
         rp = rffi.charpsize2str(resolved, rarithmetic.intmask(strlen(resolved)))
@@ -343,7 +752,7 @@ def chmod(vm):
     assert isinstance(mode_o, Con_Int)
     
     try:
-        os.chmod(p_o.v, int(mode_o.v))
+        os.chmod(p_o.as_str(), int(mode_o.v))
     except OSError, e:
         _errno_raise(vm, p_o)
 
@@ -356,7 +765,7 @@ def exists(vm):
     assert isinstance(p_o, Con_String)
     
     try:
-        if os.path.exists(p_o.v):
+        if os.path.exists(p_o.as_str()):
             return vm.get_builtin(BUILTIN_NULL_OBJ)
         else:
             return vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -370,7 +779,7 @@ def is_dir(vm):
     assert isinstance(p_o, Con_String)
     
     try:
-        if os.path.isdir(p_o.v):
+        if os.path.isdir(p_o.as_str()):
             return vm.get_builtin(BUILTIN_NULL_OBJ)
         else:
             return vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -384,7 +793,7 @@ def is_file(vm):
     assert isinstance(p_o, Con_String)
     
     try:
-        if os.path.isfile(p_o.v):
+        if os.path.isfile(p_o.as_str()):
             return vm.get_builtin(BUILTIN_NULL_OBJ)
         else:
             return vm.get_builtin(BUILTIN_FAIL_OBJ)
@@ -398,7 +807,7 @@ def iter_dir_entries(vm):
     assert isinstance(dp_o, Con_String)
     
     try:
-        for p in os.listdir(dp_o.v):
+        for p in os.listdir(dp_o.as_str()):
             yield Con_String(vm, p)
     except OSError, e:
         _errno_raise(vm, dp_o)
@@ -409,20 +818,24 @@ def mtime(vm):
     (p_o,),_ = vm.decode_args("S")
     assert isinstance(p_o, Con_String)
     
-    time_mod = vm.import_stdlib_mod(Stdlib_Modules.STDLIB_TIME)
-    mk_timespec = time_mod.get_defn(vm, "mk_timespec")
+    mtime = 0.0
+    try:
+        mtime = os.stat(p_o.as_str()).st_mtime
+    except OSError, e:
+        _errno_raise(vm, p_o)
+    
+    return _mk_timespec(vm, mtime)
 
+
+def _mk_timespec(vm, mtime):
     # XXX Ideally we'd use our own stat implementation here, but it's a cross-platform nightmare, so
     # this is a reasonable substitute. We might lose a bit of accuracy because floating point
     # numbers won't be a totally accurate representation of nanoseconds, but the difference
     # probably isn't enough to worry about.
 
-    mtime = 0
-    try:
-        mtime = os.stat(p_o.v).st_mtime
-    except OSError, e:
-        _errno_raise(vm, p_o)
-    
+    time_mod = vm.import_stdlib_mod(Stdlib_Modules.STDLIB_TIME)
+    mk_timespec = time_mod.get_defn(vm, "mk_timespec")
+
     sec = int(mtime)
     nsec = int((mtime - int(mtime)) * 1E9)
     
@@ -434,7 +847,7 @@ def rm(vm):
     (p_o,),_ = vm.decode_args("S")
     assert isinstance(p_o, Con_String)
     
-    st = [p_o.v]
+    st = [p_o.as_str()]
     i = 0
     while len(st) > 0:
         p = st[i]
@@ -486,3 +899,115 @@ def temp_file(vm):
         return File(vm, file_class, Con_String(vm, tmpp), f)
     else:
         raise Exception("XXX")
+
+
+class _Dir_Listing(object):
+    __slots__ = ("path", "names", "types", "i")
+
+    def __init__(self, path, names, types):
+        self.path = path
+        self.names = names
+        self.types = types
+        self.i = 0
+
+
+@con_object_gen
+def walk(vm):
+    mod = vm.get_funcs_mod()
+    (root_o, follow_links_o, glob_o),_ = vm.decode_args("S", opt="is")
+    assert isinstance(root_o, Con_String)
+
+    follow_links = follow_links_o is not None and type_check_int(vm, follow_links_o).v != 0
+    glob = None
+    if glob_o is not None:
+        glob = type_check_string(vm, glob_o).as_str()
+    dir_entry_class = mod.get_defn(vm, "Dir_Entry")
+
+    # The directory tree is walked depth first, with an explicit stack of directory listings. When
+    # following links, the (device, inode) of each directory entered is recorded so that cycles
+    # are not followed.
+    root = root_o.as_str()
+    visited = {}
+    if follow_links:
+        _first_visit(visited, root)
+    stack = [_read_dir(vm, root, follow_links)]
+    while len(stack) > 0:
+        d = stack[-1]
+        if d.i == len(d.names):
+            stack.pop()
+            continue
+        name = d.names[d.i]
+        type = d.types[d.i]
+        d.i += 1
+        path = os.path.join(d.path, name)
+        if glob is None or fnmatch(glob, name, 0) == 0:
+            yield Dir_Entry(vm, dir_entry_class, path, name, type, follow_links)
+        if type == ENTRY_DIR and (not follow_links or _first_visit(visited, path)):
+            stack.append(_read_dir(vm, path, follow_links))
+
+
+def _read_dir(vm, path, follow_links):
+    names = []
+    d_types = []
+    try:
+        dirp = rposix_scandir.opendir(path)
+        try:
+            while 1:
+                direntp = rposix_scandir.nextentry(dirp)
+                if not direntp:
+                    break
+                name = rposix_scandir.get_name_bytes(direntp)
+                if name == "." or name == "..":
+                    continue
+                names.append(name)
+                d_types.append(rposix_scandir.get_known_type(direntp))
+        finally:
+            rposix_scandir.closedir(dirp)
+    except OSError, e:
+        _errno_raise(vm, Con_String(vm, path))
+
+    types = [_entry_type(os.path.join(path, names[i]), d_types[i], follow_links) \
+      for i in range(len(names))]
+    return _Dir_Listing(path, names, types)
+
+
+def _entry_type(path, d_type, follow_links):
+    # Returns the ENTRY_* type of path, using the d_type from readdir where possible, and otherwise
+    # (or if it's a link that is to be followed) stat'ing it.
+    if d_type == rposix_scandir.DT_REG:
+        return ENTRY_FILE
+    elif d_type == rposix_scandir.DT_DIR:
+        return ENTRY_DIR
+    elif d_type == rposix_scandir.DT_LNK and not follow_links:
+        return ENTRY_LINK
+    elif d_type != rposix_scandir.DT_UNKNOWN and d_type != rposix_scandir.DT_LNK:
+        return ENTRY_OTHER
+
+    try:
+        if follow_links:
+            mode = os.stat(path).st_mode
+        else:
+            mode = os.lstat(path).st_mode
+    except OSError, e:
+        # Most likely a dangling link.
+        return ENTRY_LINK
+    if stat.S_ISREG(mode):
+        return ENTRY_FILE
+    elif stat.S_ISDIR(mode):
+        return ENTRY_DIR
+    elif stat.S_ISLNK(mode):
+        return ENTRY_LINK
+    return ENTRY_OTHER
+
+
+def _first_visit(visited, path):
+    # Returns True if the directory path has not been visited before, recording that it now has.
+    try:
+        st = os.stat(path)
+    except OSError, e:
+        return False
+    key = (rarithmetic.intmask(st.st_dev), rarithmetic.intmask(st.st_ino))
+    if key in visited:
+        return False
+    visited[key] = None
+    return True
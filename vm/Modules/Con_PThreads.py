@@ -0,0 +1,359 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+
+import os
+from rpython.rlib import rthread
+from rpython.rlib.rarithmetic import r_longlong
+from rpython.rtyper.lltypesystem import lltype
+from Builtins import *
+import Con_POSIX_File, Stdlib_Modules
+
+
+
+def init(vm):
+    return new_c_con_module(vm, "PThreads", "PThreads", __file__, import_, \
+      ["Condition", "Mutex", "PThread"])
+
+
+@con_object_proc
+def import_(vm):
+    (mod,),_ = vm.decode_args("O")
+
+    bootstrap_condition_class(vm, mod)
+    bootstrap_mutex_class(vm, mod)
+    bootstrap_pthread_class(vm, mod)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+
+################################################################################
+# class PThread
+#
+
+class PThread(Con_Boxed_Object):
+    __slots__ = ("func", "started", "done")
+    _immutable_fields_ = ("func",)
+
+
+    def __init__(self, vm, instance_of, func):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.func = func
+        self.started = False
+        # Held from when the thread is started until it has finished.
+        self.done = None
+
+
+@con_object_proc
+def _new_func_PThread(vm):
+    (class_, func_o),_ = vm.decode_args("CO")
+
+    t_o = PThread(vm, class_, func_o)
+    vm.get_slot_apply(t_o, "init", [func_o])
+
+    return t_o
+
+
+@con_object_proc
+def PThread_join(vm):
+    (self,),_ = vm.decode_args("!", self_of=PThread)
+    assert isinstance(self, PThread)
+
+    if not self.started:
+        vm.raise_helper("Exception", [Con_String(vm, "Thread not started.")])
+    done = self.done
+    assert done is not None
+    # Waiting for the lock releases the GIL. The lock is then released again, so that join can be
+    # called any number of times.
+    done.acquire(True)
+    done.release()
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def PThread_start(vm):
+    (self,),_ = vm.decode_args("!", self_of=PThread)
+    assert isinstance(self, PThread)
+
+    if self.started:
+        vm.raise_helper("Exception", [Con_String(vm, "Thread already started.")])
+    vm.start_threads()
+    self.started = True
+    self.done = rthread.allocate_lock()
+    self.done.acquire(True)
+
+    # RPython threads can't be passed arguments, so the thread to be run is passed via _bootstrapper,
+    # whose lock is held until the new thread has picked it up.
+    if _bootstrapper.lock is None:
+        _bootstrapper.lock = rthread.allocate_lock()
+    _bootstrapper.lock.acquire(True)
+    _bootstrapper.thread = self
+    try:
+        rthread.start_new_thread(_bootstrap, ())
+    except rthread.error:
+        _bootstrapper.thread = None
+        _bootstrapper.lock.release()
+        self.done.release()
+        vm.raise_helper("Exception", [Con_String(vm, "Can't start new thread.")])
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def bootstrap_pthread_class(vm, mod):
+    pthread_class = Con_Class(vm, Con_String(vm, "PThread"), \
+      [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
+    mod.set_defn(vm, "PThread", pthread_class)
+    pthread_class.new_func = \
+      new_c_con_func(vm, Con_String(vm, "new_PThread"), False, _new_func_PThread, mod)
+
+    new_c_con_func_for_class(vm, "join", PThread_join, pthread_class)
+    new_c_con_func_for_class(vm, "start", PThread_start, pthread_class)
+
+
+class _Bootstrapper(object):
+    __slots__ = ("lock", "thread")
+
+    def __init__(self):
+        self.lock = None
+        self.thread = None
+
+_bootstrapper = _Bootstrapper()
+
+
+def _bootstrap():
+    # The entry point of new threads. RPython calls this with the GIL already held.
+    rthread.gc_thread_start()
+    vm = VM.global_vm
+    t = _bootstrapper.thread
+    assert t is not None
+    _bootstrapper.thread = None
+    _bootstrapper.lock.release()
+
+    vm.enter_thread()
+    try:
+        vm.apply(t.func)
+    except VM.Con_Raise_Exception, e:
+        _report_exception(vm, e.ex_obj)
+    t.done.release()
+    rthread.gc_thread_die()
+
+
+def _report_exception(vm, ex_o):
+    # An exception which escapes a thread's function is treated as it would be in the main thread:
+    # Sys::exit exits the whole program; anything else has its backtrace printed, though other
+    # threads carry on running.
+    ex_mod = vm.get_builtin(BUILTIN_EXCEPTIONS_MODULE)
+    sys_ex_class = ex_mod.get_defn(vm, "System_Exit_Exception")
+    try:
+        if vm.get_slot_apply(sys_ex_class, "instantiated", [ex_o], allow_fail=True) is not None:
+            code = type_check_int(vm, ex_o.get_slot(vm, "code"))
+            Con_POSIX_File.fflush(lltype.nullptr(Con_POSIX_File.FILEP.TO))
+            os._exit(int(code.v))
+        pb = vm.import_stdlib_mod(Stdlib_Modules.STDLIB_BACKTRACE).get_defn(vm, "print_best")
+        vm.apply(pb, [ex_o])
+    except VM.Con_Raise_Exception:
+        pass
+
+
+
+################################################################################
+# class Mutex
+#
+
+class Mutex(Con_Boxed_Object):
+    __slots__ = ("lock",)
+    _immutable_fields_ = ("lock",)
+
+
+    def __init__(self, vm, instance_of):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.lock = rthread.allocate_lock()
+
+
+    def release(self, vm):
+        try:
+            self.lock.release()
+        except rthread.error:
+            vm.raise_helper("Exception", [Con_String(vm, "Mutex not locked.")])
+
+
+@con_object_proc
+def _new_func_Mutex(vm):
+    (class_,), vargs = vm.decode_args("C", vargs=True)
+
+    m_o = Mutex(vm, class_)
+    vm.get_slot_apply(m_o, "init", vargs)
+
+    return m_o
+
+
+@con_object_proc
+def Mutex_acquire(vm):
+    (self, blocking_o),_ = vm.decode_args("!", opt="I", self_of=Mutex)
+    assert isinstance(self, Mutex)
+
+    if blocking_o is None:
+        blocking = True
+    else:
+        assert isinstance(blocking_o, Con_Int)
+        blocking = blocking_o.v != 0
+    if blocking:
+        self.lock.acquire(True)
+    elif not self.lock.acquire(False):
+        return vm.get_builtin(BUILTIN_FAIL_OBJ)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Mutex_release(vm):
+    (self,),_ = vm.decode_args("!", self_of=Mutex)
+    assert isinstance(self, Mutex)
+
+    self.release(vm)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def bootstrap_mutex_class(vm, mod):
+    mutex_class = Con_Class(vm, Con_String(vm, "Mutex"), [vm.get_builtin(BUILTIN_OBJECT_CLASS)], \
+      mod)
+    mod.set_defn(vm, "Mutex", mutex_class)
+    mutex_class.new_func = \
+      new_c_con_func(vm, Con_String(vm, "new_Mutex"), False, _new_func_Mutex, mod)
+
+    new_c_con_func_for_class(vm, "acquire", Mutex_acquire, mutex_class)
+    new_c_con_func_for_class(vm, "release", Mutex_release, mutex_class)
+
+
+
+################################################################################
+# class Condition
+#
+# Each waiting thread blocks on a lock of its own, which notify releases. As waiters is only
+# changed by threads holding the GIL, it needs no further protection.
+
+class Condition(Con_Boxed_Object):
+    __slots__ = ("mutex", "waiters")
+    _immutable_fields_ = ("mutex", "waiters")
+
+
+    def __init__(self, vm, instance_of, mutex):
+        Con_Boxed_Object.__init__(self, vm, instance_of)
+        self.mutex = mutex
+        self.waiters = []
+
+        self.set_slot(vm, "mutex", mutex)
+
+
+@con_object_proc
+def _new_func_Condition(vm):
+    mod = vm.get_funcs_mod()
+    (class_, mutex_o),_ = vm.decode_args("C", opt="o")
+
+    if mutex_o is None or mutex_o is vm.get_builtin(BUILTIN_NULL_OBJ):
+        mutex_o = vm.get_slot_apply(mod.get_defn(vm, "Mutex"), "new")
+    mutex = _type_check_mutex(vm, mutex_o)
+    c_o = Condition(vm, class_, mutex)
+    vm.get_slot_apply(c_o, "init", [mutex_o])
+
+    return c_o
+
+
+@con_object_proc
+def Condition_notify(vm):
+    (self, n_o),_ = vm.decode_args("!", opt="I", self_of=Condition)
+    assert isinstance(self, Condition)
+
+    if n_o is None:
+        n = 1
+    else:
+        assert isinstance(n_o, Con_Int)
+        n = n_o.v
+    while n > 0 and len(self.waiters) > 0:
+        self.waiters.pop(0).release()
+        n -= 1
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Condition_notify_all(vm):
+    (self,),_ = vm.decode_args("!", self_of=Condition)
+    assert isinstance(self, Condition)
+
+    for w in self.waiters:
+        w.release()
+    del self.waiters[:]
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def Condition_wait(vm):
+    (self, timeout_o),_ = vm.decode_args("!", opt="N", self_of=Condition)
+    assert isinstance(self, Condition)
+
+    w = rthread.allocate_lock()
+    w.acquire(True)
+    self.waiters.append(w)
+    self.mutex.release(vm)
+    if timeout_o is None:
+        w.acquire(True)
+        notified = True
+    else:
+        assert isinstance(timeout_o, Con_Number)
+        timeout = timeout_o.as_float()
+        notified = w.acquire_timed(r_longlong(timeout * 1000000.0)) == 1
+        if not notified:
+            # If notify got to this waiter after the timeout, but before this thread reacquired the
+            # GIL, the notification still counts.
+            if w in self.waiters:
+                self.waiters.remove(w)
+            else:
+                notified = True
+    self.mutex.lock.acquire(True)
+
+    if not notified:
+        return vm.get_builtin(BUILTIN_FAIL_OBJ)
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def bootstrap_condition_class(vm, mod):
+    condition_class = Con_Class(vm, Con_String(vm, "Condition"), \
+      [vm.get_builtin(BUILTIN_OBJECT_CLASS)], mod)
+    mod.set_defn(vm, "Condition", condition_class)
+    condition_class.new_func = \
+      new_c_con_func(vm, Con_String(vm, "new_Condition"), False, _new_func_Condition, mod)
+
+    new_c_con_func_for_class(vm, "notify", Condition_notify, condition_class)
+    new_c_con_func_for_class(vm, "notify_all", Condition_notify_all, condition_class)
+    new_c_con_func_for_class(vm, "wait", Condition_wait, condition_class)
+
+
+def _type_check_mutex(vm, o):
+    if not isinstance(o, Mutex):
+        mod = vm.get_mod("PThreads")
+        vm.raise_helper("Type_Exception", [mod.get_defn(vm, "Mutex"), o])
+    assert isinstance(o, Mutex)
+    return o
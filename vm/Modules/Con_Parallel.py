@@ -0,0 +1,357 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+
+import errno, os
+from rpython.rlib import rpoll, rsignal
+from rpython.rlib.rarithmetic import intmask, r_ulonglong
+from rpython.rlib.rstring import StringBuilder
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rtyper.tool import rffi_platform as platform
+from rpython.translator.tool.cbuild import ExternalCompilationInfo
+from Builtins import *
+import Con_Marshal, Con_POSIX_File, Stdlib_Modules
+
+
+
+# The number of chunks per worker that map aims for when the chunk size isn't given: more than one
+# means that a worker which is given slow items doesn't hold everyone else up.
+CHUNKS_PER_WORKER = 4
+
+
+eci         = ExternalCompilationInfo(includes=["signal.h", "unistd.h"])
+sysconf     = rffi.llexternal("sysconf", [rffi.INT], rffi.LONG, compilation_info=eci)
+class CConfig:
+    _compilation_info_   = eci
+    SIGKILL              = platform.DefinedConstantInteger("SIGKILL")
+    SIGPIPE              = platform.DefinedConstantInteger("SIGPIPE")
+    _SC_NPROCESSORS_ONLN = platform.DefinedConstantInteger("_SC_NPROCESSORS_ONLN")
+cconfig = platform.configure(CConfig)
+
+SIGKILL              = cconfig["SIGKILL"]
+SIGPIPE              = cconfig["SIGPIPE"]
+_SC_NPROCESSORS_ONLN = cconfig["_SC_NPROCESSORS_ONLN"]
+
+
+
+def init(vm):
+    return new_c_con_module(vm, "Parallel", "Parallel", __file__, import_, \
+      ["Parallel_Exception", "map", "num_cpus"])
+
+
+@con_object_proc
+def import_(vm):
+    (mod,),_ = vm.decode_args("O")
+
+    class_class = vm.get_builtin(BUILTIN_CLASS_CLASS)
+    user_exception_class = vm.get_builtin(BUILTIN_EXCEPTIONS_MODULE). \
+      get_defn(vm, "User_Exception")
+    parallel_exception = vm.get_slot_apply(class_class, "new", \
+      [Con_String(vm, "Parallel_Exception"), Con_List(vm, [user_exception_class]), mod])
+    mod.set_defn(vm, "Parallel_Exception", parallel_exception)
+
+    new_c_con_func_for_mod(vm, "map", map_, mod)
+    new_c_con_func_for_mod(vm, "num_cpus", num_cpus, mod)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+
+################################################################################
+# Worker processes
+#
+# Workers are forked from the VM calling map, so they start with all its modules and objects. The
+# parent sends each worker one chunk of items at a time down the worker's task pipe; the worker
+# applies the function to each item and sends back either the list of results, or the backtrace of
+# the exception raised. Items and results are sent in Marshal's format. Closing a worker's task
+# pipe tells it to exit. Every message is an 8 byte little endian length followed by that many
+# bytes.
+
+MSG_RESULTS   = "r"
+MSG_EXCEPTION = "e"
+
+
+class _Worker(object):
+    __slots__ = ("pid", "task_fd", "result_fd", "chunk")
+
+    def __init__(self, pid, task_fd, result_fd):
+        self.pid = pid
+        self.task_fd = task_fd
+        self.result_fd = result_fd
+        self.chunk = -1 # The chunk this worker is working on, or -1 if it's idle.
+
+
+@con_object_proc
+def map_(vm):
+    (func_o, items_o, workers_o, chunk_o),_ = vm.decode_args("OO", opt="II")
+
+    items = []
+    vm.pre_get_slot_apply_pump(items_o, "iter")
+    while 1:
+        e_o = vm.apply_pump()
+        if not e_o:
+            break
+        items.append(e_o)
+
+    if workers_o is None:
+        num_workers = _num_cpus()
+    else:
+        assert isinstance(workers_o, Con_Int)
+        num_workers = workers_o.v
+        if num_workers < 1:
+            vm.raise_helper("Parameters_Exception", \
+              [Con_String(vm, "Number of workers must be at least 1.")])
+
+    n = len(items)
+    if chunk_o is None:
+        chunk = max(1, n // (num_workers * CHUNKS_PER_WORKER))
+    else:
+        assert isinstance(chunk_o, Con_Int)
+        chunk = chunk_o.v
+        if chunk < 1:
+            vm.raise_helper("Parameters_Exception", [Con_String(vm, "Chunk must be at least 1.")])
+
+    num_chunks = (n + chunk - 1) // chunk
+    num_workers = min(num_workers, num_chunks)
+    results = [None] * n
+    if num_workers == 0:
+        return Con_List(vm, [])
+
+    # Writing to a worker that has died (or, in a worker, to a parent that has) must fail with EPIPE
+    # rather than killing the writer. Workers inherit this from the parent.
+    rsignal.pypysig_ignore(SIGPIPE)
+    workers = []
+    try:
+        workers = _start_workers(vm, func_o, num_workers)
+        next_chunk = 0
+        for w in workers:
+            _send_chunk(vm, w, items, next_chunk, chunk)
+            next_chunk += 1
+
+        done = 0
+        while done < num_chunks:
+            fds = {}
+            for w in workers:
+                if w.chunk != -1:
+                    fds[w.result_fd] = rpoll.POLLIN
+            ready = []
+            try:
+                ready = rpoll.poll(fds, -1)
+            except rpoll.PollError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                _raise_parallel_exception(vm, e.get_msg())
+            for fd, _ in ready:
+                for w in workers:
+                    if w.result_fd == fd:
+                        break
+                else:
+                    raise Exception("XXX")
+                _recv_results(vm, w, results, chunk)
+                done += 1
+                if next_chunk < num_chunks:
+                    _send_chunk(vm, w, items, next_chunk, chunk)
+                    next_chunk += 1
+                else:
+                    w.chunk = -1
+                    os.close(w.task_fd)
+                    w.task_fd = -1
+    finally:
+        _stop_workers(workers)
+        rsignal.pypysig_default(SIGPIPE)
+
+    r = []
+    for o in results:
+        assert o is not None
+        r.append(o)
+    return Con_List(vm, r)
+
+
+@con_object_proc
+def num_cpus(vm):
+    _,_ = vm.decode_args()
+
+    return Con_Int(vm, _num_cpus())
+
+
+def _num_cpus():
+    n = intmask(sysconf(_SC_NPROCESSORS_ONLN))
+    if n < 1:
+        return 1
+    return n
+
+
+def _start_workers(vm, func_o, num_workers):
+    # Anything still sitting in stdio buffers would otherwise be written out by each child too.
+    Con_POSIX_File.fflush(lltype.nullptr(Con_POSIX_File.FILEP.TO))
+
+    workers = []
+    for i in range(num_workers):
+        task_r, task_w = os.pipe()
+        result_r, result_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Whatever happens, the child must exit here: if an exception escaped, the child would
+            # carry on running the parent's program.
+            rtn = 1
+            try:
+                # The child mustn't hold open any other worker's pipes, as otherwise that worker
+                # won't see its task pipe close.
+                for w in workers:
+                    if w.task_fd != -1:
+                        os.close(w.task_fd)
+                    os.close(w.result_fd)
+                os.close(task_w)
+                os.close(result_r)
+                _worker(vm, func_o, task_r, result_w)
+                Con_POSIX_File.fflush(lltype.nullptr(Con_POSIX_File.FILEP.TO))
+                rtn = 0
+            finally:
+                os._exit(rtn)
+        os.close(task_r)
+        os.close(result_w)
+        workers.append(_Worker(pid, task_w, result_r))
+
+    return workers
+
+
+def _stop_workers(workers):
+    # Kills any workers still working on a chunk (which only happens if map is exiting with an
+    # exception), tells idle workers to exit, and then waits for all of them.
+    for w in workers:
+        if w.chunk != -1:
+            os.kill(w.pid, SIGKILL)
+        if w.task_fd != -1:
+            os.close(w.task_fd)
+            w.task_fd = -1
+        os.close(w.result_fd)
+    for w in workers:
+        os.waitpid(w.pid, 0)
+
+
+def _worker(vm, func_o, task_fd, result_fd):
+    while 1:
+        msg = _read_msg(task_fd)
+        if msg is None:
+            break
+        b = StringBuilder()
+        try:
+            items_o = Con_Marshal.load_str(vm, msg, 0)
+            assert isinstance(items_o, Con_List)
+            rs = []
+            for o in items_o.l:
+                rs.append(vm.apply(func_o, [o]))
+            b.append(MSG_RESULTS)
+            b.append(Con_Marshal.dump_str(vm, Con_List(vm, rs)))
+        except VM.Con_Raise_Exception, e:
+            b = StringBuilder()
+            b.append(MSG_EXCEPTION)
+            b.append(_backtrace(vm, e.ex_obj))
+        if not _write_msg(result_fd, b.build()):
+            break
+
+
+def _backtrace(vm, ex_o):
+    try:
+        bt = vm.import_stdlib_mod(Stdlib_Modules.STDLIB_BACKTRACE).get_defn(vm, "backtrace")
+        return type_check_string(vm, vm.apply(bt, [ex_o, Con_Int(vm, 0)])).as_str()
+    except VM.Con_Raise_Exception:
+        return "Exception in worker (no backtrace available)."
+
+
+def _send_chunk(vm, w, items, i, chunk):
+    off = i * chunk
+    end = min(off + chunk, len(items))
+    assert off >= 0 and end >= off
+    msg = Con_Marshal.dump_str(vm, Con_List(vm, items[off:end]))
+    w.chunk = i
+    if not _write_msg(w.task_fd, msg):
+        _raise_parallel_exception(vm, "Worker %d exited unexpectedly." % w.pid)
+
+
+def _recv_results(vm, w, results, chunk):
+    msg = _read_msg(w.result_fd)
+    if msg is None or len(msg) == 0:
+        _raise_parallel_exception(vm, "Worker %d exited unexpectedly." % w.pid)
+    assert msg is not None
+    if msg[0] == MSG_EXCEPTION:
+        w.chunk = -1
+        _raise_parallel_exception(vm, "Exception in worker %d:\n%s" % (w.pid, msg[1:]))
+    rs_o = Con_Marshal.load_str(vm, msg, 1)
+    assert isinstance(rs_o, Con_List)
+    off = w.chunk * chunk
+    for o in rs_o.l:
+        results[off] = o
+        off += 1
+
+
+def _raise_parallel_exception(vm, msg):
+    mod = vm.get_mod("Parallel")
+    pex_class = mod.get_defn(vm, "Parallel_Exception")
+    vm.raise_(vm.get_slot_apply(pex_class, "new", [Con_String(vm, msg)]))
+
+
+def _write_msg(fd, msg):
+    # Returns False if the other end of the pipe has gone away (which, as SIGPIPE is ignored, shows
+    # up as EPIPE) or the write otherwise fails.
+    n = r_ulonglong(len(msg))
+    b = StringBuilder(8 + len(msg))
+    for i in range(8):
+        b.append(chr(intmask(n & 0xFF)))
+        n >>= 8
+    b.append(msg)
+    s = b.build()
+    i = 0
+    while i < len(s):
+        try:
+            i += os.write(fd, s[i:])
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            return False
+    return True
+
+
+def _read_msg(fd):
+    # Returns None at end of file.
+    hd = _read_n(fd, 8)
+    if hd is None:
+        return None
+    n = 0
+    for i in range(7, -1, -1):
+        n = (n << 8) | ord(hd[i])
+    return _read_n(fd, n)
+
+
+def _read_n(fd, n):
+    b = StringBuilder(n)
+    while n > 0:
+        try:
+            s = os.read(fd, n)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            return None
+        if len(s) == 0:
+            return None
+        b.append(s)
+        n -= len(s)
+    return b.build()
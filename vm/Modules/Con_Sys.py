@@ -22,6 +22,7 @@
 import sys
 import Config
 from Builtins import *
+import Con_POSIX_File
 
 
 
@@ -77,30 +78,34 @@ def exit(vm):
 
 @con_object_proc
 def print_(vm):
-    mod = vm.get_funcs_mod()
-    _,vargs = vm.decode_args(vargs=True)
-    stdout = mod.get_defn(vm, "stdout")
-
-    for o in vargs:
-        if isinstance(o, Con_String):
-            vm.get_slot_apply(stdout, "write", [o])
-        else:
-            vm.get_slot_apply(stdout, "write", [vm.get_slot_apply(o, "to_str")])
-
+    _print(vm, False)
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
 @con_object_proc
 def println(vm):
+    _print(vm, True)
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+def _print(vm, newline):
     mod = vm.get_funcs_mod()
     _,vargs = vm.decode_args(vargs=True)
     stdout = mod.get_defn(vm, "stdout")
 
+    ss = []
     for o in vargs:
-        if isinstance(o, Con_String):
-            vm.get_slot_apply(stdout, "write", [o])
-        else:
-            vm.get_slot_apply(stdout, "write", [vm.get_slot_apply(o, "to_str")])
-    vm.get_slot_apply(stdout, "write", [Con_String(vm, "\n")])
-
-    return vm.get_builtin(BUILTIN_NULL_OBJ)
+        if not isinstance(o, Con_String):
+            o = type_check_string(vm, vm.get_slot_apply(o, "to_str"))
+        ss.append(o)
+
+    file_class = vm.get_builtin(BUILTIN_C_FILE_MODULE).get_defn(vm, "File")
+    if isinstance(stdout, Con_POSIX_File.File) and stdout.instance_of is file_class:
+        # stdout is a plain File, so its strings can be written in one batch without calling its
+        # write function for each.
+        stdout.write_strs(vm, [s_o.as_str() for s_o in ss], newline)
+    else:
+        for s_o in ss:
+            vm.get_slot_apply(stdout, "write", [s_o])
+        if newline:
+            vm.get_slot_apply(stdout, "write", [Con_String(vm, "\n")])
@@ -19,6 +19,8 @@
 # IN THE SOFTWARE.
 
 
+import os
+import Config, Heap, JIT_Stats, Profiler
 from Builtins import *
 
 
@@ -27,7 +29,10 @@ from Builtins import *
 def init(vm):
     return new_c_con_module(vm, "VM", "VM", __file__, \
       import_, \
-      ["add_modules", "del_mod", "find_module", "import_module", "iter_mods"])
+      ["add_modules", "collect", "counters", "del_mod", "find_module", "gc_stats", "heap_census",
+        "import_module", "iter_mods", "jit_stats", "profile_stats", "start_alloc_sites",
+        "start_call_profiler", "start_profiler", "stop_alloc_sites", "stop_call_profiler",
+        "stop_profiler", "write_callgrind"])
 
 
 @con_object_proc
@@ -35,10 +40,23 @@ def import_(vm):
     (mod,),_ = vm.decode_args("O")
 
     new_c_con_func_for_mod(vm, "add_modules", add_modules, mod)
+    new_c_con_func_for_mod(vm, "collect", collect, mod)
+    new_c_con_func_for_mod(vm, "counters", counters, mod)
     new_c_con_func_for_mod(vm, "del_mod", del_mod, mod)
     new_c_con_func_for_mod(vm, "find_module", find_module, mod)
+    new_c_con_func_for_mod(vm, "gc_stats", gc_stats, mod)
+    new_c_con_func_for_mod(vm, "heap_census", heap_census, mod)
     new_c_con_func_for_mod(vm, "import_module", import_module, mod)
     new_c_con_func_for_mod(vm, "iter_mods", iter_mods, mod)
+    new_c_con_func_for_mod(vm, "jit_stats", jit_stats, mod)
+    new_c_con_func_for_mod(vm, "profile_stats", profile_stats, mod)
+    new_c_con_func_for_mod(vm, "start_alloc_sites", start_alloc_sites, mod)
+    new_c_con_func_for_mod(vm, "start_call_profiler", start_call_profiler, mod)
+    new_c_con_func_for_mod(vm, "start_profiler", start_profiler, mod)
+    new_c_con_func_for_mod(vm, "stop_alloc_sites", stop_alloc_sites, mod)
+    new_c_con_func_for_mod(vm, "stop_call_profiler", stop_call_profiler, mod)
+    new_c_con_func_for_mod(vm, "stop_profiler", stop_profiler, mod)
+    new_c_con_func_for_mod(vm, "write_callgrind", write_callgrind, mod)
     
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -58,15 +76,36 @@ def add_modules(vm):
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
 
+@con_object_proc
+def collect(vm):
+    _,_ = vm.decode_args("")
+
+    Heap.gc_stats.collect()
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def counters(vm):
+    _,_ = vm.decode_args("")
+
+    if not Config.COUNTERS or vm.counters is None:
+        vm.raise_helper("VM_Exception", \
+          [Con_String(vm, "Counters not enabled (run converge with --stats).")])
+    assert vm.counters is not None
+
+    return vm.counters.to_dict(vm)
+
+
 @con_object_proc
 def del_mod(vm):
     (mod_id_o,),_ = vm.decode_args("S")
     assert isinstance(mod_id_o, Con_String)
 
-    if mod_id_o.v not in vm.mods:
+    if mod_id_o.as_str() not in vm.mods:
         vm.raise_helper("Key_Exception", [mod_id_o])
 
-    del vm.mods[mod_id_o.v]
+    del vm.mods[mod_id_o.as_str()]
 
     return vm.get_builtin(BUILTIN_NULL_OBJ)
 
@@ -76,13 +115,39 @@ def find_module(vm):
     (mod_id_o,),_ = vm.decode_args("S")
     assert isinstance(mod_id_o, Con_String)
     
-    m_o = vm.find_mod(mod_id_o.v)
+    m_o = vm.find_mod(mod_id_o.as_str())
     if m_o is None:
         m_o = vm.get_builtin(BUILTIN_FAIL_OBJ)
     
     return m_o
 
 
+@con_object_proc
+def gc_stats(vm):
+    _,_ = vm.decode_args("")
+
+    return Heap.gc_stats.to_dict(vm)
+
+
+@con_object_proc
+def heap_census(vm):
+    (path_o,),_ = vm.decode_args("S")
+    assert isinstance(path_o, Con_String)
+
+    census = Heap.Census()
+    if not census.take():
+        vm.raise_helper("VM_Exception", \
+          [Con_String(vm, "Heap census not supported by this VM's garbage collector.")])
+    path = path_o.as_str()
+    try:
+        census.write(vm, path)
+    except OSError, e:
+        vm.raise_helper("File_Exception", [Con_String(vm, "File '%s': %s." % \
+          (path, os.strerror(e.errno)))])
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
 @con_object_proc
 def import_module(vm):
     (mod_o,),_ = vm.decode_args("M")
@@ -98,3 +163,138 @@ def iter_mods(vm):
     
     for mod in vm.mods.values():
         yield mod
+
+
+@con_object_proc
+def jit_stats(vm):
+    _,_ = vm.decode_args("")
+
+    d_o = JIT_Stats.jit_stats.to_dict(vm)
+    if d_o is None:
+        return vm.get_builtin(BUILTIN_FAIL_OBJ)
+    return d_o
+
+
+@con_object_proc
+def profile_stats(vm):
+    _,_ = vm.decode_args("")
+
+    prof = vm.last_call_profiler
+    if prof is None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Call profiler has not been started.")])
+    assert prof is not None
+
+    return prof.to_dict(vm)
+
+
+@con_object_proc
+def start_alloc_sites(vm):
+    _,classes_o = vm.decode_args(vargs=True)
+
+    if vm.alloc_sites is not None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Allocation sites already being tracked.")])
+    classes = []
+    for cls_o in classes_o:
+        classes.append(type_check_class(vm, cls_o))
+    vm.alloc_sites = Heap.Alloc_Sites(classes)
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def start_call_profiler(vm):
+    _,_ = vm.decode_args("")
+
+    if vm.call_profiler is not None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Call profiler already running.")])
+    prof = Profiler.Call_Profiler()
+    vm.call_profiler = prof
+    vm.last_call_profiler = prof
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def start_profiler(vm):
+    (path_o, hz_o),_ = vm.decode_args("S", opt="I")
+    assert isinstance(path_o, Con_String)
+
+    if hz_o is None:
+        hz = Profiler.DEFAULT_HZ
+    else:
+        assert isinstance(hz_o, Con_Int)
+        hz = hz_o.v
+        if hz < 1 or hz > 1000000:
+            vm.raise_helper("Parameters_Exception", [Con_String(vm, "Invalid sampling rate.")])
+
+    if vm.profiler is not None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Profiler already running.")])
+    prof = Profiler.Sampling_Profiler(path_o.as_str(), hz)
+    try:
+        prof.start()
+    except OSError, e:
+        vm.raise_helper("VM_Exception", [Con_String(vm, os.strerror(e.errno))])
+    vm.profiler = prof
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def stop_alloc_sites(vm):
+    _,_ = vm.decode_args("")
+
+    alloc_sites = vm.alloc_sites
+    if alloc_sites is None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Allocation sites not being tracked.")])
+    assert alloc_sites is not None
+    vm.alloc_sites = None
+
+    return alloc_sites.to_dict(vm)
+
+
+@con_object_proc
+def stop_call_profiler(vm):
+    _,_ = vm.decode_args("")
+
+    if vm.call_profiler is None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Call profiler not running.")])
+    vm.call_profiler = None
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def stop_profiler(vm):
+    _,_ = vm.decode_args("")
+
+    prof = vm.profiler
+    if prof is None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Profiler not running.")])
+    assert prof is not None
+    vm.profiler = None
+    try:
+        prof.stop()
+        prof.write()
+    except OSError, e:
+        vm.raise_helper("File_Exception", [Con_String(vm, "File '%s': %s." % \
+          (prof.path, os.strerror(e.errno)))])
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
+
+
+@con_object_proc
+def write_callgrind(vm):
+    (path_o,),_ = vm.decode_args("S")
+    assert isinstance(path_o, Con_String)
+
+    prof = vm.last_call_profiler
+    if prof is None:
+        vm.raise_helper("VM_Exception", [Con_String(vm, "Call profiler has not been started.")])
+    assert prof is not None
+    try:
+        prof.write_callgrind(vm, path_o.as_str())
+    except OSError, e:
+        vm.raise_helper("File_Exception", [Con_String(vm, "File '%s': %s." % \
+          (path_o.as_str(), os.strerror(e.errno)))])
+
+    return vm.get_builtin(BUILTIN_NULL_OBJ)
@@ -97,7 +97,7 @@ def parse(vm):
         h.c_endElementNs = llhelper(endElementNsSAX2FuncP, _end_element)
         docs_eo = Con_List(vm, [])
         _storage_hack.push(_Store(vm, [docs_eo], nodes_mod))
-        r = xmlSAXUserParseMemory(h, lltype.nullptr(rffi.VOIDP.TO), xml_o.v, len(xml_o.v))
+        r = xmlSAXUserParseMemory(h, lltype.nullptr(rffi.VOIDP.TO), xml_o.as_str(), len(xml_o.as_str()))
     if r < 0 or len(_storage_hack.peek().elems_stack) != 1:
         raise Exception("XXX")
     _storage_hack.pop()
@@ -0,0 +1,351 @@
+# Copyright (c) 2011 King's College London, created by Laurence Tratt
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+import os, time
+from rpython.rlib import jit, rposix, rsignal, rtime
+from rpython.rtyper.lltypesystem import lltype, rffi
+
+from Core import *
+import Builtins
+
+
+
+
+DEFAULT_HZ = 100
+
+if rtime.HAS_CLOCK_GETTIME:
+    # rtime.c_clock_gettime is shared with the JIT, which calls it with a different clock;
+    # calling it here with the constant CLOCK_MONOTONIC would stop the JIT translating.
+    c_clock_gettime = rffi.llexternal("clock_gettime", [lltype.Signed, lltype.Ptr(rtime.TIMESPEC)],
+      rffi.INT, compilation_info=rtime.eci, releasegil=False)
+
+
+
+################################################################################################
+# Sampling profiler
+#
+# A SIGPROF timer fires every 1/hz seconds of CPU time. The signal handler merely sets RPython's
+# "signal occurred" flag, which the VM checks at safe points (see VM.check_signals); the VM then
+# calls sample, which records the current continuation frame chain. Samples are aggregated as
+# collapsed stacks (one line per distinct stack, frames separated by ";", followed by the number
+# of samples), which is the format that flamegraph tools read.
+#
+
+class Sampling_Profiler(object):
+    __slots__ = ("path", "usec", "samples", "frame_names")
+
+    def __init__(self, path, hz):
+        self.path = path
+        self.usec = 1000000 // hz
+        self.samples = {} # Collapsed stack -> number of samples
+        # (mod id, bc_off) -> frame name. Resolving a bc_off to a line is relatively slow, but the
+        # number of distinct call sites a program samples is small.
+        self.frame_names = {}
+
+
+    def start(self):
+        rsignal.pypysig_setflag(rsignal.SIGPROF)
+        # Don't let profiling cause system calls to fail with EINTR.
+        rsignal.c_siginterrupt(rsignal.SIGPROF, 0)
+        _set_timer(self.usec)
+
+
+    def stop(self):
+        _set_timer(0)
+        rsignal.pypysig_ignore(rsignal.SIGPROF)
+
+
+    def sample(self, vm):
+        names = []
+        cf = vm.cur_cf
+        while cf is not None:
+            names.append(self._frame_name(vm, cf))
+            cf = cf.parent
+        names.reverse()
+        stack = ";".join(names)
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+
+    def _frame_name(self, vm, cf):
+        func = cf.func
+        assert isinstance(func, Builtins.Con_Func)
+        pc = cf.pc
+        if isinstance(pc, Py_PC):
+            return "%s (%s)" % (func.name.as_str(), pc.mod.id_)
+
+        assert isinstance(pc, BC_PC)
+        key = (pc.mod.id_, cf.bc_off)
+        name = self.frame_names.get(key, None)
+        if name is None:
+            name = "%s (%s)" % (func.name.as_str(), src_location(vm, pc.mod, cf.bc_off))
+            self.frame_names[key] = name
+        return name
+
+
+    def write(self):
+        # Write out the collapsed stacks to self.path. Raises OSError on failure.
+        buf = []
+        for stack, n in self.samples.items():
+            buf.append("%s %d\n" % (stack, n))
+        write_file(self.path, "".join(buf))
+
+
+
+################################################################################################
+# Call profiler
+#
+# Unlike the sampling profiler, the call profiler is told about every continuation frame the VM
+# adds and removes (see VM._add_continuation_frame and VM._remove_continuation_frame), so it
+# records exact call counts, inclusive / exclusive times (from the monotonic clock, in
+# nanoseconds), and caller -> callee edges. Generators are only timed while they are running,
+# not while they are suspended. When the profiler is not running, VM.call_profiler is None; since
+# that field is quasi-immutable, the JIT removes the check entirely from traces.
+#
+
+class Func_Stats(object):
+    __slots__ = ("func", "calls", "active", "incl_ns", "excl_ns", "callees")
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.active = 0 # Number of calls to func currently on the stack
+        self.incl_ns = 0
+        self.excl_ns = 0
+        self.callees = {} # Func_Stats -> Edge_Stats
+
+
+class Edge_Stats(object):
+    __slots__ = ("calls", "incl_ns")
+
+    def __init__(self):
+        self.calls = 0
+        self.incl_ns = 0
+
+
+class _Call(object):
+    __slots__ = ("stats", "start", "run_ns", "child_ns")
+
+    def __init__(self, stats, start):
+        self.stats = stats
+        self.start = start # When the call was entered or last resumed
+        self.run_ns = 0 # Time spent running before the call was last suspended
+        self.child_ns = 0 # Time spent in callees
+
+
+class Call_Profiler(object):
+    __slots__ = ("funcs", "calls")
+
+    def __init__(self):
+        self.funcs = {} # Con_Func -> Func_Stats
+        self.calls = {} # Stack_Continuation_Frame -> _Call
+
+
+    @jit.dont_look_inside
+    def enter(self, cf):
+        func = cf.func
+        assert isinstance(func, Builtins.Con_Func)
+        stats = self.funcs.get(func, None)
+        if stats is None:
+            stats = Func_Stats(func)
+            self.funcs[func] = stats
+        stats.calls += 1
+        stats.active += 1
+
+        caller = self._get_call(cf.parent)
+        if caller is not None:
+            edge = caller.stats.callees.get(stats, None)
+            if edge is None:
+                edge = Edge_Stats()
+                caller.stats.callees[stats] = edge
+            edge.calls += 1
+
+        self.calls[cf] = _Call(stats, _now())
+
+
+    @jit.dont_look_inside
+    def exit(self, cf):
+        call = self.calls.pop(cf, None)
+        if call is None:
+            # The call started before the profiler did.
+            return
+        run_ns = _now() - call.start
+        total_ns = call.run_ns + run_ns
+        stats = call.stats
+        stats.active -= 1
+        stats.excl_ns += total_ns - call.child_ns
+        if stats.active == 0:
+            # Only the outermost of a set of recursive calls counts towards the inclusive time.
+            stats.incl_ns += total_ns
+
+        caller = self._get_call(cf.parent)
+        if caller is not None:
+            caller.child_ns += run_ns
+            caller.stats.callees[stats].incl_ns += total_ns
+
+
+    @jit.dont_look_inside
+    def suspend(self, cf):
+        # cf is a generator which has just yielded.
+        call = self.calls.get(cf, None)
+        if call is None:
+            return
+        run_ns = _now() - call.start
+        call.run_ns += run_ns
+        caller = self._get_call(cf.parent)
+        if caller is not None:
+            caller.child_ns += run_ns
+
+
+    @jit.dont_look_inside
+    def resume(self, cf):
+        call = self.calls.get(cf, None)
+        if call is not None:
+            call.start = _now()
+
+
+    def _get_call(self, cf):
+        if cf is None:
+            return None
+        return self.calls.get(cf, None)
+
+
+    def to_dict(self, vm):
+        # Returns a Con_Dict mapping the name of each function called (in the form "func
+        # (path:line)") to a Dict of its statistics.
+        labels = {} # Func_Stats -> Con_String
+        for stats in self.funcs.values():
+            path, line = _func_location(vm, stats.func)
+            if line == -1:
+                label = "%s (%s)" % (stats.func.name.as_str(), path)
+            else:
+                label = "%s (%s:%d)" % (stats.func.name.as_str(), path, line)
+            labels[stats] = Builtins.Con_String(vm, label)
+
+        entries = []
+        for stats in self.funcs.values():
+            callees = []
+            for callee, edge in stats.callees.items():
+                callees.append(labels[callee])
+                callees.append(Builtins.Con_List(vm, [Builtins.Con_Int(vm, edge.calls), \
+                  Builtins.Con_Int(vm, edge.incl_ns)]))
+            entries.append(labels[stats])
+            entries.append(Builtins.Con_Dict(vm, [
+              Builtins.Con_String(vm, "calls"), Builtins.Con_Int(vm, stats.calls),
+              Builtins.Con_String(vm, "inclusive"), Builtins.Con_Int(vm, stats.incl_ns),
+              Builtins.Con_String(vm, "exclusive"), Builtins.Con_Int(vm, stats.excl_ns),
+              Builtins.Con_String(vm, "callees"), Builtins.Con_Dict(vm, callees)]))
+
+        return Builtins.Con_Dict(vm, entries)
+
+
+    def write_callgrind(self, vm, path):
+        # Write out the statistics in callgrind format to path. Raises OSError on failure.
+        names = {} # Func_Stats -> (fl, fn, line)
+        for stats in self.funcs.values():
+            fl, line = _func_location(vm, stats.func)
+            if line == -1:
+                line = 0
+            fn = "%s:%d" % (stats.func.name.as_str(), line)
+            names[stats] = (fl, fn, line)
+
+        buf = ["# callgrind format\nversion: 1\ncreator: converge\npositions: line\n" \
+          "events: Nanoseconds\n"]
+        for stats in self.funcs.values():
+            fl, fn, line = names[stats]
+            buf.append("\nfl=%s\nfn=%s\n%d %d\n" % (fl, fn, line, stats.excl_ns))
+            for callee, edge in stats.callees.items():
+                cfl, cfn, cline = names[callee]
+                buf.append("cfl=%s\ncfn=%s\ncalls=%d %d\n%d %d\n" \
+                  % (cfl, cfn, edge.calls, cline, line, edge.incl_ns))
+        write_file(path, "".join(buf))
+
+
+
+def _now():
+    # Returns the current time from the monotonic clock in nanoseconds.
+    if rtime.HAS_CLOCK_GETTIME:
+        with lltype.scoped_alloc(rtime.TIMESPEC) as ts:
+            c_clock_gettime(rtime.CLOCK_MONOTONIC, ts)
+            return rffi.getintfield(ts, "c_tv_sec") * 1000000000 \
+              + rffi.getintfield(ts, "c_tv_nsec")
+    else:
+        return int(time.time() * 1000000000)
+
+
+def _func_location(vm, func):
+    # Returns a tuple (path, line) for the start of func. For RPython functions path is the
+    # module ID and line is -1.
+    pc = func.pc
+    if isinstance(pc, Py_PC):
+        return pc.mod.id_, -1
+    assert isinstance(pc, BC_PC)
+    return _src_path_line(vm, pc.mod, pc.off)
+
+
+def src_location(vm, mod, bc_off):
+    # Returns a "path:line" string for the source code which bc_off in mod was compiled from.
+    path, line = _src_path_line(vm, mod, bc_off)
+    if line == -1:
+        return path
+    return "%s:%d" % (path, line)
+
+
+def _src_path_line(vm, mod, bc_off):
+    # Returns a tuple (path, line) for the source code which bc_off in mod was compiled from. If
+    # the source module isn't available, path is its module ID and line is -1.
+    src_infos = mod.bc_off_to_src_infos(vm, bc_off)
+    assert isinstance(src_infos, Builtins.Con_List)
+    src_info = src_infos.l[0]
+    assert isinstance(src_info, Builtins.Con_List)
+    mod_id = Builtins.type_check_string(vm, src_info.l[0]).as_str()
+    src_off = Builtins.type_check_int(vm, src_info.l[1]).v
+
+    src_mod = vm.find_mod(mod_id)
+    if src_mod is None or not src_mod.is_bc:
+        return mod_id, -1
+    line, _ = src_mod.src_offset_to_line_column(src_off)
+    return src_mod.src_path, line
+
+
+def write_file(path, s):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+    try:
+        while len(s) > 0:
+            n = os.write(fd, s)
+            assert n >= 0
+            s = s[n:]
+    finally:
+        os.close(fd)
+
+
+def _set_timer(usec):
+    # Set the SIGPROF timer to fire every usec microseconds (0 disables it).
+    with lltype.scoped_alloc(rsignal.itimervalP.TO, 1) as new:
+        _set_timeval(new[0].c_it_value, usec)
+        _set_timeval(new[0].c_it_interval, usec)
+        if rsignal.c_setitimer(rsignal.ITIMER_PROF, new, lltype.nullptr(rsignal.itimervalP.TO)) \
+          == -1:
+            raise OSError(rposix.get_saved_errno(), "setitimer failed")
+
+
+def _set_timeval(tv, usec):
+    rffi.setintfield(tv, "c_tv_sec", usec // 1000000)
+    rffi.setintfield(tv, "c_tv_usec", usec % 1000000)
@@ -34,7 +34,8 @@ else:
     INTSIZE = 4
     FLOATSIZE = 8
 
-INSTR_NAMES = [None, "EXBI", "VAR_LOOKUP", "VAR_ASSIGN", None, "ADD_FAILURE_FRAME", "ADD_FAIL_UP_FRAME", "REMOVE_FAILURE_FRAME", "IS_ASSIGNED", "IS", "FAIL_NOW", "POP", "LIST", "SLOT_LOOKUP", "APPLY", "FUNC_DEFN", "RETURN", "BRANCH", "YIELD", None, "IMPORT", "DICT", "DUP", "PULL", "CHANGE_FAIL_POINT", None, "BUILTIN_LOOKUP", "ASSIGN_SLOT", "EYIELD", "ADD_EXCEPTION_FRAME", None, "INSTANCE_OF", "REMOVE_EXCEPTION_FRAME", "RAISE", "SET_ITEM", "UNPACK_ARGS", "SET", "BRANCH_IF_NOT_FAIL", "BRANCH_IF_FAIL", "CONST_GET", None, "PRE_SLOT_LOOKUP_APPLY", "UNPACK_ASSIGN", "EQ", "LE", "ADD", "SUBTRACT", "NEQ", "LE_EQ", "GR_EQ", "GT", "MODULE_LOOKUP"]
+INSTR_NAMES = [None, "EXBI", "VAR_LOOKUP", "VAR_ASSIGN", None, "ADD_FAILURE_FRAME", "ADD_FAIL_UP_FRAME", "REMOVE_FAILURE_FRAME", "IS_ASSIGNED", "IS", "FAIL_NOW", "POP", "LIST", "SLOT_LOOKUP", "APPLY", "FUNC_DEFN", "RETURN", "BRANCH", "YIELD", None, "IMPORT", "DICT", "DUP", "PULL", "CHANGE_FAIL_POINT", None, "BUILTIN_LOOKUP", "ASSIGN_SLOT", "EYIELD", "ADD_EXCEPTION_FRAME", None, "INSTANCE_OF", "REMOVE_EXCEPTION_FRAME", "RAISE", "SET_ITEM", "UNPACK_ARGS", "SET", "BRANCH_IF_NOT_FAIL", "BRANCH_IF_FAIL", "CONST_GET", None, "PRE_SLOT_LOOKUP_APPLY", "UNPACK_ASSIGN", "EQ", "LE", "ADD", "SUBTRACT", "NEQ", "LE_EQ", "GR_EQ", "GT", "MODULE_LOOKUP",
+  "VAR_LOOKUP_LOCAL", "VAR_ASSIGN_LOCAL"]
 
 CONST_STRING = 0
 CONST_INT = 1
@@ -76,6 +77,7 @@ if INTSIZE == 8:
     BC_MOD_IMPORT_DEFNS = 27 * 8
     BC_MOD_NUM_IMPORT_DEFNS = 28 * 8
     BC_MOD_SIZE = 29 * 8
+    BC_MOD_INIT_MAX_STACK_SIZE = 30 * 8
     
     # Libraries
 
@@ -99,7 +101,7 @@ if INTSIZE == 8:
     CON_INSTR_LIST = 12                   # bits 0-7 12, bits 8-31 number of list elements
     CON_INSTR_SLOT_LOOKUP = 13            # bits 0-7 13, bits 8-31 size of slot name, bits 32-.. slot name
     CON_INSTR_APPLY = 14                  # bits 0-7 14, bits 8-31 number of args
-    CON_INSTR_FUNC_DEFN = 15              # bits 0-7 15, bits 8-9 is_bound, bits 9-32 max_stack_size, bit 33 has_loop
+    CON_INSTR_FUNC_DEFN = 15              # bits 0-7 15, bit 8 is_bound, bits 9-29 max_stack_size, bit 30 frame_vars, bit 31 has_loop
     CON_INSTR_RETURN = 16                 # bits 0-7 16
     CON_INSTR_BRANCH = 17                 # bits 0-7 17, bits 8-30 pc offset, bit 31 offset sign (0 = positive, 1 = negative)
     CON_INSTR_YIELD = 18                  # bits 0-7 18
@@ -133,6 +135,8 @@ if INTSIZE == 8:
     CON_INSTR_GR_EQ = 49                  # bits 0-7 49
     CON_INSTR_GT = 50                     # bits 0-7 50
     CON_INSTR_MODULE_LOOKUP = 51          # bits 0-7 51, bits 8-31 := size of definition name, bits 32-.. := definition name
+    CON_INSTR_VAR_LOOKUP_LOCAL = 52       # bits 0-7 52, bits 8-31 var number
+    CON_INSTR_VAR_ASSIGN_LOCAL = 53       # bits 0-7 53, bits 8-31 var number
 
     @elidable_promote()
     def extract_str(bc, off, size):
@@ -171,6 +175,14 @@ if INTSIZE == 8:
     def unpack_var_assign(instr):
         return ((instr & 0x000FFF00) >> 8, (instr & 0xFFF00000) >> 20)
 
+    @elidable_promote()
+    def unpack_var_lookup_local(instr):
+        return (instr & 0xFFFFFF00) >> 8
+
+    @elidable_promote()
+    def unpack_var_assign_local(instr):
+        return (instr & 0xFFFFFF00) >> 8
+
     @elidable_promote()
     def unpack_int(instr):
         x = 63
@@ -195,7 +207,8 @@ if INTSIZE == 8:
 
     @elidable_promote()
     def unpack_func_defn(instr):
-        return ((instr & 0x00000100) >> 8, (instr & 0x7ffffe00) >> 9, (instr & 0x80000000))
+        return ((instr & 0x00000100) >> 8, (instr & 0x3ffffe00) >> 9, (instr & 0x40000000) >> 30, \
+          (instr & 0x80000000))
 
     @elidable_promote()
     def unpack_list(instr):
@@ -318,6 +331,7 @@ else:
     BC_MOD_IMPORT_DEFNS = 28 * 4
     BC_MOD_NUM_IMPORT_DEFNS = 29 * 4
     BC_MOD_SIZE = 30 * 4
+    BC_MOD_INIT_MAX_STACK_SIZE = 31 * 4
     
     # Libraries
 
@@ -341,7 +355,7 @@ else:
     CON_INSTR_LIST = 12                   # bits 0-7 12, bits 8-31 number of list elements
     CON_INSTR_SLOT_LOOKUP = 13            # bits 0-7 13, bits 8-31 size of slot name, bits 32-.. slot name
     CON_INSTR_APPLY = 14                  # bits 0-7 14, bits 8-31 number of args
-    CON_INSTR_FUNC_DEFN = 15              # bits 0-7 15, bits 8-9 is_bound
+    CON_INSTR_FUNC_DEFN = 15              # bits 0-7 15, bit 8 is_bound, bits 9-29 max_stack_size, bit 30 frame_vars, bit 31 has_loop
     CON_INSTR_RETURN = 16                 # bits 0-7 16
     CON_INSTR_BRANCH = 17                 # bits 0-7 17, bits 8-30 pc offset, bit 31 offset sign (0 = positive, 1 = negative)
     CON_INSTR_YIELD = 18                  # bits 0-7 18
@@ -375,6 +389,8 @@ else:
     CON_INSTR_GR_EQ = 49                  # bits 0-7 49
     CON_INSTR_GT = 50                     # bits 0-7 50
     CON_INSTR_MODULE_LOOKUP = 51          # bits 0-7 51, bits 8-31 := size of definition name, bits 32-.. := definition name
+    CON_INSTR_VAR_LOOKUP_LOCAL = 52       # bits 0-7 52, bits 8-31 var number
+    CON_INSTR_VAR_ASSIGN_LOCAL = 53       # bits 0-7 53, bits 8-31 var number
 
     @elidable_promote()
     def extract_str(bc, off, size):
@@ -416,6 +432,16 @@ else:
         x = 0xFFF
         return ((instr & (x << 8)) >> 8, (instr & (x << 20)) >> 20)
 
+    @elidable_promote()
+    def unpack_var_lookup_local(instr):
+        x = 0xFFFFFF
+        return (instr & (x << 8)) >> 8
+
+    @elidable_promote()
+    def unpack_var_assign_local(instr):
+        x = 0xFFFFFF
+        return (instr & (x << 8)) >> 8
+
     @elidable_promote()
     def unpack_int(instr):
         x = 31
@@ -444,8 +470,9 @@ else:
 
     @elidable_promote()
     def unpack_func_defn(instr):
-        x = 0x7ffffe
-        return ((instr & 0x00000100) >> 8, (instr & (x << 8)) >> 9, (instr & (1 << 31)))
+        x = 0x3ffffe
+        return ((instr & 0x00000100) >> 8, (instr & (x << 8)) >> 9, (instr & (1 << 30)) >> 30, \
+          (instr & (1 << 31)))
 
     @elidable_promote()
     def unpack_list(instr):
@@ -22,17 +22,29 @@
 import os, sys
 
 from pypy.config.pypyoption import get_pypy_config
-from rpython.rlib import debug, jit, objectmodel
+from rpython.rlib import debug, jit, objectmodel, rgil, rsignal, rthread
 from rpython.rtyper.lltypesystem import lltype, llmemory, rffi
 
 from Core import *
-import Builtins, Target
+import Builtins, Config, Target
 
 
 
 
 DEBUG = False
 
+# Once threads have been started, a thread gives others a chance to run (by releasing the GIL)
+# every TICKS_PER_YIELD backwards jumps.
+TICKS_PER_YIELD = 100
+
+# Continuation frames' stacks are rounded up to a multiple of FRAME_STACK_GRANULE, so that a frame
+# can be recycled by any function with a similar stack size. Frames with stacks larger than
+# FRAME_POOL_MAX_STACK_SIZE are never recycled, and at most FRAME_POOL_MAX_FREE free frames of each
+# size are kept.
+FRAME_STACK_GRANULE = 4
+FRAME_POOL_MAX_STACK_SIZE = 64
+FRAME_POOL_MAX_FREE = 32
+
 
 
 def get_printable_location(bc_off, mod_bc, pc, self):
@@ -48,19 +60,34 @@ jitdriver = jit.JitDriver(greens=["bc_off", "mod_bc", "pc", "self"],
 
 
 class VM(object):
-    __slots__ = ("argv", "builtins", "cur_cf", "mods", "pypy_config", "vm_path")
-    _immutable_fields_ = ("argv", "builtins", "mods", "vm_path")
+    __slots__ = ("alloc_sites", "argv", "builtins", "call_profiler", "char_strs", "counters",
+      "cur_cf", "cur_ts", "frame_pool", "last_call_profiler", "mods", "profiler", "pypy_config",
+      "threads_started", "ticker", "vm_path")
+    _immutable_fields_ = ("alloc_sites?", "argv", "builtins", "call_profiler?", "char_strs[*]",
+      "counters?", "frame_pool", "mods", "threads_started?", "vm_path")
 
     def __init__(self): 
         self.builtins = [None] * Builtins.NUM_BUILTINS
+        self.char_strs = None # Single character strings, set by Builtins.bootstrap_con_string
         self.mods = {}
         self.cur_cf = None # Current continuation frame
+        self.cur_ts = None # The Thread_State of the thread which last held the GIL
+        self.frame_pool = Frame_Pool()
+        self.profiler = None # The running Profiler.Sampling_Profiler, if any
+        self.call_profiler = None # The running Profiler.Call_Profiler, if any
+        self.last_call_profiler = None # The most recently started Profiler.Call_Profiler
+        self.counters = None # A Counters.Counters if counting is enabled (converge --stats)
+        self.alloc_sites = None # A Heap.Alloc_Sites if allocation sites are being tracked
         self.pypy_config = None
+        self.threads_started = False
+        self.ticker = TICKS_PER_YIELD
 
 
     def init(self, vm_path,argv):
         self.vm_path = vm_path
         self.argv = argv
+        self.cur_ts = Thread_State()
+        _thread_state.set(self.cur_ts)
         
         Builtins.bootstrap_con_object(self)
         Builtins.bootstrap_con_class(self)
@@ -187,6 +214,8 @@ class VM(object):
         else:
             o = self.execute_proc(cf)
         self._remove_continuation_frame()
+        closure = cf.closure
+        self.frame_pool.free_frame(cf)
         
         if o is self.get_builtin(Builtins.BUILTIN_FAIL_OBJ):
             o = None
@@ -194,7 +223,7 @@ class VM(object):
             self.raise_helper("VM_Exception", [Builtins.Con_String(self, \
               "Function attempting to return fail, but caller can not handle failure.")])
 
-        return o, cf.closure
+        return o, closure
 
 
     def pre_get_slot_apply_pump(self, o, n, args=None):
@@ -209,6 +238,8 @@ class VM(object):
 
         cf = self.cur_cf
         gf = Stack_Generator_Frame(cf.gfp, -1)
+        if Config.COUNTERS and self.counters is not None:
+            self.counters.gen_frames += 1
         cf.gfp = cf.stackpe
         cf.stack_push(gf)
         if isinstance(func, Builtins.Con_Partial_Application):
@@ -250,6 +281,8 @@ class VM(object):
             assert cf.parent is self.cur_cf
             self.cur_cf = cf
             gen = gf.gen
+            if self.call_profiler is not None:
+                self.call_profiler.resume(cf)
 
         try:
             o = gen.next()
@@ -266,6 +299,8 @@ class VM(object):
             self._remove_generator_frame(cf)
         else:
             saved_cf = self.cur_cf
+            if self.call_profiler is not None:
+                self.call_profiler.suspend(saved_cf)
             self.cur_cf = cf = saved_cf.parent
 
             # At this point cf.stack looks like:
@@ -410,6 +445,8 @@ class VM(object):
 
     def raise_(self, ex):
         ex = Builtins.type_check_exception(self, ex)
+        if Config.COUNTERS and self.counters is not None:
+            self.counters.exceptions += 1
         if ex.call_chain is None:
             cc = [] # Call chain
             cf = self.cur_cf
@@ -430,6 +467,74 @@ class VM(object):
         self.raise_(ex)
 
 
+    ################################################################################################
+    # Threads
+    #
+    # Only the thread holding the GIL runs Converge code. The GIL is released around blocking
+    # external calls (RPython does this automatically for any llexternal which isn't marked
+    # releasegil=False) and periodically by tick. The running thread's continuation frame is kept
+    # in cur_cf, so that the interpreter doesn't have to look it up in thread-local storage; when a
+    # different thread acquires the GIL, _after_thread_switch saves the previous thread's cur_cf in
+    # its Thread_State and restores the new thread's.
+    #
+
+    def start_threads(self):
+        # Must be called before any thread other than the main thread is started. threads_started
+        # is quasi-immutable, as it changes at most once, so that traces needn't read it in tick.
+        if not self.threads_started:
+            rgil.invoke_after_thread_switch(_after_thread_switch)
+            self.threads_started = True
+
+
+    def enter_thread(self):
+        # Called by a newly started thread once it holds the GIL, before it runs any Converge code.
+        ts = Thread_State()
+        _thread_state.set(ts)
+        self.cur_ts.cur_cf = self.cur_cf
+        self.cur_ts = ts
+        self.cur_cf = None
+
+
+    def tick(self):
+        self.check_signals()
+        if self.threads_started:
+            self.ticker -= 1
+            if self.ticker <= 0:
+                self.ticker = TICKS_PER_YIELD
+                self.yield_thread()
+
+
+    @jit.dont_look_inside
+    def yield_thread(self):
+        # Give other threads waiting for the GIL a chance to run.
+        rgil.yield_thread()
+
+
+    ################################################################################################
+    # Signals
+    #
+    # Signal handlers installed with rsignal.pypysig_setflag do nothing more than record the
+    # signal and set a flag. check_signals tests that flag, which is cheap enough to be done at
+    # every safe point (function entry and backwards jumps); the real work is done outside the
+    # signal handler, in handle_signals.
+    #
+
+    def check_signals(self):
+        if rsignal.pypysig_getaddr_occurred().c_value < 0:
+            self.handle_signals()
+
+
+    @jit.dont_look_inside
+    def handle_signals(self):
+        rsignal.pypysig_getaddr_occurred().c_value = 0
+        while 1:
+            signum = rsignal.pypysig_poll()
+            if signum == -1:
+                break
+            if signum == rsignal.SIGPROF and self.profiler is not None:
+                self.profiler.sample(self)
+
+
     ################################################################################################
     # The interpreter
     #
@@ -525,15 +630,21 @@ class VM(object):
         pc = cf.pc
         mod_bc = pc.mod.bc
         prev_bc_off = -1
+        self.check_signals()
         while 1:
             bc_off = cf.bc_off
             if prev_bc_off != -1 and prev_bc_off > bc_off:
+                self.tick()
                 jitdriver.can_enter_jit(bc_off=bc_off, mod_bc=mod_bc, cf=cf, prev_bc_off=prev_bc_off, pc=pc, self=self)
             jitdriver.jit_merge_point(bc_off=bc_off, mod_bc=mod_bc, cf=cf, prev_bc_off=prev_bc_off, pc=pc, self=self)
             assert cf is self.cur_cf
             prev_bc_off = bc_off
             instr = Target.read_word(mod_bc, bc_off)
             it = Target.get_instr(instr)
+            if Config.COUNTERS and self.counters is not None:
+                self.counters.count_instr(pc.mod, it)
+            if self.alloc_sites is not None:
+                self.alloc_sites.at(pc.mod, bc_off)
 
             try:
                 #x = cf.stackpe; assert x >= 0; print "%s %s %d [stackpe:%d ffp:%d gfp:%d xfp:%d]" % (Target.INSTR_NAMES[instr & 0xFF], str(cf.stack[:x]), bc_off, cf.stackpe, cf.ffp, cf.gfp, cf.xfp)
@@ -543,6 +654,10 @@ class VM(object):
                     self._instr_var_lookup(instr, cf)
                 elif it == Target.CON_INSTR_VAR_ASSIGN:
                     self._instr_var_assign(instr, cf)
+                elif it == Target.CON_INSTR_VAR_LOOKUP_LOCAL:
+                    self._instr_var_lookup_local(instr, cf)
+                elif it == Target.CON_INSTR_VAR_ASSIGN_LOCAL:
+                    self._instr_var_assign_local(instr, cf)
                 elif it == Target.CON_INSTR_ADD_FAILURE_FRAME:
                     self._instr_add_failure_frame(instr, cf)
                 elif it == Target.CON_INSTR_ADD_FAIL_UP_FRAME:
@@ -675,6 +790,21 @@ class VM(object):
         cf.bc_off += Target.INTSIZE
 
 
+    def _instr_var_lookup_local(self, instr, cf):
+        var_num = Target.unpack_var_lookup_local(instr)
+        v = cf.stack_get(cf.localsp + var_num)
+        if not v:
+            self.raise_helper("Unassigned_Var_Exception")
+        cf.stack_push(v)
+        cf.bc_off += Target.INTSIZE
+
+
+    def _instr_var_assign_local(self, instr, cf):
+        var_num = Target.unpack_var_assign_local(instr)
+        cf.stack_set(cf.localsp + var_num, cf.stack_get(cf.stackpe - 1))
+        cf.bc_off += Target.INTSIZE
+
+
     def _instr_add_failure_frame(self, instr, cf):
         off = Target.unpack_add_failure_frame(instr)
         self._add_failure_frame(cf, False, cf.bc_off + off)
@@ -694,12 +824,15 @@ class VM(object):
     @jit.unroll_safe
     def _instr_is_assigned(self, instr, cf):
         closure_off, var_num = Target.unpack_var_lookup(instr)
-        closure = cf.closure
-        while closure_off > 0:
-            closure = closure.parent
-            closure_off -= 1
-        v = closure.vars[var_num]
-        if closure.vars[var_num] is not None:
+        if cf.func.frame_vars:
+            v = cf.stack_get(cf.localsp + var_num)
+        else:
+            closure = cf.closure
+            while closure_off > 0:
+                closure = closure.parent
+                closure_off -= 1
+            v = closure.vars[var_num]
+        if v is not None:
             pc = cf.pc
             assert isinstance(pc, BC_PC)
             mod_bc = pc.mod.bc
@@ -763,6 +896,8 @@ class VM(object):
 
         if ff.is_fail_up:
             gf = Stack_Generator_Frame(cf.gfp, cf.bc_off + Target.INTSIZE)
+            if Config.COUNTERS and self.counters is not None:
+                self.counters.gen_frames += 1
             cf.stack_set(fp, gf)
             cf.gfp = fp
             o = self.apply_pump()
@@ -770,6 +905,7 @@ class VM(object):
             cf.stack_pop() # Function pointer
             o = self.execute_proc(new_cf)
             self._remove_continuation_frame()
+            self.frame_pool.free_frame(new_cf)
             
             if o is self.get_builtin(Builtins.BUILTIN_FAIL_OBJ):
                 o = None
@@ -786,7 +922,7 @@ class VM(object):
 
 
     def _instr_func_defn(self, instr, cf):
-        is_bound, max_stack_size, has_loop = Target.unpack_func_defn(instr)
+        is_bound, max_stack_size, frame_vars, has_loop = Target.unpack_func_defn(instr)
         np_o = cf.stack_pop()
         assert isinstance(np_o, Builtins.Con_Int)
         nv_o = cf.stack_pop()
@@ -795,7 +931,7 @@ class VM(object):
         new_pc = BC_PC(cf.pc.mod, cf.bc_off + 2 * Target.INTSIZE)
         container = cf.func.get_slot(self, "container")
         f = Builtins.Con_Func(self, name, is_bound, new_pc, max_stack_size, np_o.v, nv_o.v, \
-          container, cf.closure, has_loop=has_loop)
+          container, cf.closure, has_loop=has_loop, frame_vars=frame_vars)
         cf.stack_push(f)
         cf.bc_off += Target.INTSIZE
 
@@ -850,6 +986,8 @@ class VM(object):
         self._remove_failure_frame(cf)
         prev_gfp = cf.gfp
         egf = Stack_Generator_EYield_Frame(prev_gfp, resume_bc_off)
+        if Config.COUNTERS and self.counters is not None:
+            self.counters.gen_frames += 1
         cf.gfp = cf.stackpe
         cf.stack_push(egf)
         # At this point the Con_Stack looks like:
@@ -909,7 +1047,7 @@ class VM(object):
                     else:
                         o = cf.stack_pop()
                     assert isinstance(o, Builtins.Con_Object)
-                    cf.closure.vars[Target.unpack_unpack_args_arg_num(arg_info)] = o
+                    self._set_arg(cf, Target.unpack_unpack_args_arg_num(arg_info), o)
 
         if has_vargs:
             arg_offset = cf.bc_off + Target.INTSIZE + num_fargs * Target.INTSIZE
@@ -922,12 +1060,20 @@ class VM(object):
                 assert i >= 0 and j >= 0
                 l = cf.stack_get_slice(i, j)
                 cf.stackpe = i + 1
-            cf.closure.vars[Target.unpack_unpack_args_arg_num(arg_info)] = Builtins.Con_List(self, l)
+            self._set_arg(cf, Target.unpack_unpack_args_arg_num(arg_info), \
+              Builtins.Con_List(self, l))
             cf.bc_off += Target.INTSIZE + (num_fargs + 1) * Target.INTSIZE
         else:
             cf.bc_off += Target.INTSIZE + num_fargs * Target.INTSIZE
 
 
+    def _set_arg(self, cf, var_num, o):
+        if cf.func.frame_vars:
+            cf.stack_set(cf.localsp + var_num, o)
+        else:
+            cf.closure.vars[var_num] = o
+
+
     def _instr_set(self, instr, cf):
         ne = Target.unpack_set(instr)
         l = cf.stack_get_slice_del(cf.stackpe - ne)
@@ -1039,7 +1185,14 @@ class VM(object):
         else:
             bc_off = -1 
 
-        closure = Closure(func.container_closure, func.num_vars)
+        if func.frame_vars:
+            # The function's variables are kept at the end of its frame's stack, and it looks up
+            # variables in enclosing functions directly via its container's closure.
+            closure = func.container_closure
+            num_locals = func.num_vars
+        else:
+            closure = Closure(func.container_closure, func.num_vars)
+            num_locals = 0
 
         if func.max_stack_size > nargs:
             max_stack_size = func.max_stack_size
@@ -1054,20 +1207,28 @@ class VM(object):
         stack_count += 1
         func.stack_count = stack_count
 
-        cf = Stack_Continuation_Frame(self.cur_cf, func, pc, max_stack_size, nargs, bc_off,
-          closure)
+        cf = self.frame_pool.new_frame(self.cur_cf, func, pc, max_stack_size + num_locals, nargs,
+          bc_off, closure, num_locals)
         self.cur_cf = cf
+        if Config.COUNTERS and self.counters is not None:
+            self.counters.cont_frames += 1
+        if self.call_profiler is not None:
+            self.call_profiler.enter(cf)
         
         return cf, stack_count
 
 
     def _remove_continuation_frame(self):
         old_cf = self.cur_cf
+        if self.call_profiler is not None:
+            self.call_profiler.exit(old_cf)
         old_func = old_cf.func
         old_stack_count = old_func.stack_count
         assert old_stack_count > 0
         old_func.stack_count = old_stack_count - 1
         self.cur_cf = old_cf.parent
+        if self.alloc_sites is not None:
+            self.alloc_sites.resume(self.cur_cf)
 
 
     def _remove_generator_frame(self, cf):
@@ -1082,6 +1243,8 @@ class VM(object):
 
     def _add_failure_frame(self, cf, is_fail_up, new_off=-1):
         ff = Stack_Failure_Frame()
+        if Config.COUNTERS and self.counters is not None:
+            self.counters.fail_frames += 1
 
         ff.is_fail_up = is_fail_up
         ff.prev_ffp = cf.ffp
@@ -1160,16 +1323,20 @@ class VM(object):
 #
 
 class Stack_Continuation_Frame(Con_Thingy):
-    __slots__ = ("parent", "stack", "stackpe", "func", "pc", "nargs", "bc_off", "closure", "ffp",
-      "gfp", "xfp", "returned")
-    _immutable_fields_ = ("parent", "stack", "ff_cache", "func", "closure", "pc", "nargs")
+    __slots__ = ("parent", "stack", "stackpe", "localsp", "func", "pc", "nargs", "bc_off",
+      "closure", "ffp", "gfp", "xfp", "returned")
+    _immutable_fields_ = ("parent", "stack", "ff_cache", "func", "closure", "pc", "nargs",
+      "localsp")
     _virtualizable_ = ("parent", "bc_off", "stack[*]", "closure", "stackpe", "ffp", "gfp")
 
-    def __init__(self, parent, func, pc, max_stack_size, nargs, bc_off, closure):
+    def __init__(self, parent, func, pc, max_stack_size, nargs, bc_off, closure, num_locals):
         self = jit.hint(self, access_directly=True, fresh_virtualizable=True)
         self.parent = parent
         self.stack = [None] * max_stack_size
         debug.make_sure_not_resized(self.stack)
+        # If func.frame_vars is set, its variables are stored in the last num_locals elements of
+        # stack, starting at localsp; the stack proper may not grow beyond localsp.
+        self.localsp = max_stack_size - num_locals
         self.func = func
         self.pc = pc
         self.nargs = nargs # Number of arguments passed to this continuation
@@ -1184,6 +1351,30 @@ class Stack_Continuation_Frame(Con_Thingy):
         self.ffp = self.gfp = self.xfp = -1
 
 
+    def reuse(self, parent, func, pc, nargs, bc_off, closure, num_locals):
+        # Reinitialise a frame taken from a Frame_Pool. Although some of the fields set here are
+        # immutable, a frame is only recycled once nothing (including any trace) refers to it.
+        self.parent = parent
+        self.func = func
+        self.pc = pc
+        self.nargs = nargs
+        self.bc_off = bc_off
+        self.closure = closure
+        self.localsp = len(self.stack) - num_locals
+        self.returned = False
+        self.stackpe = 0
+        self.ffp = self.gfp = self.xfp = -1
+
+
+    def clear(self):
+        # Drop everything this frame refers to, so that a frame sitting in a Frame_Pool doesn't keep
+        # objects alive.
+        for i in range(len(self.stack)):
+            self.stack[i] = None
+        self.parent = None
+        self.closure = None
+
+
     def stack_get(self, i):
         assert i >= 0
         return self.stack[i]
@@ -1226,7 +1417,7 @@ class Stack_Continuation_Frame(Con_Thingy):
 
 
     def stack_push(self, x):
-        assert self.stackpe < len(self.stack)
+        assert self.stackpe < self.localsp
         self.stack_set(self.stackpe, x)
         self.stackpe += 1
 
@@ -1312,6 +1503,49 @@ class Stack_Exception_Frame(Con_Thingy):
 
 
 
+class Frame_Pool(object):
+    # Freelists of continuation frames, indexed by stack size, so that calls made by the
+    # interpreter needn't allocate a new frame and stack. Only frames which have returned normally
+    # from a non-generator call are recycled, since those are the only ones nothing else can refer
+    # to. Traced code always allocates fresh frames, which the JIT can then keep virtual.
+    __slots__ = ("free",)
+
+    def __init__(self):
+        self.free = []
+        for i in range(FRAME_POOL_MAX_STACK_SIZE // FRAME_STACK_GRANULE):
+            self.free.append([])
+
+
+    def new_frame(self, parent, func, pc, max_stack_size, nargs, bc_off, closure, num_locals):
+        if max_stack_size > FRAME_POOL_MAX_STACK_SIZE:
+            return Stack_Continuation_Frame(parent, func, pc, max_stack_size, nargs, bc_off,
+              closure, num_locals)
+        stack_size = (max_stack_size + FRAME_STACK_GRANULE - 1) // FRAME_STACK_GRANULE \
+          * FRAME_STACK_GRANULE
+        if not jit.we_are_jitted():
+            free = self.free[stack_size // FRAME_STACK_GRANULE - 1]
+            if len(free) > 0:
+                cf = free.pop()
+                cf.reuse(parent, func, pc, nargs, bc_off, closure, num_locals)
+                return cf
+        return Stack_Continuation_Frame(parent, func, pc, stack_size, nargs, bc_off, closure,
+          num_locals)
+
+
+    def free_frame(self, cf):
+        # cf has returned and must no longer be referred to by anything.
+        if jit.we_are_jitted():
+            return
+        stack_size = len(cf.stack)
+        if stack_size > FRAME_POOL_MAX_STACK_SIZE:
+            return
+        free = self.free[stack_size // FRAME_STACK_GRANULE - 1]
+        if len(free) < FRAME_POOL_MAX_FREE:
+            cf.clear()
+            free.append(cf)
+
+
+
 ####################################################################################################
 # Misc
 #
@@ -1326,6 +1560,28 @@ class Closure:
         debug.make_sure_not_resized(self.vars)
 
 
+class Thread_State(object):
+    __slots__ = ("cur_cf",)
+
+    def __init__(self):
+        self.cur_cf = None # Only up to date when this thread doesn't hold the GIL.
+
+
+_thread_state = rthread.ThreadLocalReference(Thread_State)
+
+
+def _after_thread_switch():
+    # Called by RPython whenever a thread (re)acquires the GIL.
+    vm = global_vm
+    ts = _thread_state.get()
+    if ts is None or ts is vm.cur_ts:
+        # Either a new thread (which calls enter_thread itself), or the same thread as before.
+        return
+    vm.cur_ts.cur_cf = vm.cur_cf
+    vm.cur_cf = ts.cur_cf
+    vm.cur_ts = ts
+
+
 class Con_Raise_Exception(Exception):
     _immutable_ = True
 
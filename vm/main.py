@@ -33,7 +33,7 @@ from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rtyper.tool import rffi_platform as platform
 from rpython.translator.tool.cbuild import ExternalCompilationInfo
 import os, os.path, sys
-import Builtins, Bytecode, Config, Stdlib_Modules, VM
+import Builtins, Bytecode, Config, Counters, JIT_Stats, Profiler, Stdlib_Modules, VM
 
 
 
@@ -49,6 +49,8 @@ cconfig  = platform.configure(CConfig)
 BUFSIZ   = cconfig["BUFSIZ"]
 PATH_MAX = cconfig["PATH_MAX"]
 getenv   = rffi.llexternal("getenv", [rffi.CCHARP], rffi.CCHARP, compilation_info=eci)
+setenv   = rffi.llexternal("setenv", [rffi.CCHARP, rffi.CCHARP, rffi.INT], rffi.INT, \
+             compilation_info=eci)
 realpath = rffi.llexternal("realpath", [rffi.CCHARP, rffi.CCHARP], rffi.CCHARP, compilation_info=eci)
 strlen   = rffi.llexternal("strlen", [rffi.CCHARP], rffi.SIZE_T, compilation_info=eci)
 
@@ -63,23 +65,57 @@ def entry_point(argv):
     
     verbosity = 0
     mk_fresh = False
+    prof_path = None
+    stats = False
+    jit_params = None
+    gc_env = [] # List of (PYPY_GC_* environment variable, value) pairs
     i = 1
-    for i in range(1, len(argv)):
+    while i < len(argv):
         arg = argv[i]
         if len(arg) == 0 or (len(arg) == 1 and arg[0] == "-"):
             _usage(vm_path)
             return 1
-        if arg[0] == "-":
+        if arg == "--stats":
+            stats = True
+            i += 1
+        elif arg == "--jit":
+            # --jit takes the next argument as JIT parameters, in the form
+            # "param=value,param=value" (e.g. "threshold=500,trace_limit=8000") or "off".
+            i += 1
+            if i == len(argv):
+                _usage(vm_path)
+                return 1
+            jit_params = argv[i]
+            i += 1
+        elif arg.startswith("--gc-nursery="):
+            gc_env.append(("PYPY_GC_NURSERY", arg[len("--gc-nursery="):]))
+            i += 1
+        elif arg.startswith("--gc-max-heap="):
+            gc_env.append(("PYPY_GC_MAX", arg[len("--gc-max-heap="):]))
+            i += 1
+        elif arg[0] == "-":
             for c in arg[1:]:
                 if c == "v":
                     verbosity += 1
                 elif c == "f":
                     mk_fresh = True
+                elif c == "p":
+                    # -p takes the next argument as the path to write the profile to.
+                    i += 1
+                    if i == len(argv):
+                        _usage(vm_path)
+                        return 1
+                    prof_path = argv[i]
                 else:
                     _usage(vm_path)
                     return 1
+            i += 1
         else:
             break
+    if len(gc_env) > 0:
+        rtn = _set_gc_env(vm_path, argv, gc_env)
+        if rtn != 0:
+            return rtn
     if i < len(argv):
         filename = argv[i]
         if i + 1 < len(argv):
@@ -113,9 +149,36 @@ def entry_point(argv):
 
     assert start >= 0
     useful_bc = rffi.str2charp(bc[start:])
+    if jit_params is not None:
+        try:
+            set_user_param(VM.jitdriver, jit_params)
+        except ValueError:
+            _error(vm_path, "Invalid JIT parameters '%s'." % jit_params)
+            return 1
+        except TraceLimitTooHigh:
+            _error(vm_path, "JIT trace_limit too high.")
+            return 1
+
+    if stats and not Config.COUNTERS:
+        _error(vm_path, "--stats not available (rebuild after running configure with"
+          " --enable-counters).")
+        return 1
+
     vm = VM.new_vm(vm_path, args)
+    if stats:
+        vm.counters = Counters.Counters()
     _import_lib(vm, "Stdlib.cvl", vm_path, STDLIB_DIRS)
     _import_lib(vm, "Compiler.cvl", vm_path, COMPILER_DIRS)
+    if prof_path is not None:
+        prof = Profiler.Sampling_Profiler(prof_path, Profiler.DEFAULT_HZ)
+        try:
+            prof.start()
+        except OSError, e:
+            _error(vm_path, "Unable to start profiler: %s." % os.strerror(e.errno))
+            return 1
+        vm.profiler = prof
+
+    rtn = 0
     try:
         main_mod_id = Bytecode.add_exec(vm, useful_bc)
         mod = vm.get_mod(main_mod_id)
@@ -126,13 +189,66 @@ def entry_point(argv):
         sys_ex_class = ex_mod.get_defn(vm, "System_Exit_Exception")
         if vm.get_slot_apply(sys_ex_class, "instantiated", [e.ex_obj], allow_fail=True) is not None:
             code = Builtins.type_check_int(vm, e.ex_obj.get_slot(vm, "code"))
-            return int(code.v)
+            rtn = int(code.v)
         else:
             pb = vm.import_stdlib_mod(Stdlib_Modules.STDLIB_BACKTRACE).get_defn(vm, "print_best")
             vm.apply(pb, [e.ex_obj])
+            rtn = 1
+
+    if vm.profiler is not None:
+        # Either -p was specified, or the program started a profiler and didn't stop it.
+        _stop_profiler(vm_path, vm)
+    if Config.COUNTERS and vm.counters is not None:
+        os.write(2, vm.counters.summary())
+
+    return rtn
+
+
+def _stop_profiler(vm_path, vm):
+    prof = vm.profiler
+    assert prof is not None
+    vm.profiler = None
+    try:
+        prof.stop()
+        prof.write()
+    except OSError, e:
+        _error(vm_path, "Unable to write profile '%s': %s." % (prof.path, os.strerror(e.errno)))
+
+
+def _set_gc_env(vm_path, argv, gc_env):
+    # The GC reads its PYPY_GC_* environment variables when the VM starts up, before entry_point is
+    # called. If they don't already have the values requested on the command line, we set them and
+    # re-execute the VM (which will then find that they do have the right values).
+    changed = False
+    for name, val in gc_env:
+        if not _valid_gc_size(val):
+            _error(vm_path, "Invalid GC size '%s'." % val)
             return 1
-    
-    return 0
+        raw_cur = getenv(name)
+        if not raw_cur or rffi.charp2str(raw_cur) != val:
+            setenv(name, val, 1)
+            changed = True
+    if not changed:
+        return 0
+
+    try:
+        os.execv(vm_path, argv)
+    except OSError:
+        pass
+    _error(vm_path, "Couldn't execv VM to set GC parameters.")
+    return 1
+
+
+def _valid_gc_size(s):
+    # Returns True if s is a size in the format the GC accepts: a number, optionally followed by
+    # K, M or G, and optionally by B (all case insensitive), e.g. "4MB" or "1.5g".
+    i = 0
+    while i < len(s) and (s[i].isdigit() or s[i] == "."):
+        i += 1
+    if i == 0:
+        return False
+    suffix = s[i:].upper()
+    return suffix in ["", "B", "K", "KB", "M", "MB", "G", "GB"]
 
 
 def _get_vm_path(argv):
@@ -361,17 +477,20 @@ def _warning(vm_path, msg):
 
 
 def _usage(vm_path):
-    print "Usage: %s [-vf] [source file | executable file]" % _leafname(vm_path)
+    print "Usage: %s [-vf] [-p profile file] [--stats] [--jit param=value,...]" \
+      " [--gc-nursery=size] [--gc-max-heap=size] [source file | executable file]" \
+      % _leafname(vm_path)
 
 
 def target(driver, args):
     VM.global_vm.pypy_config = driver.config
+    JIT_Stats.HAVE_JIT = driver.config.translation.jit
     return entry_point, None
 
 
 def jitpolicy(driver):
     from rpython.jit.codewriter.policy import JitPolicy
-    return JitPolicy()
+    return JitPolicy(JIT_Stats.jit_hooks_iface)
 
 if __name__ == "__main__":
     entry_point(sys.argv)
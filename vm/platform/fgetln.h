@@ -1,2 +0,0 @@
-static void removeCR(char *);
-char *fgetln(FILE *, size_t *);
\ No newline at end of file